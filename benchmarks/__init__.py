@@ -0,0 +1,8 @@
+"""
+Package: benchmarks
+Stand-alone performance benchmarks for the Promotions service
+
+Each module is run from the repository root with ``python -m benchmarks.<name>``.
+They TRUNCATE the promotion table of the database named by BENCH_DATABASE_URI,
+so never point them at a database that holds data you care about.
+"""
@@ -0,0 +1,99 @@
+"""
+Benchmark: evaluating cart lines one by one versus over a NumPy snapshot
+
+Usage:
+    python -m benchmarks.batch_evaluate [LINES ...]
+
+Loads 10^5 synthetic promotions, takes a PromotionSnapshot of the active
+ones and evaluates LINES random cart lines (default 10^4, 10^5 and 10^6)
+dated on one day, with rules.evaluate over the promotions in effect that day
+and with PromotionSnapshot.evaluate. Both must give exactly the same
+discounts. The time to take the snapshot once is reported separately.
+"""
+import sys
+import time
+import random
+from datetime import date
+
+import numpy as np
+from service import rules
+from service.batch import PromotionSnapshot
+from service.models import Promotion, db
+from benchmarks.common import (
+    get_app,
+    get_engine,
+    reset_table,
+    load_rows,
+    timed,
+    print_table,
+)
+
+ROWS = 10**5
+DEFAULT_LINES = [10**4, 10**5, 10**6]
+ON_DATE = date(2023, 6, 1)
+
+
+def in_effect(on_date: date) -> dict:
+    """Returns the active promotions in effect on a date by product, as rules.evaluate takes them"""
+    by_product = {}
+    query = Promotion.find_by_active_on(on_date).filter(Promotion.status.is_(True))
+    for promotion in query.with_entities(Promotion.id, Promotion.product_id, Promotion.promotion_type, Promotion.rule):
+        by_product.setdefault(promotion.product_id, []).append(
+            {"id": promotion.id, "promotion_type": promotion.promotion_type.name, "rule": promotion.rule}
+        )
+    return by_product
+
+
+def random_lines(count: int) -> list:
+    """Returns count random cart lines of the loaded products"""
+    generator = random.Random(42)
+    return [
+        rules.CartLine(generator.randrange(20000), generator.randrange(1, 10), generator.randrange(1, 10000) / 100)
+        for _ in range(count)
+    ]
+
+
+def run(snapshot: PromotionSnapshot, promotions: dict, count: int) -> tuple:
+    """Returns the lines per second of the scalar and the batch evaluation"""
+    lines = random_lines(count)
+    # batches arrive as columns, e.g. read from a file
+    columns = (
+        np.array([line.product_id for line in lines]),
+        np.array([line.quantity for line in lines]),
+        np.array([line.unit_price for line in lines]),
+    )
+    expected = rules.evaluate(lines, promotions)
+    positions, ids, discounts = snapshot.evaluate(*columns, ON_DATE)
+    if list(zip(positions.tolist(), ids.tolist(), discounts.tolist())) != [
+        (item["line"], item["promotion_id"], item["discount"]) for item in expected
+    ]:
+        raise AssertionError(f"The batch evaluation disagrees with the scalar one for {count} lines")
+    scalar_ms = timed(lambda: rules.evaluate(lines, promotions), repeat=3)
+    batch_ms = timed(lambda: snapshot.evaluate(*columns, ON_DATE), repeat=3)
+    return count * 1000 / scalar_ms, count * 1000 / batch_ms
+
+
+def main(sizes):
+    """Runs the benchmark for each number of cart lines"""
+    engine = get_engine()
+    results = []
+    with get_app().app_context():
+        print(f"Loading {ROWS:,} rows...", file=sys.stderr)
+        reset_table(engine)
+        load_rows(engine, ROWS)
+        start = time.perf_counter()
+        snapshot = PromotionSnapshot.load()
+        snapshot_ms = (time.perf_counter() - start) * 1000
+        promotions = in_effect(ON_DATE)
+        # release the locks of the session so the next TRUNCATE can run
+        db.session.remove()
+        for count in sizes:
+            print(f"Evaluating {count:,} lines...", file=sys.stderr)
+            scalar, batch = run(snapshot, promotions, count)
+            results.append((f"{count:,}", f"{scalar:,.0f}", f"{batch:,.0f}", f"{batch / scalar:.0f}x"))
+    print(f"snapshot of {len(snapshot):,} promotions taken in {snapshot_ms:.0f} ms")
+    print_table(["lines", "scalar lines/s", "batch lines/s", "speedup"], results)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_LINES)
@@ -0,0 +1,60 @@
+"""
+Benchmark: one POST per Promotion versus one POST /api/promotions/bulk
+
+Usage:
+    python -m benchmarks.bulk_create [COUNT ...]
+
+Creates COUNT promotions (default 1,000 and 10,000) through the service
+both ways with the Flask test client and prints the throughput of each.
+"""
+import sys
+import time
+
+from tests.factories import PromotionFactory
+from benchmarks.common import get_app, get_engine, reset_table, print_table
+
+DEFAULT_COUNTS = [1000, 10000]
+
+
+def one_by_one(client, payload):
+    """Creates every Promotion with its own request"""
+    for item in payload:
+        response = client.post("/api/promotions", json=item)
+        assert response.status_code == 201, response.get_json()
+
+
+def in_bulk(client, payload):
+    """Creates every Promotion with a single bulk request"""
+    response = client.post("/api/promotions/bulk", json=payload)
+    assert response.status_code == 201, response.get_json()
+
+
+def main(counts):
+    """Runs the benchmark for each count"""
+    app = get_app()
+    engine = get_engine()
+    client = app.test_client()
+    rows = []
+    for count in counts:
+        payload = [promotion.serialize() for promotion in PromotionFactory.create_batch(count)]
+        timings = {}
+        for label, function in [("one by one", one_by_one), ("bulk", in_bulk)]:
+            reset_table(engine)
+            start = time.perf_counter()
+            function(client, payload)
+            timings[label] = time.perf_counter() - start
+        for label, seconds in timings.items():
+            rows.append(
+                (
+                    f"{count:,}",
+                    label,
+                    f"{seconds:.2f}",
+                    f"{count / seconds:,.0f}",
+                    f"{timings['one by one'] / seconds:.1f}x",
+                )
+            )
+    print_table(["promotions", "path", "seconds", "rows/s", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_COUNTS)
@@ -0,0 +1,89 @@
+"""
+Benchmark: effective Promotions of a product from SQL versus the interval index
+
+Usage:
+    python -m benchmarks.effective [ROWS ...]
+
+Loads ROWS synthetic promotions (default 10^5 and 10^6) and times finding the
+ids of the active promotions of a product in effect on a date, with a SQL
+query that uses the (product_id, status) index and with the in-process
+interval index behind Promotion.find_effective. The time to build the index
+once is reported separately.
+"""
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import func
+from service.models import Promotion, db
+from service.common.intervals import IntervalIndex
+from benchmarks.common import (
+    get_app,
+    get_engine,
+    reset_table,
+    load_rows,
+    timed,
+    print_table,
+)
+
+DEFAULT_SIZES = [10**5, 10**6]
+LOOKUPS = [(product_id, date(2023, 6, 1)) for product_id in range(0, 20000, 97)]
+
+
+def sql_ids(product_id: int, on_date: date) -> list:
+    """Finds the effective ids of a product with a SQL query"""
+    end_date = Promotion.start_date + func.make_interval(0, 0, 0, Promotion.duration)
+    rows = db.session.query(Promotion.id).filter(
+        Promotion.product_id == product_id,
+        Promotion.status.is_(True),
+        Promotion.start_date <= on_date,
+        end_date > on_date,
+    )
+    return sorted(row.id for row in rows)
+
+
+def build_index() -> tuple:
+    """Returns a loaded interval index and how long loading it took in milliseconds"""
+    index = IntervalIndex()
+    start = time.perf_counter()
+    index.find(0, date(2023, 6, 1), Promotion._effective_rows)  # pylint: disable=protected-access
+    return index, (time.perf_counter() - start) * 1000
+
+
+def run(engine, size: int) -> tuple:
+    """Returns the build time and the time per lookup of SQL and the index"""
+    reset_table(engine)
+    load_rows(engine, size)
+    index, build_ms = build_index()
+    for product_id, on_date in LOOKUPS:
+        if sorted(index.find(product_id, on_date, None)) != sql_ids(product_id, on_date):
+            raise AssertionError(f"The index disagrees with SQL for product {product_id}")
+    sql_ms = timed(lambda: [sql_ids(*lookup) for lookup in LOOKUPS], repeat=3)
+    index_ms = timed(lambda: [index.find(*lookup, None) for lookup in LOOKUPS], repeat=3)
+    # release the locks of the session so the next TRUNCATE can run
+    db.session.remove()
+    return build_ms, sql_ms / len(LOOKUPS), index_ms / len(LOOKUPS)
+
+
+def main(sizes):
+    """Runs the benchmark for each table size"""
+    engine = get_engine()
+    results = []
+    with get_app().app_context():
+        for size in sizes:
+            print(f"Loading {size:,} rows...", file=sys.stderr)
+            build_ms, sql_ms, index_ms = run(engine, size)
+            results.append(
+                (
+                    f"{size:,}",
+                    f"{build_ms:.0f}",
+                    f"{sql_ms:.3f}",
+                    f"{index_ms:.4f}",
+                    f"{sql_ms / index_ms:.0f}x",
+                )
+            )
+    print_table(["rows", "index build ms", "sql ms/lookup", "index ms/lookup", "speedup"], results)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,84 @@
+"""
+Benchmark: query time of the list filters with and without indexes
+
+Usage:
+    python -m benchmarks.indexes [ROWS ...]
+
+Loads ROWS synthetic promotions (default 10^5, 10^6 and 10^7), times every
+filter used by GET /api/promotions with the indexes dropped and again after
+they are created the same way ``flask db-upgrade`` does, and prints the
+median query time of each.
+"""
+import sys
+from datetime import date
+
+from sqlalchemy import select
+from service.models import Promotion, PromotionType
+from benchmarks.common import (
+    get_engine,
+    reset_table,
+    load_rows,
+    analyze,
+    timed,
+    print_table,
+)
+
+DEFAULT_SIZES = [10**5, 10**6, 10**7]
+
+QUERIES = {
+    "product_id": Promotion.product_id == 4242,
+    "product_id+status": (Promotion.product_id == 4242) & (Promotion.status.is_(True)),
+    "status+start_date": (Promotion.status.is_(False))
+    & (Promotion.start_date == date(2023, 6, 1)),
+    "start_date": Promotion.start_date == date(2023, 6, 1),
+    "promotion_type": Promotion.promotion_type == PromotionType.UNKNOWN,
+    "name": Promotion.name == "promo-4242",
+    "active_on": (Promotion.end_date > date(2025, 3, 31))
+    & (Promotion.start_date <= date(2025, 3, 31)),
+}
+
+
+def run_queries(engine) -> dict:
+    """Returns the median time of each query in milliseconds"""
+    results = {}
+    with engine.connect() as conn:
+        for label, criteria in QUERIES.items():
+            statement = select(Promotion.__table__).where(criteria)
+            results[label] = timed(lambda s=statement: conn.execute(s).fetchall())
+    return results
+
+
+def main(sizes):
+    """Runs the benchmark for each table size"""
+    engine = get_engine()
+    indexes = Promotion.__table__.indexes
+    rows = []
+    for size in sizes:
+        print(f"Loading {size:,} rows...", file=sys.stderr)
+        reset_table(engine)
+        for index in indexes:
+            index.drop(bind=engine, checkfirst=True)
+        load_rows(engine, size)
+        before = run_queries(engine)
+
+        for index in indexes:
+            index.create(bind=engine, checkfirst=True)
+        analyze(engine)
+        after = run_queries(engine)
+
+        for label in QUERIES:
+            speedup = before[label] / after[label] if after[label] else float("inf")
+            rows.append(
+                (
+                    f"{size:,}",
+                    label,
+                    f"{before[label]:.2f}",
+                    f"{after[label]:.2f}",
+                    f"{speedup:.1f}x",
+                )
+            )
+    print_table(["rows", "filter", "no index ms", "indexed ms", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
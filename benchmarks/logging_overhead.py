@@ -0,0 +1,118 @@
+"""
+Benchmark: cost of logging per request, synchronous versus queued
+
+Usage:
+    python -m benchmarks.logging_overhead [REQUESTS]
+
+Reads one cached promotion REQUESTS times (default 5,000) with the test
+client and reports the time per request with logging off, with the text
+records written by the request thread as before, and with the JSON records
+queued for the listener thread, keeping all of the info records or one in
+ten. The records go to a file, then to a sink that takes SLOW_WRITE seconds
+per record like a pipe whose reader lags behind. Only the time of the
+request threads counts, which is what a client waits for; the listener
+writes in the background, though it still takes turns with them for the GIL.
+"""
+import os
+import sys
+import logging
+import tempfile
+import time
+
+from service.models import db
+from service.common.log_handlers import MODULE_LOGGER, DATE_FORMAT, init_logging
+from tests.factories import PromotionFactory
+from benchmarks.common import get_app, get_engine, reset_table, timed, print_table
+
+DEFAULT_REQUESTS = 5000
+SINK = "benchmarks.logging_overhead"
+SLOW_WRITE = 0.0002
+
+
+class SlowFileHandler(logging.FileHandler):
+    """Writes to a file after waiting SLOW_WRITE seconds for every record"""
+
+    def emit(self, record):
+        time.sleep(SLOW_WRITE)
+        super().emit(record)
+
+
+def log_nothing(app, _path, _handler_class):
+    """Turns logging off"""
+    for logger in (app.logger, logging.getLogger(MODULE_LOGGER)):
+        logger.handlers = []
+        logger.filters = []
+        logger.setLevel(logging.CRITICAL)
+
+
+def log_synchronously(app, path, handler_class):
+    """Writes text records from the request thread, the way init_logging used to"""
+    handler = handler_class(path)
+    handler.setFormatter(logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", DATE_FORMAT))
+    for logger in (app.logger, logging.getLogger(MODULE_LOGGER)):
+        logger.propagate = False
+        logger.handlers = [handler]
+        logger.filters = []
+        logger.setLevel(logging.INFO)
+
+
+def log_queued(sample_rates):
+    """Returns a setup that queues JSON records for a listener writing them to a file"""
+
+    def setup(app, path, handler_class):
+        sink = logging.getLogger(SINK)
+        sink.handlers = [handler_class(path)]
+        sink.setLevel(logging.INFO)
+        return init_logging(app, SINK, sample_rates)
+
+    return setup
+
+
+MODES = [
+    ("off", log_nothing),
+    ("synchronous text", log_synchronously),
+    ("queued json", log_queued(None)),
+    ("queued json, 10% info", log_queued({logging.INFO: 0.1})),
+]
+
+
+SINKS = [("file", logging.FileHandler), ("slow", SlowFileHandler)]
+
+
+def run(app, setup, handler_class, url: str, requests: int) -> tuple:
+    """Returns the microseconds per request and the lines logged with one logging setup"""
+    client = app.test_client()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "service.log")
+        listener = setup(app, path, handler_class)
+        milliseconds = timed(lambda: [client.get(url) for _ in range(requests)], repeat=3)
+        if listener is not None:
+            listener.stop()
+        lines = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                lines = sum(1 for _ in file)
+    return milliseconds * 1000 / requests, lines
+
+
+def main(requests: int):
+    """Runs the benchmark for each logging setup"""
+    app = get_app()
+    reset_table(get_engine())
+    results = []
+    with app.app_context():
+        promotion = PromotionFactory()
+        promotion.create()
+        url = f"/api/promotions/{promotion.id}"
+        off_us, _ = run(app, log_nothing, None, url, requests)
+        results.append(("-", "off", f"{off_us:.1f}", "+0.0", "0"))
+        for sink, handler_class in SINKS:
+            for name, setup in MODES[1:]:
+                per_request_us, lines = run(app, setup, handler_class, url, requests)
+                results.append((sink, name, f"{per_request_us:.1f}", f"{per_request_us - off_us:+.1f}", f"{lines:,}"))
+        db.session.remove()
+    print_table(["sink", "logging", "us/request", "vs off", "lines written"], results)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUESTS)
@@ -0,0 +1,67 @@
+"""
+Benchmark: ORM plus marshalling versus the row tuple read path
+
+Usage:
+    python -m benchmarks.read_path [ROWS ...]
+
+Loads ROWS synthetic promotions (default 10,000 and 100,000) and times how
+long it takes to build the response body of an unfiltered
+GET /api/promotions both ways, after checking that the two bodies are byte
+for byte identical.
+"""
+import sys
+import json
+
+from flask_restx import marshal
+from service.models import Promotion, db
+from benchmarks.common import (
+    get_app,
+    get_engine,
+    reset_table,
+    load_rows,
+    timed,
+    print_table,
+)
+
+DEFAULT_SIZES = [10_000, 100_000]
+
+
+def orm_path() -> str:
+    """Builds the body from Promotion instances marshalled with promotion_model"""
+    from service.routes import promotion_model  # pylint: disable=import-outside-toplevel
+
+    promotions = Promotion.query.order_by(Promotion.id)
+    return json.dumps(marshal([promotion.serialize() for promotion in promotions], promotion_model))
+
+
+def row_path() -> str:
+    """Builds the body from row tuples the way the list endpoint does"""
+    from service.routes import present  # pylint: disable=import-outside-toplevel
+
+    rows = Promotion.serialize_rows(Promotion.query.order_by(Promotion.id))
+    return json.dumps([present(row) for row in rows])
+
+
+def main(sizes):
+    """Runs the benchmark for each table size"""
+    app = get_app()
+    engine = get_engine()
+    rows = []
+    with app.app_context():
+        for size in sizes:
+            reset_table(engine)
+            load_rows(engine, size)
+            if orm_path() != row_path():
+                raise AssertionError("The two read paths returned different bodies")
+            orm_ms = timed(orm_path, repeat=3)
+            row_ms = timed(row_path, repeat=3)
+            # release the locks of the session so the next TRUNCATE can run
+            db.session.remove()
+            rows.append(
+                (f"{size:,}", f"{orm_ms:.0f}", f"{row_ms:.0f}", f"{orm_ms / row_ms:.1f}x")
+            )
+    print_table(["rows", "orm + marshal ms", "row tuples ms", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -21,7 +21,8 @@ and SQL database
 import sys
 from flask import Flask
 from flask_restx import Api
-from service.common import log_handlers
+from service.common import log_handlers, metrics, profiling
+from service.common.admin import is_admin
 from service import config
 
 
@@ -40,9 +41,41 @@ def create_app():
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
-    from service.models import db
+    from service.models import (
+        db,
+        promotion_cache,
+        result_cache,
+        effective_index,
+        product_filter,
+        query_timer,
+    )
 
     db.init_app(app)
+    promotion_cache.configure(
+        app.config["PROMOTION_CACHE_SIZE"], app.config["PROMOTION_CACHE_TTL"]
+    )
+    result_cache.configure(
+        app.config["RESULT_CACHE_SIZE"], app.config["RESULT_CACHE_TTL"]
+    )
+    effective_index.configure(app.config["EFFECTIVE_INDEX_TTL"])
+    product_filter.configure(
+        app.config["PRODUCT_FILTER_ERROR_RATE"], app.config["PRODUCT_FILTER_TTL"]
+    )
+    query_timer.configure(app.config["SLOW_QUERY_THRESHOLD"])
+    with app.app_context():
+        query_timer.instrument(db.engine)
+    metrics.registry.configure(
+        app.config["METRICS_DIR"], app.config["METRICS_FLUSH_INTERVAL"]
+    )
+    metrics.init_metrics(app, metrics.registry)
+    profiling.sampling_profiler.configure(
+        app.config["SAMPLING_PROFILER_INTERVAL"], app.config["SAMPLING_PROFILER_MAX_STACKS"]
+    )
+    app.wsgi_app = profiling.RequestProfiler(
+        app.wsgi_app,
+        lambda environ: app.config["PROFILE_REQUESTS"]
+        and is_admin(environ.get("HTTP_X_ADMIN_TOKEN"), app.config["ADMIN_TOKEN"]),
+    )
 
     ######################################################################
     # Configure Swagger before initializing it
@@ -73,7 +106,11 @@ def create_app():
             sys.exit(4)
 
         # Set up logging for production
-        log_handlers.init_logging(app, "gunicorn.error")
+        log_handlers.init_logging(
+            app,
+            "gunicorn.error",
+            log_handlers.parse_sample_rates(app.config["LOG_SAMPLE_RATES"]),
+        )
 
         app.logger.info(70 * "*")
         app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
@@ -0,0 +1,49 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Admin Access
+
+This module guards the operational endpoints that only the operators of
+the service may call with the ADMIN_TOKEN of the configuration.
+"""
+import hmac
+from functools import wraps
+
+from flask import current_app, jsonify, request
+from . import status
+
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def is_admin(token, expected: str) -> bool:
+    """Returns True when token is the expected admin token, which must be set"""
+    return bool(expected) and token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def admin_only(view):
+    """Answers 403 Forbidden unless the request sends the admin token"""
+
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        if not is_admin(request.headers.get(ADMIN_TOKEN_HEADER), current_app.config["ADMIN_TOKEN"]):
+            return (
+                jsonify(status=status.HTTP_403_FORBIDDEN, message="This endpoint needs the admin token"),
+                status.HTTP_403_FORBIDDEN,
+            )
+        return view(*args, **kwargs)
+
+    return guarded
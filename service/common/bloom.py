@@ -0,0 +1,251 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Bloom Filters
+
+This module contains a counting Bloom filter that answers whether a key
+was definitely never added, and an in-process filter of keys that is
+rebuilt from the rows it was loaded from.
+"""
+import math
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger("flask.app")
+
+# A counter that reaches this value is never decremented again, since it
+# no longer knows how many keys share it
+SATURATED = 255
+
+
+class CountingBloomFilter:
+    """A Bloom filter with a small counter per slot so keys can be removed
+
+    It never answers that a key that was added is missing. It may answer
+    that a key that was never added is there with about the error rate
+    while it holds at most capacity keys.
+
+    Args:
+        capacity (int): the number of distinct keys it is sized for
+        error_rate (float): the false positive rate at capacity
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.capacity = capacity
+        self._counters = bytearray(self.size)
+        self._filled = 0
+
+    def add(self, key, count: int = 1):
+        """Adds count occurrences of key"""
+        for slot in self._slots(key):
+            value = self._counters[slot]
+            if value == 0:
+                self._filled += 1
+            self._counters[slot] = min(value + count, SATURATED)
+
+    def remove(self, key, count: int = 1):
+        """Removes count occurrences of a key that was added"""
+        for slot in self._slots(key):
+            value = self._counters[slot]
+            if 0 < value < SATURATED:
+                value = max(value - count, 0)
+                self._counters[slot] = value
+                if value == 0:
+                    self._filled -= 1
+
+    def __contains__(self, key) -> bool:
+        return all(self._counters[slot] for slot in self._slots(key))
+
+    def false_positive_rate(self) -> float:
+        """Returns the chance that a key that was never added is found
+
+        It is the chance that all the slots of a new key are in use, from
+        the fraction of the slots in use now.
+        """
+        return (self._filled / self.size) ** self.hashes
+
+    def _slots(self, key):
+        """Returns the slots of a key with double hashing"""
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+
+class KeyFilter:
+    """A counting Bloom filter of the keys of a table's rows
+
+    The filter is built on the first lookup with a load function that
+    returns (key, count) pairs, sized to hold twice the keys it was built
+    with. Writes add and remove their keys as they happen. Once the time to
+    live has passed, or as soon as it is so full that its false positive
+    rate is twice the one it was sized for, it is rebuilt in a thread of its
+    own to pick up the writes made by other processes, while the lookups
+    keep answering from the filter built before. Until then, like a cache,
+    it may answer that a key another process added is missing. The load
+    function must work from that thread too.
+
+    Args:
+        error_rate (float): the false positive rate the filter is sized for
+        ttl (float): the seconds before the filter is rebuilt
+        clock: returns the current time in seconds, time.monotonic by default
+        spawn: calls a function in the background, in a new thread by default
+    """
+
+    def __init__(self, error_rate: float = 0.01, ttl: float = 60.0, clock=time.monotonic, spawn=None):
+        self.error_rate = error_rate
+        self.ttl = ttl
+        self.lookups = 0
+        self.negatives = 0
+        self._clock = clock
+        self._spawn = spawn or _in_thread
+        self._filter = None  # None until loaded
+        self._expires = 0.0
+        self._generation = 0  # bumped whenever the filter is built or dropped
+        self._reloading = None  # the keys added since the rebuild in the background started
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """The generation of the filter, which a write reads before it removes rows"""
+        with self._lock:
+            return self._generation
+
+    def configure(self, error_rate: float, ttl: float):
+        """Changes the error rate and time to live and drops the filter"""
+        with self._lock:
+            self.error_rate = error_rate
+            self.ttl = ttl
+            self._drop()
+
+    def invalidate(self):
+        """Rebuilds the filter on the next lookup"""
+        with self._lock:
+            self._drop()
+
+    def add(self, keys):
+        """Adds a row of each of the keys"""
+        keys = list(keys)
+        with self._lock:
+            if self._filter is None:
+                return
+            for key in keys:
+                self._filter.add(key)
+            if self._reloading is not None:
+                self._reloading.extend(keys)
+            if self._filter.false_positive_rate() > 2 * self.error_rate:
+                self._expires = 0.0
+
+    def remove(self, keys, generation: int):
+        """Removes a row of each of the keys, read from the database at a generation
+
+        A filter built since that generation may no longer count the rows, so
+        they are left in it, which only causes false positives.
+        """
+        with self._lock:
+            if self._filter is not None and generation == self._generation:
+                for key in keys:
+                    self._filter.remove(key)
+
+    def might_contain(self, key, load) -> bool:
+        """Returns False when no row has the key, and True when one might"""
+        with self._lock:
+            generation = self._refresh(load)
+            self.lookups += 1
+            found = key in self._filter
+            if not found:
+                self.negatives += 1
+        if generation is not None:
+            self._spawn(lambda: self._rebuild(load, generation))
+        return found
+
+    def false_positive_rate(self) -> float:
+        """Returns the estimated false positive rate, 0 until the filter is loaded"""
+        with self._lock:
+            return self._filter.false_positive_rate() if self._filter is not None else 0.0
+
+    def stats(self) -> dict:
+        """Returns the counters and the estimated false positive rate"""
+        with self._lock:
+            loaded = self._filter is not None
+            return {
+                "lookups": self.lookups,
+                "negatives": self.negatives,
+                "capacity": self._filter.capacity if loaded else 0,
+                "size": self._filter.size if loaded else 0,
+                "hashes": self._filter.hashes if loaded else 0,
+                "false_positive_rate": self._filter.false_positive_rate() if loaded else 0.0,
+                "error_rate": self.error_rate,
+                "ttl": self.ttl,
+            }
+
+    def _drop(self):
+        """Drops the filter, so that it is built again on the next lookup"""
+        self._filter = None
+        self._generation += 1
+        self._reloading = None
+
+    def _refresh(self, load):
+        """Builds the filter when there is none
+
+        Returns:
+            the generation to rebuild in the background once it has expired,
+            or None
+        """
+        if self._filter is None:
+            self._build(load())
+        if self._reloading is None and self._clock() >= self._expires:
+            self._reloading = []
+            return self._generation
+        return None
+
+    def _rebuild(self, load, generation: int):
+        """Rebuilds the filter and swaps it in unless it was dropped meanwhile"""
+        try:
+            counts = load()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not rebuild the key filter, retrying after the next lookup")
+            counts = None
+        with self._lock:
+            if generation != self._generation:
+                return
+            if counts is not None:
+                added = self._reloading
+                self._build(counts)
+                # the counts may have been read before the rows added since it started
+                for key in added:
+                    self._filter.add(key)
+            self._reloading = None
+
+    def _build(self, counts):
+        """Builds the filter from (key, count) pairs"""
+        counts = list(counts)
+        self._filter = CountingBloomFilter(max(2 * len(counts), 1024), self.error_rate)
+        for key, count in counts:
+            self._filter.add(key, count)
+        self._expires = self._clock() + self.ttl
+        self._generation += 1
+
+
+def _in_thread(function):
+    """Calls a function in a new daemon thread"""
+    threading.Thread(target=function, name="key-filter-rebuild", daemon=True).start()
@@ -16,7 +16,13 @@
 """
 Flask CLI Command Extensions
 """
+import csv
+from datetime import date
+
+import click
 from flask import current_app as app  # Import Flask application
+from sqlalchemy import CheckConstraint, inspect, text
+from sqlalchemy.schema import AddConstraint, CreateColumn
 from service.models import db
 
 
@@ -34,3 +40,94 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to bring an existing database up to the current schema
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    Creates any missing tables, columns, check constraints and indexes
+    without dropping data.
+
+    It does not avoid locks. Adding a generated column, such as end_date,
+    rewrites the whole table under an ACCESS EXCLUSIVE lock that blocks
+    every read and write until it is done, and creating an index blocks
+    the writes to its table while it is built. Run it in a maintenance
+    window on a large table. Check constraints are added NOT VALID, so only
+    the rows written afterwards are checked.
+    """
+    db.create_all()
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                if column.computed is not None:
+                    app.logger.warning(
+                        "Adding generated column %s.%s rewrites the table and locks it until done",
+                        table.name,
+                        column.name,
+                    )
+                else:
+                    app.logger.info("Adding column %s.%s", table.name, column.name)
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+        add_check_constraints(inspector, table)
+        db.session.commit()
+        for index in table.indexes:
+            app.logger.info("Ensuring index %s exists", index.name)
+            index.create(bind=db.engine, checkfirst=True)
+    db.session.commit()
+
+
+def add_check_constraints(inspector, table):
+    """Adds the check constraints of a table that the database does not have yet"""
+    existing = {constraint["name"] for constraint in inspector.get_check_constraints(table.name)}
+    for constraint in table.constraints:
+        if isinstance(constraint, CheckConstraint) and constraint.name not in existing:
+            app.logger.info("Adding constraint %s to %s", constraint.name, table.name)
+            ddl = AddConstraint(constraint).compile(dialect=db.engine.dialect)
+            # without scanning the rows that are already there
+            db.session.execute(text(f"{ddl} NOT VALID"))
+
+
+######################################################################
+# Command to evaluate the Promotions of many carts at once
+# Usage:
+#   flask evaluate-carts LINES.csv DISCOUNTS.csv
+######################################################################
+@app.cli.command("evaluate-carts")
+@click.argument("lines", type=click.File("r"))
+@click.argument("discounts", type=click.File("w"))
+def evaluate_carts(lines, discounts):
+    """
+    Evaluates the cart lines of LINES against the active Promotions in one batch.
+
+    LINES is a CSV file with the columns cart_id, product_id, quantity,
+    unit_price and an optional on_date, today by default. The discount of
+    every matching Promotion of every line is written to DISCOUNTS as CSV
+    with the columns cart_id, line, product_id, promotion_id and discount,
+    line being the position of the line in LINES.
+    """
+    # pylint: disable=import-outside-toplevel
+    from service.batch import PromotionSnapshot
+
+    rows = list(csv.DictReader(lines))
+    today = date.today().isoformat()
+    snapshot = PromotionSnapshot.load()
+    app.logger.info("Evaluating %d lines against %d Promotions", len(rows), len(snapshot))
+    positions, promotion_ids, amounts = snapshot.evaluate(
+        [int(row["product_id"]) for row in rows],
+        [int(row["quantity"]) for row in rows],
+        [float(row["unit_price"]) for row in rows],
+        [date.fromisoformat(row.get("on_date") or today).toordinal() for row in rows],
+    )
+    writer = csv.writer(discounts)
+    writer.writerow(["cart_id", "line", "product_id", "promotion_id", "discount"])
+    for position, promotion_id, amount in zip(positions.tolist(), promotion_ids.tolist(), amounts.tolist()):
+        row = rows[position]
+        writer.writerow([row["cart_id"], position, row["product_id"], promotion_id, amount])
@@ -19,7 +19,7 @@ Module: error_handlers
 # from flask import jsonify
 from flask import current_app as app  # Import Flask application
 from service import api
-from service.models import DataValidationError, DatabaseConnectionError
+from service.models import DataValidationError, DatabaseConnectionError, VersionConflictError
 from . import status
 
 
@@ -38,6 +38,18 @@ def request_validation_error(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
+@api.errorhandler(VersionConflictError)
+def version_conflict_error(error):
+    """Handles writes to a Promotion that was changed since it was read"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status_code": status.HTTP_412_PRECONDITION_FAILED,
+        "error": "Precondition Failed",
+        "message": message,
+    }, status.HTTP_412_PRECONDITION_FAILED
+
+
 @api.errorhandler(DatabaseConnectionError)
 def database_connection_error(error):
     """Handles Database Errors from connection attempts"""
@@ -0,0 +1,210 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Interval Indexes
+
+This module contains an interval tree that finds the half open [start, end)
+intervals containing a point in O(log n + k), and an in-process index that
+keeps one tree per key in sync with the rows it was loaded from.
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger("flask.app")
+
+
+class IntervalTree:
+    """A static centered interval tree of half open [start, end) intervals
+
+    Args:
+        intervals: an iterable of (start, end, value) tuples, the empty ones
+            where end <= start are ignored
+    """
+
+    def __init__(self, intervals):
+        intervals = [interval for interval in intervals if interval[0] < interval[1]]
+        self.center = None
+        self.left = None
+        self.right = None
+        self.by_start = []
+        self.by_end = []
+        if not intervals:
+            return
+        starts = sorted(interval[0] for interval in intervals)
+        self.center = starts[len(starts) // 2]
+        left = [interval for interval in intervals if interval[1] <= self.center]
+        right = [interval for interval in intervals if interval[0] > self.center]
+        # every interval left here contains the center
+        here = [
+            interval for interval in intervals
+            if interval[0] <= self.center < interval[1]
+        ]
+        self.by_start = sorted(here, key=lambda interval: interval[0])
+        self.by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def at(self, point) -> list:
+        """Returns the values of every interval that contains point"""
+        values = []
+        node = self
+        while node is not None and node.center is not None:
+            if point < node.center:
+                for start, _, value in node.by_start:
+                    if start > point:
+                        break
+                    values.append(value)
+                node = node.left
+            else:
+                for _, end, value in node.by_end:
+                    if end <= point:
+                        break
+                    values.append(value)
+                # the intervals left of the center end before it
+                node = node.right if point > node.center else None
+        return values
+
+
+class IntervalIndex:
+    """Intervals grouped by key with one IntervalTree per key
+
+    The rows are loaded on the first lookup with a load function that takes
+    a list of ids, or None for all of them, and returns (id, key, start, end)
+    tuples. Ids that are invalidated are reloaded on the next lookup and only
+    the trees of their keys are rebuilt. Once the time to live has passed,
+    everything is reloaded in a thread of its own to pick up the writes made
+    by other processes, while the lookups keep answering from the rows
+    loaded before, so a request never waits for a full reload it did not ask
+    for. The load function must work from that thread too.
+
+    Args:
+        ttl (float): the seconds before everything is reloaded
+        clock: returns the current time in seconds, time.monotonic by default
+        spawn: calls a function in the background, in a new thread by default
+    """
+
+    def __init__(self, ttl: float = 300.0, clock=time.monotonic, spawn=None):
+        self.ttl = ttl
+        self._clock = clock
+        self._spawn = spawn or _in_thread
+        self._keys = None  # key of every id, None until loaded
+        self._groups = {}  # key -> {id: (start, end)}
+        self._trees = {}  # key -> IntervalTree, built on the first lookup of a key
+        self._stale = set()
+        self._expires = 0.0
+        self._generation = 0  # bumped whenever everything is dropped
+        self._reloading = None  # the ids invalidated since the reload in the background started
+        self._lock = threading.Lock()
+
+    def configure(self, ttl: float):
+        """Changes the time to live and drops the index"""
+        with self._lock:
+            self.ttl = ttl
+            self._drop()
+
+    def invalidate(self, ids=None):
+        """Reloads the given ids on the next lookup, or everything for None"""
+        with self._lock:
+            if ids is None:
+                self._drop()
+            else:
+                self._stale.update(ids)
+                if self._reloading is not None:
+                    self._reloading.update(ids)
+
+    def find(self, key, point, load) -> list:
+        """Returns the ids of the key whose intervals contain point"""
+        with self._lock:
+            generation = self._refresh(load)
+            tree = self._trees.get(key)
+            if tree is None:
+                tree = IntervalTree(
+                    (start, end, by_id)
+                    for by_id, (start, end) in self._groups.get(key, {}).items()
+                )
+                self._trees[key] = tree
+            found = tree.at(point)
+        if generation is not None:
+            self._spawn(lambda: self._reload(load, generation))
+        return found
+
+    def _drop(self):
+        """Drops everything, so that it is loaded again on the next lookup"""
+        self._keys = None
+        self._generation += 1
+        self._reloading = None
+
+    def _refresh(self, load):
+        """Loads everything when needed, otherwise reloads the stale ids
+
+        Returns:
+            the generation to reload in the background once it has expired,
+            or None
+        """
+        if self._keys is None:
+            self._replace(load(None))
+            self._stale = set()
+        elif self._stale:
+            ids = list(self._stale)
+            self._stale = set()
+            for by_id in ids:
+                key = self._keys.pop(by_id, None)
+                if key is not None:
+                    del self._groups[key][by_id]
+                    self._trees.pop(key, None)
+            self._add(load(ids))
+        if self._reloading is None and self._clock() >= self._expires:
+            self._reloading = set()
+            return self._generation
+        return None
+
+    def _reload(self, load, generation: int):
+        """Reloads everything and swaps it in unless everything was dropped meanwhile"""
+        try:
+            rows = load(None)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not reload the interval index, retrying after the next lookup")
+            rows = None
+        with self._lock:
+            if generation != self._generation:
+                return
+            if rows is not None:
+                # the rows may have been read before the writes made since it started
+                self._stale.update(self._reloading)
+                self._replace(rows)
+            self._reloading = None
+
+    def _replace(self, rows):
+        """Replaces everything with (id, key, start, end) rows"""
+        self._keys = {}
+        self._groups = {}
+        self._trees = {}
+        self._add(rows)
+        self._expires = self._clock() + self.ttl
+
+    def _add(self, rows):
+        """Adds (id, key, start, end) rows and drops the trees of their keys"""
+        for by_id, key, start, end in rows:
+            self._keys[by_id] = key
+            self._groups.setdefault(key, {})[by_id] = (start, end)
+            self._trees.pop(key, None)
+
+
+def _in_thread(function):
+    """Calls a function in a new daemon thread"""
+    threading.Thread(target=function, name="interval-index-reload", daemon=True).start()
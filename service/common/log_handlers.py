@@ -19,18 +19,165 @@ Log Handlers
 
 This module contains utility functions to set up logging
 consistently
+
+The request threads only put their records on a queue. A listener thread
+formats them as JSON lines and writes them through the gunicorn handlers,
+so a slow disk or pipe never holds a request up. Since the listener is a
+thread, it has to be started in each worker, which is why gunicorn must
+not --preload the app.
 """
+import json
+import time
+import queue
+import atexit
+import random
 import logging
+from logging.handlers import QueueHandler, QueueListener
+
+# The logger that the modules outside of the routes log to
+MODULE_LOGGER = "flask.app"
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line"""
+
+    def __init__(self, datefmt: str = DATE_FORMAT):
+        super().__init__(datefmt=datefmt)
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+    """Puts records on a queue with their message and traceback as text
+
+    Unlike QueueHandler it neither formats nor copies the record, which
+    takes as long as creating it, and leaves the formatting to the handlers
+    of the listener. It only merges the arguments into the message, because
+    they may change once the call that logged them returns, and replaces the
+    traceback object, which keeps every frame of the stack alive, with its
+    text. Any other handler of the record formats it the same way.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _TRACEBACKS.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_TRACEBACKS = logging.Formatter()
+
+
+class RecordQueueListener(QueueListener):
+    """QueueListener that writes the records in batches
+
+    The QueueListener thread wakes up for every record, and each wake up
+    takes the GIL from a request thread. This one wakes up every interval
+    seconds instead and writes all the records queued since, so putting a
+    record on the queue never wakes it. It may be stopped more than once.
+
+    Args:
+        records: the queue of the records
+        handlers: the handlers that write them
+        interval (float): the seconds between two batches
+    """
+
+    def __init__(self, records, *handlers, interval: float = 0.05):
+        super().__init__(records, *handlers, respect_handler_level=True)
+        self.interval = interval
+
+    def stop(self):
+        """Writes the records left on the queue and stops the thread unless it is stopped"""
+        if self._thread is not None:
+            super().stop()
+
+    def _monitor(self):
+        """Writes the records queued every interval until the sentinel that stop queues"""
+        while True:
+            time.sleep(self.interval)
+            while True:
+                try:
+                    record = self.dequeue(False)
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    return
+                self.handle(record)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random share of the records of some levels and all the others
+
+    Args:
+        rates (dict): the share from 0 to 1 of the records kept by level number
+        sample: returns a random number from 0 to 1, random.random by default
+    """
+
+    def __init__(self, rates: dict, sample=random.random):
+        super().__init__()
+        self.rates = rates
+        self.sample = sample
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno)
+        return rate is None or self.sample() < rate
+
+
+def parse_sample_rates(text: str) -> dict:
+    """Parses "INFO=0.1,DEBUG=0.01" into the share of the records kept by level number"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, rate = item.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int) or not 0 <= float(rate) <= 1:
+            raise ValueError(f"Invalid log sample rate: {item}")
+        rates[level] = float(rate)
+    return rates
+
 
+def init_logging(app, logger_name: str, sample_rates: dict = None) -> RecordQueueListener:
+    """Set up logging for production
 
-def init_logging(app, logger_name: str):
-    """Set up logging for production"""
-    app.logger.propagate = False
+    The app logger and the logger of the other modules put their records on
+    a queue, sampled by level with sample_rates, and the returned listener
+    writes them as JSON through the handlers of the logger_name logger, or
+    to stderr when it has none. The listener is stopped, after it has
+    written every record left, when the process exits.
+    """
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
+    handlers = gunicorn_logger.handlers or [logging.StreamHandler()]
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    formatter = JsonFormatter()
+    for handler in handlers:
         handler.setFormatter(formatter)
+    records = queue.SimpleQueue()
+    queue_handler = RecordQueueHandler(records)
+    for logger in (app.logger, logging.getLogger(MODULE_LOGGER)):
+        logger.propagate = False
+        logger.handlers = [queue_handler]
+        logger.setLevel(gunicorn_logger.level)
+        for old_filter in [item for item in logger.filters if isinstance(item, SamplingFilter)]:
+            logger.removeFilter(old_filter)
+        if sample_rates:
+            logger.addFilter(SamplingFilter(sample_rates))
+    listener = RecordQueueListener(records, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
     app.logger.info("Logging handler established")
+    return listener
@@ -0,0 +1,127 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Memory Diagnostics
+
+This module contains a tracer that diffs tracemalloc snapshots of a live
+worker to find the sites that allocate the most, and a helper that
+measures the peak memory a function allocates.
+"""
+import threading
+import tracemalloc
+
+# Allocations made by tracemalloc and the import machinery are never ours
+IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class MemoryTracer:
+    """Takes tracemalloc snapshots and diffs each one with the one before
+
+    Tracing slows every allocation down, so it only runs between start and
+    stop. The first snapshot after start is diffed with an empty one.
+    """
+
+    def __init__(self):
+        self._previous = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        """Returns True while allocations are traced"""
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        """Starts tracing allocations with up to frames frames of their stacks"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._previous = None
+
+    def stop(self):
+        """Stops tracing and frees the traces and the last snapshot"""
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+
+    def snapshot(self, limit: int = 20, key_type: str = "lineno") -> dict:
+        """Takes a snapshot and returns the sites that grew the most since the last one
+
+        Args:
+            limit (int): the most sites returned
+            key_type (string): "lineno", "filename" or "traceback", how the
+                allocations are grouped into sites
+
+        Returns:
+            the current and peak traced bytes and the top sites, or None
+            when allocations are not traced
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return None
+            snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED)
+            current, peak = tracemalloc.get_traced_memory()
+            previous = self._previous or tracemalloc.Snapshot([], snapshot.traceback_limit)
+            self._previous = snapshot
+        top = snapshot.compare_to(previous, key_type)[:limit]
+        return {
+            "current": current,
+            "peak": peak,
+            "top": [
+                {
+                    "site": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size": stat.size,
+                    "size_diff": stat.size_diff,
+                    "count": stat.count,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in top
+            ],
+        }
+
+    def stats(self) -> dict:
+        """Returns whether allocations are traced and the traced bytes"""
+        current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": self.tracing, "current": current, "peak": peak}
+
+
+# The memory tracer of this worker
+memory_tracer = MemoryTracer()
+
+
+def peak_allocated(function, *args, **kwargs):
+    """Calls a function and returns its result and the most bytes it had allocated at once
+
+    The peak is measured from the memory in use when it was called, so it
+    does not depend on what was allocated before. Allocations that another
+    thread makes at the same time are counted too.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        result = function(*args, **kwargs)
+        return result, tracemalloc.get_traced_memory()[1] - start
+    finally:
+        if not tracing:
+            tracemalloc.stop()
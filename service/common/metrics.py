@@ -0,0 +1,283 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Metrics
+
+This module contains a registry of counters, gauges and histograms that
+renders them in the Prometheus text format, and the request hooks that
+record the rate, latency, status codes and database time of every route.
+
+Each gunicorn worker records its own metrics in memory. When a directory
+is configured, every worker also writes them to a file of its own at most
+once per flush interval, and the registry sums the files of all the
+workers when it renders them, so any worker can answer a scrape.
+"""
+import os
+import json
+import glob
+import time
+import threading
+from bisect import bisect_left
+
+from flask import g, request
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS = "promotion_http_requests_total"
+REQUEST_DURATION = "promotion_http_request_duration_seconds"
+IN_FLIGHT = "promotion_http_requests_in_flight"
+DB_DURATION = "promotion_db_duration_seconds"
+DB_STATEMENTS = "promotion_db_statements_total"
+PRODUCT_FILTER_LOOKUPS = "promotion_product_filter_lookups_total"
+PRODUCT_FILTER_NEGATIVES = "promotion_product_filter_negatives_total"
+PRODUCT_FILTER_FALSE_POSITIVE_RATE = "promotion_product_filter_false_positive_rate"
+
+# The kind and help text of every metric
+FAMILIES = {
+    REQUESTS: ("counter", "Requests answered by endpoint, method and status code"),
+    REQUEST_DURATION: ("histogram", "Seconds spent answering requests by endpoint and method"),
+    IN_FLIGHT: ("gauge", "Requests being answered by endpoint and method"),
+    DB_DURATION: ("histogram", "Seconds spent in database statements per request by endpoint and method"),
+    DB_STATEMENTS: ("counter", "Database statements run by endpoint and method"),
+    PRODUCT_FILTER_LOOKUPS: ("counter", "Products looked up in the product filter"),
+    PRODUCT_FILTER_NEGATIVES: ("counter", "Products the product filter answered without a query"),
+    PRODUCT_FILTER_FALSE_POSITIVE_RATE: ("gauge", "Estimated false positive rate of the product filter by worker"),
+}
+
+CONTENT_TYPE_PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsRegistry:
+    """Thread safe counters, gauges and histograms of one process
+
+    Samples are keyed by the name of their metric and a tuple of (label,
+    value) pairs. Recording one only takes a lock and a dictionary update.
+
+    Args:
+        families (dict): the (kind, help) of every metric by name
+        buckets (tuple): the upper bounds of the histogram buckets
+        clock: returns the current time in seconds, time.monotonic by default
+    """
+
+    def __init__(self, families: dict = None, buckets: tuple = BUCKETS, clock=time.monotonic):
+        self.families = FAMILIES if families is None else families
+        self.buckets = buckets
+        self.directory = None  # None records this process only
+        self.flush_interval = 1.0
+        self._clock = clock
+        self._samples = {}
+        self._next_flush = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, directory: str, flush_interval: float):
+        """Changes the directory shared by the workers and how often they write to it"""
+        with self._lock:
+            self.directory = directory or None
+            self.flush_interval = flush_interval
+            self._next_flush = 0.0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def clear(self):
+        """Removes every sample of this process"""
+        with self._lock:
+            self._samples.clear()
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1.0):
+        """Adds amount to a counter or a gauge, which may go down"""
+        key = (name, labels)
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0.0) + amount
+
+    def set(self, name: str, labels: tuple, value: float):
+        """Sets a gauge to value"""
+        with self._lock:
+            self._samples[(name, labels)] = value
+
+    def observe(self, name: str, labels: tuple, value: float):
+        """Adds a value to a histogram"""
+        # the first bucket whose upper bound is at least the value, or +Inf
+        index = bisect_left(self.buckets, value)
+        key = (name, labels)
+        with self._lock:
+            histogram = self._samples.get(key)
+            if histogram is None:
+                # a count for each bucket and +Inf, then the sum
+                histogram = self._samples[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def samples(self) -> dict:
+        """Returns a copy of the samples of this process"""
+        with self._lock:
+            return {
+                key: list(value) if isinstance(value, list) else value
+                for key, value in self._samples.items()
+            }
+
+    def flush(self, force: bool = False):
+        """Writes the samples of this process to its file when the flush interval has passed"""
+        if self.directory is None:
+            return
+        now = self._clock()
+        if not force and now < self._next_flush:
+            return
+        self._next_flush = now + self.flush_interval
+        rows = [[name, [list(pair) for pair in labels], value] for (name, labels), value in self.samples().items()]
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        # a reader never sees a file that is only partly written
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(rows, file)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self) -> dict:
+        """Returns the samples of all the workers summed
+
+        The gauges of the workers that are no longer running are left out,
+        while their counters and histograms still count.
+        """
+        merged = self.samples()
+        if self.directory is None:
+            return merged
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            pid = int(os.path.basename(path)[: -len(".json")])
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path, encoding="utf-8") as file:
+                    rows = json.load(file)
+            except (OSError, ValueError):
+                continue
+            alive = _is_running(pid)
+            for name, labels, value in rows:
+                if name in self.families and (alive or self.families[name][0] != "gauge"):
+                    _add(merged, (name, tuple(tuple(pair) for pair in labels)), value)
+        return merged
+
+    def render(self) -> str:
+        """Returns the samples of all the workers in the Prometheus text format"""
+        samples = self.collect()
+        lines = []
+        for name, (kind, description) in self.families.items():
+            keys = sorted(key for key in samples if key[0] == name)
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in keys:
+                if kind == "histogram":
+                    lines.extend(self._histogram_lines(name, key[1], samples[key]))
+                else:
+                    lines.append(f"{name}{_labels(key[1])} {_number(samples[key])}")
+        return "\n".join(lines) + "\n"
+
+    def _histogram_lines(self, name: str, labels: tuple, histogram: list) -> list:
+        """Returns the cumulative bucket, sum and count lines of a histogram"""
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), histogram):
+            total += count
+            lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {total}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(histogram[-1])}")
+        lines.append(f"{name}_count{_labels(labels)} {total}")
+        return lines
+
+
+# The metrics of this worker, configured in create_app
+registry = MetricsRegistry()
+
+
+def _add(samples: dict, key: tuple, value):
+    """Adds a sample value to the samples"""
+    current = samples.get(key)
+    if current is None:
+        samples[key] = value
+    elif isinstance(current, list):
+        samples[key] = [mine + theirs for mine, theirs in zip(current, value)]
+    else:
+        samples[key] = current + value
+
+
+def _is_running(pid: int) -> bool:
+    """Returns True when a process with the pid is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _labels(labels: tuple) -> str:
+    """Formats labels as {name="value",...} with the values escaped"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value) -> str:
+    """Escapes the backslashes, double quotes and line feeds of a label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    """Formats a sample value the way Prometheus parses it"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+######################################################################
+# Request hooks
+######################################################################
+def init_metrics(app, registry: MetricsRegistry):
+    """Records the metrics of every request of the app in the registry
+
+    The database time and statements of a request are the ones the
+    QueryTimer of the app adds up in g. Both times are also sent in the
+    Server-Timing header, so they show up in the browser and the access log.
+    """
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_labels = (
+            ("endpoint", request.url_rule.rule if request.url_rule else "unmatched"),
+            ("method", request.method),
+        )
+        g.metrics_start = time.perf_counter()
+        g.db_time = 0.0
+        g.db_statements = 0
+        registry.inc(IN_FLIGHT, g.metrics_labels)
+
+    @app.after_request
+    def record_request_metrics(response):
+        labels = g.pop("metrics_labels", None)
+        if labels is not None:
+            elapsed = time.perf_counter() - g.metrics_start
+            registry.inc(IN_FLIGHT, labels, -1)
+            registry.inc(REQUESTS, labels + (("status", str(response.status_code)),))
+            registry.observe(REQUEST_DURATION, labels, elapsed)
+            registry.observe(DB_DURATION, labels, g.db_time)
+            registry.inc(DB_STATEMENTS, labels, g.db_statements)
+            registry.flush()
+            response.headers["Server-Timing"] = (
+                f'db;dur={g.db_time * 1000:.1f};desc="statements: {g.db_statements}", '
+                f"total;dur={elapsed * 1000:.1f}"
+            )
+        return response
@@ -0,0 +1,201 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Profilers
+
+This module contains a sampling profiler that counts the stacks of the
+threads of a live worker in the background, and a WSGI middleware that
+profiles single requests with cProfile when they ask for it.
+"""
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from urllib.parse import parse_qs
+
+# The stack that the samples of the stacks beyond max_stacks are counted as
+TRUNCATED = "[truncated]"
+
+
+class SamplingProfiler:
+    """Counts the stacks of every other thread at a fixed interval
+
+    A background thread reads the current frame of each thread with
+    sys._current_frames, which does not stop them, so the overhead is one
+    walk of every stack per interval. The stacks are kept in the collapsed
+    format of flamegraph.pl, from the outermost frame to the innermost.
+
+    Args:
+        interval (float): the seconds between two samples
+        max_stacks (int): the most distinct stacks kept
+    """
+
+    def __init__(self, interval: float = 0.01, max_stacks: int = 10000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self._stacks = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def configure(self, interval: float, max_stacks: int):
+        """Changes the sampling interval and the most distinct stacks kept"""
+        with self._lock:
+            self.interval = interval
+            self.max_stacks = max_stacks
+
+    @property
+    def running(self) -> bool:
+        """Returns True while the background thread is sampling"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts sampling in the background unless it already is"""
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops sampling and waits for the background thread to end"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def clear(self):
+        """Forgets every stack counted so far"""
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def sample(self):
+        """Counts the current stack of every thread but the calling one"""
+        me = threading.get_ident()
+        stacks = [
+            _collapse(frame)
+            for ident, frame in sys._current_frames().items()  # pylint: disable=protected-access
+            if ident != me
+        ]
+        with self._lock:
+            self.samples += 1
+            for stack in stacks:
+                if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                    self._stacks[stack] += 1
+                else:
+                    self._stacks[TRUNCATED] += 1
+
+    def collapsed(self) -> str:
+        """Returns one "stack count" line per stack, the most sampled first"""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def stats(self) -> dict:
+        """Returns whether it is running and how much it has counted"""
+        with self._lock:
+            return {
+                "running": self.running,
+                "interval": self.interval,
+                "samples": self.samples,
+                "stacks": len(self._stacks),
+                "max_stacks": self.max_stacks,
+            }
+
+    def _run(self):
+        """Samples until stopped"""
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+# The sampling profiler of this worker, configured in create_app
+sampling_profiler = SamplingProfiler()
+
+
+def _collapse(frame) -> str:
+    """Returns the frames of a stack from the outermost one, separated by semicolons"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class RequestProfiler:
+    """WSGI middleware that answers a request with its cProfile statistics
+
+    A request with ?__profile=1 that is_allowed accepts runs under cProfile,
+    its whole body included, and the response is replaced by the statistics
+    of the functions with the most cumulative time. The status of the
+    response it replaces is sent in X-Profiled-Status.
+
+    Args:
+        app: the WSGI application to profile
+        is_allowed: returns True when the WSGI environ may be profiled
+        limit (int): the most functions listed
+    """
+
+    def __init__(self, app, is_allowed, limit: int = 50):
+        self.app = app
+        self.is_allowed = is_allowed
+        self.limit = limit
+
+    def __call__(self, environ, start_response):
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        if query.get("__profile") != ["1"] or not self.is_allowed(environ):
+            return self.app(environ, start_response)
+        profiled = {}
+
+        def keep_status(status, headers, exc_info=None):  # pylint: disable=unused-argument
+            profiled["status"] = status
+            return lambda data: None
+
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            body = self.app(environ, keep_status)
+            try:
+                for _ in body:
+                    pass
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+        finally:
+            profile.disable()
+        elapsed = time.perf_counter() - started
+        output = io.StringIO()
+        output.write(f"{environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')} took {elapsed * 1000:.1f} ms\n")
+        pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(self.limit)
+        report = output.getvalue().encode()
+        start_response(
+            "200 OK",
+            [
+                ("Content-Type", "text/plain; charset=utf-8"),
+                ("Content-Length", str(len(report))),
+                ("X-Profiled-Status", profiled.get("status", "")),
+            ],
+        )
+        return [report]
@@ -0,0 +1,99 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Statement Timing
+
+This module contains the SQLAlchemy engine hooks that count the statements
+and the database time of each request and log the slow statements with
+their parameters and EXPLAIN plans.
+"""
+import time
+import logging
+import threading
+
+from flask import g, has_request_context
+from sqlalchemy import event
+
+logger = logging.getLogger("flask.app")
+
+
+class QueryTimer:
+    """Times every statement of the engines it instruments
+
+    The number of statements and the seconds spent in them are added up in
+    g.db_statements and g.db_time of the request that runs them. A statement
+    that takes at least the threshold is logged with its parameters and the
+    plan EXPLAIN gives for it, which is read on a connection of its own so
+    that a failure cannot abort the transaction of the request.
+
+    Args:
+        threshold (float): the seconds a statement may take before it is logged
+    """
+
+    def __init__(self, threshold: float = 0.5):
+        self.threshold = threshold
+        self._local = threading.local()
+
+    def configure(self, threshold: float):
+        """Changes the seconds a statement may take before it is logged"""
+        self.threshold = threshold
+
+    def instrument(self, engine):
+        """Listens to the statements of an engine, once"""
+        if not event.contains(engine, "before_cursor_execute", self.before_execute):
+            event.listen(engine, "before_cursor_execute", self.before_execute)
+            event.listen(engine, "after_cursor_execute", self.after_execute)
+
+    def before_execute(self, conn, *_args):
+        """Notes when a statement starts"""
+        conn.info["statement_start"] = time.perf_counter()
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def after_execute(self, conn, _cursor, statement, parameters, _context, executemany):
+        """Adds the time of a statement to its request and logs it when it is slow"""
+        start = conn.info.pop("statement_start", None)
+        if start is None or getattr(self._local, "explaining", False):
+            return
+        elapsed = time.perf_counter() - start
+        if has_request_context():
+            g.db_statements = g.get("db_statements", 0) + 1
+            g.db_time = g.get("db_time", 0.0) + elapsed
+        if elapsed >= self.threshold:
+            plan = self.explain(conn.engine, statement, parameters, executemany)
+            logger.warning(
+                "Slow statement took %.1f ms: %s with parameters %r\n%s",
+                elapsed * 1000,
+                statement,
+                parameters,
+                plan,
+            )
+
+    def explain(self, engine, statement: str, parameters, executemany: bool = False) -> str:
+        """Returns the plan of a statement, or why there is none"""
+        if executemany:
+            return "No plan for a statement run with many sets of parameters"
+        self._local.explaining = True
+        try:
+            with engine.connect() as connection:
+                # never wait behind a lock the slow request itself holds
+                connection.exec_driver_sql("SET LOCAL lock_timeout = '1s'")
+                rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+                return "\n".join(row[0] for row in rows)
+        except Exception as error:  # pylint: disable=broad-except
+            return f"No plan: {error}"
+        finally:
+            self._local.explaining = False
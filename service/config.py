@@ -15,6 +15,69 @@ SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 # SQLALCHEMY_POOL_SIZE = 2
 
+# Page sizes for keyset pagination of the list endpoint
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched per round trip when streaming the list endpoint
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Largest number of Promotions accepted by one bulk create request
+MAX_BULK_SIZE = int(os.getenv("MAX_BULK_SIZE", "10000"))
+
+# In-process cache of the Promotions read by id, a size of 0 disables it
+PROMOTION_CACHE_SIZE = int(os.getenv("PROMOTION_CACHE_SIZE", "10000"))
+PROMOTION_CACHE_TTL = float(os.getenv("PROMOTION_CACHE_TTL", "30"))
+
+# In-process cache of the encoded results of the list endpoint. Results with
+# more than RESULT_CACHE_MAX_ROWS Promotions are not kept.
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "10"))
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "1000"))
+
+# Seconds before the index of effective Promotions is reloaded in the
+# background to pick up the Promotions other workers made effective. The
+# Promotions it finds are always checked again in the database.
+EFFECTIVE_INDEX_TTL = float(os.getenv("EFFECTIVE_INDEX_TTL", "300"))
+
+# Bloom filter of the product_ids that have a Promotion, rebuilt in the
+# background after the TTL in seconds to pick up the writes made by other
+# workers, which it misses until then
+PRODUCT_FILTER_ERROR_RATE = float(os.getenv("PRODUCT_FILTER_ERROR_RATE", "0.01"))
+PRODUCT_FILTER_TTL = float(os.getenv("PRODUCT_FILTER_TTL", "60"))
+
+# Seconds the stacking optimizer searches a cart before it falls back to
+# the greedy choice
+STACKING_TIME_BUDGET = float(os.getenv("STACKING_TIME_BUDGET", "0.05"))
+
+# Seconds a database statement may take before it is logged with its
+# parameters and EXPLAIN plan
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.5"))
+
+# Directory shared by the gunicorn workers to sum their metrics for
+# /metrics, and the seconds between the writes of each worker. Without a
+# directory /metrics only has the metrics of the worker that answers it.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+# Token the operators send in X-Admin-Token to call the /admin endpoints.
+# They are all forbidden while it is empty.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Seconds between the samples of the sampling profiler, and the most
+# distinct stacks it keeps
+SAMPLING_PROFILER_INTERVAL = float(os.getenv("SAMPLING_PROFILER_INTERVAL", "0.01"))
+SAMPLING_PROFILER_MAX_STACKS = int(os.getenv("SAMPLING_PROFILER_MAX_STACKS", "10000"))
+
+# Allows the requests with ?__profile=1 and the admin token to be answered
+# with their cProfile statistics
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "false").lower() == "true"
+
+# Share of the records of a level that are logged, e.g. "INFO=0.1,DEBUG=0"
+# to keep one info record in ten and no debug record. The levels that are
+# not listed are always logged.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
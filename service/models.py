@@ -1,3 +1,4 @@
+# pylint: disable=too-many-lines
 """
 Models for Promotion
 
@@ -6,14 +7,40 @@ All of the models are stored in this module
 
 import logging
 from enum import Enum
-from datetime import date
+from datetime import date, timedelta
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert, inspect, literal, select, tuple_, union_all, update
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm.attributes import set_committed_value
+from service.common.cache import LRUCache, Generation
+from service.common.intervals import IntervalIndex
+from service.common.bloom import KeyFilter
+from service.common.query_timer import QueryTimer
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Serialized Promotions by id and encoded list results, both sized in
+# create_app from the configuration. Every write bumps the generation that
+# the list results are keyed by.
+promotion_cache = LRUCache()
+result_cache = LRUCache()
+promotion_generation = Generation()
+
+# The intervals in which the active Promotions of each product are in effect
+effective_index = IntervalIndex()
+
+# The product_ids that have a Promotion, to answer that a product has none
+# without a query
+product_filter = KeyFilter()
+
+# Counts the statements and database time of each request and logs the slow
+# statements, listening to db.engine once create_app has configured it
+query_timer = QueryTimer()
+
 
 class DatabaseConnectionError(Exception):
     """Custom Exception when database connection fails"""
@@ -23,6 +50,10 @@ class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class VersionConflictError(Exception):
+    """Used when a Promotion is no longer at the version a write expected"""
+
+
 class PromotionType(Enum):
     """Enumeration of valid PromotionTypes"""
 
@@ -32,12 +63,69 @@ class PromotionType(Enum):
     UNKNOWN = 3
 
 
+# Converts the fields that are not JSON types when serializing a Promotion
+SERIALIZERS = {
+    "start_date": date.isoformat,
+    "end_date": date.isoformat,
+    "promotion_type": lambda promotion_type: promotion_type.name,  # convert enum to string
+}
+
+
+def _typed(kind, name: str):
+    """Returns a converter that only accepts a value of kind for the field name"""
+
+    def convert(value):
+        # bool is an int, but True is not a valid duration or product_id
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise DataValidationError(f"Invalid type for {kind.__name__} [{name}]: {type(value)}")
+        return value
+
+    return convert
+
+
+def _promotion_type(value) -> "PromotionType":
+    """Converts the name of a PromotionType to the enum"""
+    if not isinstance(value, str) or value not in PromotionType.__members__:
+        raise DataValidationError(f"Invalid attribute: {value}")
+    return PromotionType[value]
+
+
+def _start_date(value) -> date:
+    """Converts an ISO date string to a date"""
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError) as error:
+        raise DataValidationError(f"Invalid value: {value}") from error
+
+
+def _end_date(start_date: date, duration: int) -> date:
+    """Returns the end date of a Promotion, which must be a date Python can load"""
+    try:
+        return start_date + timedelta(days=duration)
+    except OverflowError as error:
+        raise DataValidationError(
+            f"Invalid duration: {duration} days from {start_date} ends out of range"
+        ) from error
+
+
+# Converts and validates the fields a partial update may change
+DESERIALIZERS = {
+    "name": _typed(str, "name"),
+    "start_date": _start_date,
+    "duration": _typed(int, "duration"),
+    "promotion_type": _promotion_type,
+    "rule": _typed(str, "rule"),
+    "product_id": _typed(int, "product_id"),
+    "status": _typed(bool, "status"),
+}
+
+
 class Promotion(db.Model):
     """
     Class that represents a Promotion
     """
 
-    # pylint: disable=too-many-instance-attributes
+    # pylint: disable=too-many-instance-attributes, too-many-public-methods
     ##################################################
     # Table Schema
     ##################################################
@@ -45,6 +133,8 @@ class Promotion(db.Model):
     name = db.Column(db.String(63), nullable=False)
     start_date = db.Column(db.Date(), nullable=False, default=date.today())
     duration = db.Column(db.Integer, nullable=False)
+    # The first day the Promotion is no longer in effect, kept by the database
+    end_date = db.Column(db.Date(), db.Computed("start_date + duration", persisted=True))
     promotion_type = db.Column(
         db.Enum(PromotionType),
         nullable=False,
@@ -53,6 +143,55 @@ class Promotion(db.Model):
     rule = db.Column(db.String(63), nullable=False)
     product_id = db.Column(db.Integer, nullable=False)
     status = db.Column(db.Boolean, default=True, nullable=False)
+    # Counts the writes of the row. The ORM only updates and deletes a row at
+    # the version it loaded, and the Core writes below bump it themselves.
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # Indexes for every filter exposed by the list endpoint. The leading
+    # column of each composite also serves single column lookups, so
+    # (product_id, status) covers find_by_product_id and (status, start_date)
+    # covers find_by_promotion_status. (start_date, id) also serves keyset
+    # pages ordered by start_date. (end_date, start_date) serves the date
+    # range filters, which all bound end_date from below. Postgres stores
+    # dates far past the ones Python can load, so the check keeps end_date
+    # readable for every query that selects it.
+    __table_args__ = (
+        db.CheckConstraint(
+            "start_date + duration BETWEEN DATE '0001-01-01' AND DATE '9999-12-31'",
+            name="ck_promotion_end_date",
+        ),
+        db.Index("ix_promotion_product_id_status", "product_id", "status"),
+        db.Index("ix_promotion_status_start_date", "status", "start_date"),
+        db.Index("ix_promotion_start_date_id", "start_date", "id"),
+        db.Index("ix_promotion_promotion_type", "promotion_type"),
+        db.Index("ix_promotion_name", "name"),
+        db.Index("ix_promotion_end_date_start_date", "end_date", "start_date"),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+    # Names of the fields of a serialized Promotion
+    FIELDS = (
+        "id",
+        "name",
+        "start_date",
+        "duration",
+        "end_date",
+        "promotion_type",
+        "rule",
+        "product_id",
+        "status",
+    )
+
+    # The fields kept in promotion_cache, which add the version the ETag of a
+    # Promotion is made of
+    VERSIONED_FIELDS = FIELDS + ("version",)
+
+    # Sort orders supported by find_page. Each one ends with the unique id so
+    # that the key of the last row identifies exactly where a page stops.
+    PAGE_KEYS = {
+        "id": ("id",),
+        "start_date": ("start_date", "id"),
+    }
 
     def __repr__(self):
         return f"<Promotion {self.name} id=[{self.id}]>"
@@ -63,6 +202,7 @@ class Promotion(db.Model):
         """
         logger.info("Creating %s", self.name)
         self.id = None  # pylint: disable=invalid-name
+        product_id = self.product_id
         try:
             db.session.add(self)
             db.session.commit()
@@ -70,6 +210,39 @@ class Promotion(db.Model):
             db.session.rollback()
             logger.error("Error creating record: %s", self)
             raise DataValidationError(e) from e
+        product_filter.add([product_id])
+        # ids are reused once the sequence is restarted
+        self._invalidate([self.id])
+
+    @classmethod
+    def create_many(cls, promotions: list):
+        """
+        Creates many Promotions to the database in a single transaction
+
+        The rows are sent as batched multi-row INSERT ... RETURNING statements,
+        so the whole list costs a few round trips and one commit instead of one
+        of each per Promotion. The Promotions are not added to the session, so
+        they keep their values after the commit and only get their new ids.
+        """
+        logger.info("Creating %d Promotions", len(promotions))
+        if not promotions:
+            # an INSERT without any rows would insert one of defaults
+            return
+        statement = insert(cls.__table__).returning(
+            cls.__table__.c.id, sort_by_parameter_order=True
+        )
+        try:
+            result = db.session.execute(statement, [promotion.row() for promotion in promotions])
+            new_ids = result.scalars().all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error creating %d records", len(promotions))
+            raise DataValidationError(e) from e
+        for promotion, new_id in zip(promotions, new_ids):
+            promotion.id = new_id
+        product_filter.add([promotion.product_id for promotion in promotions])
+        cls._invalidate(new_ids)
 
     def update(self):
         """
@@ -78,35 +251,189 @@ class Promotion(db.Model):
         logger.info("Saving %s", self.name)
         if not self.id:  # it should not update a promotion with no id
             raise DataValidationError("Update called with empty ID field")
+        moved = inspect(self).attrs.product_id.history
+        built = product_filter.generation
         try:
             db.session.commit()
+        except StaleDataError as e:
+            db.session.rollback()
+            logger.error("Record was changed by another writer: %s", self)
+            raise VersionConflictError(f"Promotion with id '{self.id}' was changed") from e
         except Exception as e:
             db.session.rollback()
             logger.error("Error updating record: %s", self)
             raise DataValidationError(e) from e
+        # the old product_id is unknown when it was not loaded, and then it
+        # stays in product_filter, which only costs a query
+        product_filter.remove(moved.deleted, built)
+        product_filter.add(moved.added)
+        self._invalidate([int(self.id)])
 
     def delete(self):
         """Removes a Promotion from the data store"""
         logger.info("Deleting %s", self.name)
+        by_id, product_id = self.id, self.product_id
+        built = product_filter.generation
         try:
             db.session.delete(self)
             db.session.commit()
+        except StaleDataError as e:
+            db.session.rollback()
+            logger.error("Record was changed by another writer: %s", self)
+            raise VersionConflictError(f"Promotion with id '{by_id}' was changed") from e
         except Exception as e:
             db.session.rollback()
             logger.error("Error deleting record: %s", self)
             raise DataValidationError(e) from e
+        product_filter.remove([product_id], built)
+        self._invalidate([by_id])
 
     def activate(self):
         """Activates a Promotion by setting status to True"""
         logger.info("Activate Promotion with Promotion Id %d", self.id)
-        self.status = True
-        db.session.commit()
+        self._set_committed(self.set_status(self.id, True, ["status", "version"]))
 
     def deactivate(self):
         """Deactivates a Promotion by setting status to False"""
         logger.info("Deactivate Promotion with Promotion Id %d", self.id)
-        self.status = False
-        db.session.commit()
+        self._set_committed(self.set_status(self.id, False, ["status", "version"]))
+
+    @classmethod
+    def set_status(cls, by_id, promotion_status: bool, fields=None):
+        """Sets the status of a Promotion and returns it serialized
+
+        This runs as a single UPDATE ... RETURNING that only writes the row
+        when its status changes and reads it back in the same statement when
+        it does not, so it usually costs one round trip. Under READ COMMITTED
+        that read sees the row as the statement started. When another
+        transaction changed the status meanwhile, the UPDATE matches nothing
+        and the read returns the old status, so the statement runs once more
+        to see the row as it was committed.
+
+        Args:
+            by_id (int): the id of the Promotion to change
+            promotion_status (bool): True to activate and False to deactivate
+            fields (list): the only fields to include, or None for all of them
+
+        Returns:
+            the serialized Promotion, or None when it does not exist
+        """
+        logger.info("Setting status %s of id %s ...", promotion_status, by_id)
+        try:
+            by_id = int(by_id)
+        except ValueError:
+            return None
+        names = list(cls.FIELDS if fields is None else fields)
+        statement = cls._set_status_statement(by_id, promotion_status, [getattr(cls, name) for name in names])
+        row = cls._execute_set_status(by_id, statement)
+        if row is not None and not row.current:
+            logger.info("Status of id %s changed while it was set, reading it again", by_id)
+            row = cls._execute_set_status(by_id, statement)
+        if row is None:
+            return None
+        if row.written:
+            cls._invalidate([by_id])
+        return cls._serialize_row(names, row)
+
+    @classmethod
+    def _set_status_statement(cls, by_id: int, promotion_status: bool, columns: list):
+        """Returns the statement that sets the status of a Promotion and returns its columns
+
+        Every row also tells whether the statement wrote it, and whether it
+        already had the status as read, which is False when the read missed
+        the write of a concurrent transaction.
+        """
+        changed = (
+            update(cls)
+            .where(cls.id == by_id, cls.status != promotion_status)
+            .values(status=promotion_status, version=cls.version + 1)
+            .returning(*columns, literal(True).label("written"), literal(True).label("current"))
+            .cte("changed")
+        )
+        unchanged = select(
+            *columns, literal(False).label("written"), (cls.status == promotion_status).label("current")
+        ).where(cls.id == by_id, ~select(changed).exists())
+        return union_all(select(changed), unchanged)
+
+    @classmethod
+    def _execute_set_status(cls, by_id: int, statement):
+        """Runs a statement of _set_status_statement and returns its row, or None"""
+        try:
+            row = db.session.execute(statement).first()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error setting status of record %s: %s", by_id, e)
+            raise DataValidationError(e) from e
+        return row
+
+    @classmethod
+    def patch(cls, by_id, data: dict, fields=None, versions=None):
+        """Changes only the given fields of a Promotion and returns it serialized
+
+        The fields are validated on their own and written with a single
+        UPDATE ... RETURNING, without reading the Promotion first. When the
+        product_id changes, the statement also joins the row as it was
+        before the UPDATE to return the product_id it moves away from.
+
+        Args:
+            by_id (int): the id of the Promotion to change
+            data (dict): the new values of some of the DESERIALIZERS fields
+            fields (list): the only fields to include, or None for all of them
+            versions (list): the versions the Promotion may be at, or None
+                for any version
+
+        Returns:
+            the serialized Promotion, or None when it does not exist
+
+        Raises:
+            VersionConflictError: when the Promotion is at another version
+        """
+        logger.info("Patching Promotion with id %s ...", by_id)
+        values = cls._patch_values(data)
+        try:
+            by_id = int(by_id)
+        except ValueError:
+            return None
+        names = list(cls.FIELDS if fields is None else fields)
+        statement = update(cls).where(cls.id == by_id).values(**values, version=cls.version + 1)
+        if versions is not None:
+            statement = statement.where(cls.version.in_(versions))
+        moved_from = literal(None)
+        if "product_id" in values:
+            before = cls.__table__.alias("before")
+            statement = statement.where(before.c.id == cls.id)
+            moved_from = before.c.product_id
+        statement = statement.returning(*[getattr(cls, name) for name in names], moved_from.label("moved_from"))
+        built = product_filter.generation
+        try:
+            row = db.session.execute(statement).first()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error patching record %s: %s", by_id, e)
+            raise DataValidationError(e) from e
+        if row is None:
+            # only a failed write needs the second query to tell why
+            if versions is not None and db.session.get(cls, by_id) is not None:
+                raise VersionConflictError(f"Promotion with id '{by_id}' was changed")
+            return None
+        if row.moved_from is not None:
+            product_filter.remove([row.moved_from], built)
+            product_filter.add([values["product_id"]])
+        cls._invalidate([by_id])
+        return cls._serialize_row(names, row)
+
+    def row(self) -> dict:
+        """Returns the column values of a Promotion for a Core INSERT
+
+        The version is left out so that new rows start at its server default.
+        """
+        return {
+            column.key: getattr(self, column.key)
+            for column in self.__table__.columns
+            if not column.primary_key and column.computed is None and column.key != "version"
+        }
 
     def serialize(self):
         """Serializes a Promotion into a dictionary"""
@@ -115,6 +442,8 @@ class Promotion(db.Model):
             "name": self.name,
             "start_date": self.start_date.isoformat(),
             "duration": self.duration,
+            # computed like the database does so unsaved Promotions have one too
+            "end_date": (self.start_date + timedelta(days=self.duration)).isoformat(),
             "promotion_type": self.promotion_type.name,  # convert enum to string
             "rule": self.rule,
             "product_id": self.product_id,
@@ -153,6 +482,7 @@ class Promotion(db.Model):
             if not isinstance(status_val, bool):
                 raise ValueError("Invalid status value: must be boolean")
             self.status = status_val
+            _end_date(self.start_date, self.duration)
 
         except AttributeError as error:
             raise DataValidationError("Invalid attribute: " + error.args[0]) from error
@@ -186,61 +516,536 @@ class Promotion(db.Model):
         return cls.query.session.get(cls, by_id)
 
     @classmethod
-    def find_by_name(cls, name):
+    def find_serialized(cls, by_id, fields=None):
+        """Finds a Promotion by it's ID and returns it serialized
+
+        This is the read only fast path of find, see serialize_rows. The whole
+        Promotion is kept in promotion_cache, so repeated lookups of the same
+        id skip the database until a write invalidates it or it expires.
+
+        Args:
+            by_id (int): the id of the Promotion to find
+            fields (list): the only fields to include, or None for all of them
+
+        Returns:
+            the serialized Promotion, or None when it does not exist
+        """
+        logger.info("Processing serialized lookup for id %s ...", by_id)
+        try:
+            by_id = int(by_id)
+        except ValueError:
+            return None
+        promotion = promotion_cache.get(by_id)
+        if promotion is None:
+            promotion = next(cls.serialize_rows(cls.query.filter(cls.id == by_id), cls.VERSIONED_FIELDS), None)
+            if promotion is None:
+                return None
+            promotion_cache.put(by_id, promotion)
+        # a copy, so callers may change it without changing the cached one
+        return {name: promotion[name] for name in (cls.FIELDS if fields is None else fields)}
+
+    @classmethod
+    def find_serialized_many(cls, ids, fields=None) -> dict:
+        """Finds many Promotions by their IDs and returns them serialized
+
+        This is find_serialized for a list of ids. The ids that are not in
+        promotion_cache are read with a single SELECT and cached.
+
+        Args:
+            ids (list): the ids of the Promotions to find
+            fields (list): the only fields to include, or None for all of them
+
+        Returns:
+            a dictionary of the serialized Promotions of the ids that exist
+        """
+        logger.info("Processing serialized lookup for %d ids ...", len(ids))
+        found = {}
+        for by_id in dict.fromkeys(ids):
+            promotion = promotion_cache.get(by_id)
+            if promotion is not None:
+                found[by_id] = promotion
+        missing = [by_id for by_id in dict.fromkeys(ids) if by_id not in found]
+        if missing:
+            for promotion in cls.serialize_rows(cls.find_by_ids(missing), cls.VERSIONED_FIELDS):
+                promotion_cache.put(promotion["id"], promotion)
+                found[promotion["id"]] = promotion
+        names = cls.FIELDS if fields is None else fields
+        return {
+            by_id: {name: promotion[name] for name in names}
+            for by_id, promotion in found.items()
+        }
+
+    @classmethod
+    def serialize_groups(cls, query, key: str, fields=None) -> dict:
+        """Serializes the Promotions of a query grouped by the value of a field
+
+        Args:
+            query: the Promotion query to serialize
+            key (string): the name of the field to group by
+            fields (list): the only fields to include, or None for all of them
+
+        Returns:
+            a dictionary of the lists of serialized Promotions ordered by id
+            of every value of the field that has any
+        """
+        names = list(cls.FIELDS if fields is None else fields)
+        selected = names if key in names else names + [key]
+        groups = {}
+        for promotion in cls.serialize_rows(query.order_by(cls.id), selected):
+            value = promotion[key] if key in names else promotion.pop(key)
+            groups.setdefault(value, []).append(promotion)
+        return groups
+
+    @classmethod
+    def serialize_rows(cls, query, fields=None):
+        """Serializes the Promotions of a query straight from its row tuples
+
+        Only the columns of the fields are SELECTed and the rows are turned
+        into the same dictionaries as serialize without building Promotion
+        instances or tracking them in the session, which is much faster for
+        read only requests.
+
+        Args:
+            query: the Promotion query to serialize
+            fields (list): the only fields to include, or None for all of them
+
+        Returns:
+            a generator of serialized Promotions
+        """
+        names = list(cls.FIELDS if fields is None else fields)
+        columns = [getattr(cls, name) for name in names]
+        serializers = [SERIALIZERS.get(name) for name in names]
+        for row in query.with_entities(*columns):
+            yield {
+                name: value if serializer is None else serializer(value)
+                for name, value, serializer in zip(names, row, serializers)
+            }
+
+    @classmethod
+    def find_by_name(cls, name, query=None):
         """Returns all Promotions with the given name
 
         Args:
             name (string): the name of the Promotions you want to match
+            query: an optional Promotion query to narrow down instead of all Promotions
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        return cls._base(query).filter(cls.name == name)
 
     @classmethod
     def find_by_promotion_type(
-        cls, promotion_type: PromotionType = PromotionType.UNKNOWN
+        cls, promotion_type: PromotionType = PromotionType.UNKNOWN, query=None
     ) -> list:
         """Returns all Promotions by their PromotionType
 
         :param promotion_type: values are ['AMOUNT_DISCOUNT', 'PERCENTAGE_DISCOUNT', 'BXGY', 'UNKNOWN']
         :type available: enum
+        :param query: an optional Promotion query to narrow down instead of all Promotions
 
         :return: a collection of Promotions that are available
         :rtype: list
 
         """
         logger.info("Processing promotion_type query for %s ...", promotion_type.name)
-        return cls.query.filter(cls.promotion_type == promotion_type)
+        return cls._base(query).filter(cls.promotion_type == promotion_type)
 
     @classmethod
-    def find_by_product_id(cls, product_id):
-        """Returns all Promotions with the given product_id
+    def find_by_product_id(cls, product_id, query=None):
+        """Returns all Promotions with the given product_id, or any of a list of them
 
         Args:
-            product_id (string): the product_id of the Promotions you want to match
+            product_id (int or list): the product_id of the Promotions you want to match
+            query: an optional Promotion query to narrow down instead of all Promotions
         """
-        logger.info("Processing product_id query for %d ...", product_id)
-        return cls.query.filter(cls.product_id == product_id)
+        logger.info("Processing product_id query for %s ...", product_id)
+        if isinstance(product_id, list):
+            return cls._base(query).filter(cls.product_id.in_(product_id))
+        return cls._base(query).filter(cls.product_id == product_id)
 
     @classmethod
-    def find_by_start_date(cls, start_date):
+    def find_by_start_date(cls, start_date, query=None):
         """Returns all Promotions with the given start_date
 
         Args:
             start_date (string): the start_date of the Promotions you want to match
+            query: an optional Promotion query to narrow down instead of all Promotions
         """
         logger.info("Processing start_date query for %s ...", start_date)
-        return cls.query.filter(cls.start_date == date.fromisoformat(start_date))
+        return cls._base(query).filter(cls.start_date == cls._date(start_date))
+
+    @classmethod
+    def find_by_active_on(cls, on_date, query=None):
+        """Returns all Promotions in effect on a date, whatever their status
+
+        Args:
+            on_date (string): the date as an ISO date
+            query: an optional Promotion query to narrow down instead of all Promotions
+        """
+        logger.info("Processing active_on query for %s ...", on_date)
+        on_date = cls._date(on_date)
+        return cls._base(query).filter(cls.end_date > on_date, cls.start_date <= on_date)
+
+    @classmethod
+    def find_by_starts_before(cls, before, query=None):
+        """Returns all Promotions that start before a date
+
+        Args:
+            before (string): the date as an ISO date
+            query: an optional Promotion query to narrow down instead of all Promotions
+        """
+        logger.info("Processing starts_before query for %s ...", before)
+        return cls._base(query).filter(cls.start_date < cls._date(before))
+
+    @classmethod
+    def find_by_ends_after(cls, after, query=None):
+        """Returns all Promotions whose end_date is after a date
+
+        Args:
+            after (string): the date as an ISO date
+            query: an optional Promotion query to narrow down instead of all Promotions
+        """
+        logger.info("Processing ends_after query for %s ...", after)
+        return cls._base(query).filter(cls.end_date > cls._date(after))
 
     @classmethod
-    def find_by_promotion_status(cls, promotion_status: bool = True) -> list:
+    def find_by_promotion_status(cls, promotion_status: bool = True, query=None) -> list:
         """Returns all Promotions by their status
 
         :param available: True for promotions that are activated
         :type available: str
+        :param query: an optional Promotion query to narrow down instead of all Promotions
 
         :return: a collection of Promotions that are activated
         :rtype: list
 
         """
         logger.info("Processing promotion status query for %s ...", promotion_status)
-        return cls.query.filter(cls.status == promotion_status)
+        return cls._base(query).filter(cls.status == promotion_status)
+
+    @classmethod
+    def find_by_filters(  # pylint: disable=too-many-arguments
+        cls,
+        *,
+        name=None,
+        start_date=None,
+        promotion_type=None,
+        product_id=None,
+        status=None,
+        active_on=None,
+        starts_before=None,
+        ends_after=None,
+    ):
+        """Returns all Promotions that match every one of the given filters
+
+        The filters are combined by chaining the find_by_* queries so the
+        database does all of the selection in a single SELECT. Filters that
+        are None are ignored, so calling it with no filters returns all
+        Promotions.
+
+        Args:
+            name (string): the name of the Promotions you want to match
+            start_date (string): the start_date as an ISO date
+            promotion_type (string): the name of a PromotionType
+            product_id (int): the product_id of the Promotions you want to match
+            status (bool): True for promotions that are activated
+            active_on (string): an ISO date the Promotions are in effect on
+            starts_before (string): an ISO date the Promotions start before
+            ends_after (string): an ISO date the end_date of the Promotions is after
+        """
+        if promotion_type is not None:
+            try:
+                promotion_type = PromotionType[promotion_type.upper()]
+            except KeyError as error:
+                raise DataValidationError(
+                    f"Invalid promotion_type: {promotion_type}"
+                ) from error
+        selected = [
+            (cls.find_by_name, name),
+            (cls.find_by_start_date, start_date),
+            (cls.find_by_promotion_type, promotion_type),
+            (cls.find_by_product_id, product_id),
+            (cls.find_by_promotion_status, status),
+            (cls.find_by_active_on, active_on),
+            (cls.find_by_starts_before, starts_before),
+            (cls.find_by_ends_after, ends_after),
+        ]
+        query = cls.query
+        for find_by, value in selected:
+            if value is not None:
+                query = find_by(value, query)
+        return query
+
+    @classmethod
+    def find_by_ids(cls, ids, query=None):
+        """Returns all Promotions with one of the given ids
+
+        Args:
+            ids (list): the ids of the Promotions you want to match
+            query: an optional Promotion query to narrow down instead of all Promotions
+        """
+        logger.info("Processing ids query for %d ids ...", len(ids))
+        return cls._base(query).filter(cls.id.in_(ids))
+
+    @classmethod
+    def may_have_product(cls, product_id: int) -> bool:
+        """Returns False when no Promotion has the product_id, True when one may
+
+        The answer comes from product_filter, so a product without Promotions
+        costs no query. A product that has one is only sometimes wrongly
+        reported, at about PRODUCT_FILTER_ERROR_RATE. A product that got its
+        first Promotion from another worker is reported without any until
+        the filter is rebuilt, up to PRODUCT_FILTER_TTL later.
+        """
+        return product_filter.might_contain(product_id, cls._in_app(cls._product_counts))
+
+    @classmethod
+    def find_effective(cls, product_id: int, on_date: date = None, fields=None) -> list:
+        """Returns the active Promotions of a product that are in effect on a date
+
+        A Promotion is in effect from its start_date for duration days, so on
+        the dates in [start_date, start_date + duration). The ids are looked up
+        in effective_index in O(log n + k) and only those k Promotions are read.
+
+        Args:
+            product_id (int): the product_id of the Promotions you want to match
+            on_date (date): the date they must be in effect on, today by default
+            fields (list): the only fields to include, or None for all of them
+
+        Returns:
+            a list of serialized Promotions ordered by id
+        """
+        return cls.find_effective_many([product_id], on_date, fields).get(product_id, [])
+
+    @classmethod
+    def find_effective_many(cls, product_ids, on_date: date = None, fields=None) -> dict:
+        """Returns the active Promotions of many products that are in effect on a date
+
+        This is find_effective for a whole cart, all of the Promotions are
+        read with a single SELECT.
+
+        Args:
+            product_ids (list): the product_ids of the Promotions you want to match
+            on_date (date): the date they must be in effect on, today by default
+            fields (list): the only fields to include, or None for all of them
+
+        Returns:
+            a dictionary of the lists of serialized Promotions ordered by id of
+            every product that has any
+        """
+        on_date = on_date or date.today()
+        logger.info("Processing effective query for %s on %s ...", product_ids, on_date)
+        product_ids = set(product_ids)
+        load = cls._effective_loader()
+        ids = [by_id for product_id in product_ids for by_id in effective_index.find(product_id, on_date, load)]
+        if not ids:
+            return {}
+        names = list(cls.FIELDS if fields is None else fields)
+        selected = names if "product_id" in names else names + ["product_id"]
+        # effective_index may not have seen the writes of the other workers yet,
+        # so the rows are checked again before anything is priced with them
+        query = cls.find_by_ids(ids).filter(cls.product_id.in_(product_ids))
+        query = cls.find_by_active_on(on_date, cls.find_by_promotion_status(True, query)).order_by(cls.id)
+        found = {}
+        for promotion in cls.serialize_rows(query, selected):
+            product_id = promotion["product_id"] if "product_id" in names else promotion.pop("product_id")
+            found.setdefault(product_id, []).append(promotion)
+        return found
+
+    @classmethod
+    def set_status_where(cls, promotion_status: bool, ids=None, **filters) -> int:
+        """Sets the status of every Promotion with one of the ids that matches the filters
+
+        This runs as a single UPDATE ... WHERE without loading any Promotion
+        and skips the rows that already have the status.
+
+        Args:
+            promotion_status (bool): True to activate and False to deactivate
+            ids (list): the ids of the Promotions to change, or None for any id
+            filters: the find_by_filters filters the Promotions must match
+
+        Returns:
+            the number of Promotions that were changed
+        """
+        logger.info("Setting status %s where ids %s and %s", promotion_status, ids, filters)
+        query = cls.find_by_filters(**filters).filter(cls.status != promotion_status)
+        if ids is not None:
+            query = cls.find_by_ids(ids, query)
+        try:
+            count = query.update(
+                {cls.status: promotion_status, cls.version: cls.version + 1},
+                synchronize_session=False,
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error updating status of records: %s", e)
+            raise DataValidationError(e) from e
+        cls._invalidate(ids)
+        return count
+
+    @classmethod
+    def delete_where(cls, ids=None, **filters) -> int:
+        """Removes every Promotion with one of the ids that matches the filters
+
+        This runs as a single DELETE ... WHERE without loading any Promotion,
+        so their product_ids stay in product_filter until it is rebuilt.
+
+        Args:
+            ids (list): the ids of the Promotions to remove, or None for any id
+            filters: the find_by_filters filters the Promotions must match
+
+        Returns:
+            the number of Promotions that were removed
+        """
+        logger.info("Deleting where ids %s and %s", ids, filters)
+        query = cls.find_by_filters(**filters)
+        if ids is not None:
+            query = cls.find_by_ids(ids, query)
+        try:
+            count = query.delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error deleting records: %s", e)
+            raise DataValidationError(e) from e
+        cls._invalidate(ids)
+        return count
+
+    @classmethod
+    def find_page(cls, query, limit: int, after: dict = None, order_by: str = "id", fields=None):
+        """Returns one page of a Promotion query using keyset pagination
+
+        The page starts right after the key of the last row of the previous
+        page, so the database seeks to it through an index and a deep page
+        costs the same as the first one, unlike an OFFSET.
+
+        Args:
+            query: the Promotion query to page through
+            limit (int): the maximum number of Promotions on the page
+            after (dict): the key of the last Promotion of the previous page
+            order_by (string): one of the PAGE_KEYS sort orders
+            fields (list): the only fields to include, or None for all of them
+
+        Returns:
+            a tuple of the list of serialized Promotions and the key of the
+            next page, which is None on the last page
+        """
+        logger.info("Processing page of %d by %s after %s ...", limit, order_by, after)
+        names = cls.PAGE_KEYS[order_by]
+        columns = [getattr(cls, name) for name in names]
+        if after is not None:
+            query = query.filter(tuple_(*columns) > tuple_(*cls._page_key(names, after)))
+        wanted = list(cls.FIELDS if fields is None else fields)
+        selected = wanted + [name for name in names if name not in wanted]
+        query = query.order_by(*columns).limit(limit + 1)
+        promotions = list(cls.serialize_rows(query, selected))
+        next_key = None
+        if len(promotions) > limit:
+            promotions = promotions[:limit]
+            next_key = {name: promotions[-1][name] for name in names}
+        if len(selected) > len(wanted):
+            promotions = [{name: item[name] for name in wanted} for item in promotions]
+        return promotions, next_key
+
+    @classmethod
+    def _effective_loader(cls):
+        """Returns _effective_rows bound to the current app, so effective_index can reload in a thread"""
+        return cls._in_app(cls._effective_rows)
+
+    @staticmethod
+    def _in_app(load):
+        """Returns a load function that runs in the current app, even from another thread"""
+        app = current_app._get_current_object()  # pylint: disable=protected-access
+
+        def load_in_app(*args):
+            if has_app_context():
+                return load(*args)
+            with app.app_context():
+                return load(*args)
+
+        return load_in_app
+
+    @classmethod
+    def _effective_rows(cls, ids=None) -> list:
+        """Returns the (id, product_id, start, end) intervals of the active Promotions
+
+        Args:
+            ids (list): the ids of the Promotions to read, or None for all of them
+        """
+        query = cls.find_by_promotion_status(True).filter(cls.end_date > cls.start_date)
+        if ids is not None:
+            query = cls.find_by_ids(ids, query)
+        return [
+            tuple(row)
+            for row in query.with_entities(cls.id, cls.product_id, cls.start_date, cls.end_date)
+        ]
+
+    @classmethod
+    def _product_counts(cls) -> list:
+        """Returns the number of Promotions of every product_id"""
+        query = db.session.query(cls.product_id, db.func.count()).group_by(cls.product_id)
+        return [tuple(row) for row in query]
+
+    @staticmethod
+    def _patch_values(data) -> dict:
+        """Returns the column values of the fields of a partial update"""
+        if not isinstance(data, dict) or not data:
+            raise DataValidationError("Invalid Promotion: body of request contained bad or no data")
+        unknown = [name for name in data if name not in DESERIALIZERS]
+        if unknown:
+            raise DataValidationError(f"Invalid fields: {', '.join(map(str, unknown))}")
+        values = {name: DESERIALIZERS[name](value) for name, value in data.items()}
+        # with only one of them, the check constraint bounds the end date
+        if "start_date" in values and "duration" in values:
+            _end_date(values["start_date"], values["duration"])
+        return values
+
+    def _set_committed(self, values: dict):
+        """Sets attributes to the values a Core statement wrote without marking them changed"""
+        for name, value in (values or {}).items():
+            set_committed_value(self, name, value)
+
+    @staticmethod
+    def _serialize_row(names, row) -> dict:
+        """Serializes the named columns of a row returned by a statement"""
+        return {
+            name: value if name not in SERIALIZERS else SERIALIZERS[name](value)
+            for name, value in zip(names, row)
+        }
+
+    @staticmethod
+    def _invalidate(ids=None):
+        """Removes the Promotions with the ids from the caches, or all of them for None"""
+        promotion_generation.bump()
+        effective_index.invalidate(ids)
+        if ids is None:
+            promotion_cache.clear()
+        else:
+            for by_id in ids:
+                promotion_cache.invalidate(by_id)
+
+    @classmethod
+    def _base(cls, query=None):
+        """Returns the query to narrow down, which defaults to all Promotions"""
+        return cls.query if query is None else query
+
+    @staticmethod
+    def _date(value) -> date:
+        """Returns a date given as a date or an ISO date string"""
+        if isinstance(value, date):
+            return value
+        try:
+            return date.fromisoformat(value)
+        except (TypeError, ValueError) as error:
+            raise DataValidationError(f"Invalid date: {value}") from error
+
+    @staticmethod
+    def _page_key(names, after: dict) -> list:
+        """Converts a page key from its serialized form to column values"""
+        try:
+            return [
+                date.fromisoformat(after[name]) if name == "start_date" else int(after[name])
+                for name in names
+            ]
+        except (KeyError, TypeError, ValueError) as error:
+            raise DataValidationError(f"Invalid page key: {after}") from error
@@ -0,0 +1,190 @@
+"""
+Promotion Rules
+
+Parses the rule of a Promotion into a callable that computes the discount
+it gives a cart line. The grammar of each PromotionType, case insensitive:
+
+    AMOUNT_DISCOUNT       "<amount> off" or "<amount> off each", e.g. "$30 off"
+    PERCENTAGE_DISCOUNT   "<percent>% off", e.g. "20% off"
+    BXGY                  "buy <x> get <y>", e.g. "buy 2 get 1 free"
+
+"discount" may be used instead of "off". Rules that do not follow the
+grammar of their type, and every UNKNOWN rule, never give a discount.
+"""
+import re
+import math
+import logging
+from datetime import date
+from functools import lru_cache
+from typing import NamedTuple
+
+from service.models import DataValidationError
+
+logger = logging.getLogger("flask.app")
+
+# Most Promotions share a few rules, so this holds far more than are active
+RULE_CACHE_SIZE = 4096
+
+AMOUNT_RULE = re.compile(
+    r"^\$?\s*(\d+(?:\.\d+)?)\s*\$?\s*(?:off|discount)(\s+each)?$", re.IGNORECASE
+)
+PERCENT_RULE = re.compile(r"^(\d+(?:\.\d+)?)\s*%\s*(?:off|discount)$", re.IGNORECASE)
+BXGY_RULE = re.compile(r"^buy\s+(\d+)\s+get\s+(\d+)(?:\s+free)?$", re.IGNORECASE)
+
+
+class CartLine(NamedTuple):
+    """A quantity of one product at a unit price"""
+
+    product_id: int
+    quantity: int
+    unit_price: float
+
+
+class AmountOff:  # pylint: disable=too-few-public-methods
+    """Takes a fixed amount off a line, or off each unit of it
+
+    The discount is never more than the line total.
+    """
+
+    def __init__(self, amount: float, each: bool = False):
+        self.amount = amount
+        self.each = each
+
+    def __call__(self, quantity: int, unit_price: float) -> float:
+        amount = self.amount * quantity if self.each else self.amount
+        return min(amount, quantity * unit_price)
+
+
+class PercentOff:  # pylint: disable=too-few-public-methods
+    """Takes a percentage off a line"""
+
+    def __init__(self, percent: float):
+        self.percent = percent
+
+    def __call__(self, quantity: int, unit_price: float) -> float:
+        return quantity * unit_price * self.percent / 100
+
+
+class BuyXGetY:  # pylint: disable=too-few-public-methods
+    """Gives y units free for every x units bought"""
+
+    def __init__(self, buy: int, get: int):
+        self.buy = buy
+        self.get = get
+
+    def __call__(self, quantity: int, unit_price: float) -> float:
+        return quantity // (self.buy + self.get) * self.get * unit_price
+
+
+@lru_cache(maxsize=RULE_CACHE_SIZE)
+def compile_rule(promotion_type: str, rule: str):
+    """Returns the callable of a rule, or None when it never gives a discount
+
+    The callables are cached by type and rule, so each distinct rule is only
+    parsed once however many Promotions or carts use it, and a changed rule
+    is compiled again.
+
+    Args:
+        promotion_type (string): the name of the PromotionType of the rule
+        rule (string): the rule of the Promotion
+    """
+    rule = rule.strip()
+    if promotion_type == "AMOUNT_DISCOUNT" and (match := AMOUNT_RULE.match(rule)):
+        return AmountOff(float(match[1]), bool(match[2]))
+    if promotion_type == "PERCENTAGE_DISCOUNT" and (match := PERCENT_RULE.match(rule)):
+        percent = float(match[1])
+        return PercentOff(percent) if percent <= 100 else None
+    if promotion_type == "BXGY" and (match := BXGY_RULE.match(rule)):
+        buy, get = int(match[1]), int(match[2])
+        return BuyXGetY(buy, get) if buy > 0 and get > 0 else None
+    logger.debug("Rule %r of type %s gives no discount", rule, promotion_type)
+    return None
+
+
+def round_cents(amount: float) -> float:
+    """Rounds an amount to cents, half up
+
+    Written with the same float operations as the batch evaluation so both
+    round every discount exactly the same way.
+    """
+    return math.floor(amount * 100 + 0.5) / 100
+
+
+def parse_cart(data) -> tuple:
+    """Returns the lines and the date of a cart posted as a dictionary
+
+    Args:
+        data (dict): the items of the cart and an optional ISO on_date
+
+    Returns:
+        a tuple of the list of CartLines and the date, None for today
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("items"), list):
+        raise DataValidationError("Invalid cart: expected a list of items")
+    lines = [parse_line(position, item) for position, item in enumerate(data["items"])]
+    # the discounts of every line are summed and rounded to cents too
+    if not math.isfinite(sum(line.quantity * line.unit_price for line in lines) * 100):
+        raise DataValidationError("Invalid cart: the total of its items is too large")
+    on_date = data.get("on_date")
+    if on_date is None:
+        return lines, None
+    try:
+        return lines, date.fromisoformat(on_date)
+    except (TypeError, ValueError) as error:
+        raise DataValidationError(f"Invalid on_date: {on_date}") from error
+
+
+def parse_line(position: int, item) -> CartLine:
+    """Returns the CartLine of one item of a cart"""
+    try:
+        product_id, quantity, unit_price = item["product_id"], item["quantity"], item["unit_price"]
+    except (KeyError, TypeError) as error:
+        raise DataValidationError(
+            f"Invalid item {position}: expected product_id, quantity and unit_price"
+        ) from error
+    if not isinstance(product_id, int) or isinstance(product_id, bool):
+        raise DataValidationError(f"Invalid item {position}: product_id must be an integer")
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        raise DataValidationError(f"Invalid item {position}: quantity must be a positive integer")
+    if not isinstance(unit_price, (int, float)) or isinstance(unit_price, bool) or not _finite(unit_price) or unit_price < 0:
+        raise DataValidationError(f"Invalid item {position}: unit_price must be a non negative number")
+    # every discount is at most the line total, which is rounded to cents
+    if not _finite(quantity, unit_price, 100):
+        raise DataValidationError(f"Invalid item {position}: quantity times unit_price is too large")
+    return CartLine(product_id, quantity, float(unit_price))
+
+
+def _finite(*factors) -> bool:
+    """Returns True when the product of numbers is a float that is neither infinite nor NaN"""
+    try:
+        return math.isfinite(math.prod(float(factor) for factor in factors))
+    except OverflowError:
+        return False
+
+
+def evaluate(lines: list, promotions: dict) -> list:
+    """Returns the discount every matching Promotion gives every cart line
+
+    Args:
+        lines (list): the CartLines of the cart
+        promotions (dict): the serialized Promotions of each product_id
+
+    Returns:
+        a list of dictionaries with the position of the line, its product_id,
+        the promotion_id and the discount, for each discount above zero
+    """
+    discounts = []
+    for position, line in enumerate(lines):
+        for promotion in promotions.get(line.product_id, ()):
+            rule = compile_rule(promotion["promotion_type"], promotion["rule"])
+            discount = rule(line.quantity, line.unit_price) if rule else 0
+            if discount > 0:
+                discounts.append(
+                    {
+                        "line": position,
+                        "product_id": line.product_id,
+                        "promotion_id": promotion["id"],
+                        "discount": round_cents(discount),
+                    }
+                )
+    return discounts
@@ -0,0 +1,287 @@
+"""
+Promotion Stacking
+
+Picks the combination of Promotions that gives a cart the largest discount
+when they cannot all be applied at once. The stacking rules follow the
+PromotionTypes:
+
+    - a line takes at most one Promotion of each PromotionType
+    - they apply in the order BXGY, AMOUNT_DISCOUNT, PERCENTAGE_DISCOUNT,
+      each one to what the previous ones left to pay
+    - an AMOUNT_DISCOUNT that is not "each" is a coupon that is used on one
+      line of the cart only
+
+Every line has a few allowed combinations, but the coupons tie together the
+lines of the same product. Those lines are searched with a dynamic program
+over the coupons still in play, pruned with a bound from the greedy choice.
+When it runs out of time the greedy choice is returned instead, or the best
+choice of each line in turn when it runs out before it has even listed the
+combinations.
+"""
+import time
+import logging
+from itertools import product
+from typing import NamedTuple
+
+from service.rules import AmountOff, compile_rule, round_cents
+
+logger = logging.getLogger("flask.app")
+
+# The order the PromotionTypes of a combination apply in
+STACKING_ORDER = ("BXGY", "AMOUNT_DISCOUNT", "PERCENTAGE_DISCOUNT")
+
+
+class Option(NamedTuple):
+    """An allowed combination of Promotions on one line"""
+
+    value: float
+    coupons: frozenset
+    discounts: tuple  # (promotion_id, discount) pairs
+
+
+class Plan(NamedTuple):
+    """The Promotions applied to a cart"""
+
+    discounts: list
+    total: float
+    optimal: bool
+
+
+class _OutOfTime(Exception):
+    """Raised when the search runs past its deadline"""
+
+
+def line_options(line, promotions: list, out_of_time=None) -> list:
+    """Returns the allowed combinations of the Promotions of a line, best first
+
+    Args:
+        line (CartLine): the line of the cart
+        promotions (list): the serialized Promotions of its product
+        out_of_time: returns True once the search must stop, never by default
+
+    Returns:
+        a list of Options, the empty one included
+
+    Raises:
+        _OutOfTime: when out_of_time returns True before they are all listed
+    """
+    by_type = _candidates(line, promotions)
+    options = []
+    for combination in product(*([None] + candidates for candidates in by_type.values())):
+        if out_of_time is not None and len(options) % 256 == 0 and out_of_time():
+            raise _OutOfTime()
+        remaining = line.quantity * line.unit_price
+        discounts = []
+        coupons = set()
+        for promotion_id, rule in filter(None, combination):
+            # the rule sees the unit price of what is left to pay
+            discount = round_cents(rule(line.quantity, remaining / line.quantity))
+            remaining -= discount
+            discounts.append((promotion_id, discount))
+            if _is_coupon(rule):
+                coupons.add(promotion_id)
+        options.append(Option(round_cents(sum(discount for _, discount in discounts)), frozenset(coupons), tuple(discounts)))
+    # the most valuable first, and the fewest Promotions among equals
+    options.sort(key=lambda option: (-option.value, len(option.discounts)))
+    return options
+
+
+def optimize(lines: list, promotions: dict, budget: float, clock=time.monotonic) -> Plan:
+    """Returns the allowed combination of Promotions with the largest total discount
+
+    A line that cannot use a coupon is independent of the others, and taking
+    the largest discount of each PromotionType in turn is the best it can
+    do, so only the lines that can use a coupon are searched. When listing
+    their options or searching them takes longer than the budget, they fall
+    back to the greedy choice, or, if their options are not all listed yet,
+    to the best choice of each line in turn among the coupons left.
+
+    Args:
+        lines (list): the CartLines of the cart
+        promotions (dict): the serialized Promotions of each product_id
+        budget (float): the seconds the search may take before it falls back
+            to the greedy choice
+        clock: returns the current time in seconds, time.monotonic by default
+
+    Returns:
+        a Plan with the discounts ordered by line, and whether it is optimal
+    """
+    deadline = clock() + budget
+
+    def out_of_time():
+        return clock() > deadline
+
+    # the same product, quantity and price always have the same candidates and options
+    memo = {}
+    candidates = [
+        _memoized(memo, "candidates", line, lambda line: _candidates(line, promotions.get(line.product_id, ())))
+        for line in lines
+    ]
+    # only the lines that can use a coupon depend on each other
+    coupled = [
+        position for position, by_type in enumerate(candidates)
+        if any(_is_coupon(rule) for _, rule in by_type["AMOUNT_DISCOUNT"])
+    ]
+    searched = set(coupled)
+    chosen = [
+        None if position in searched else _stack(line, by_type, frozenset())
+        for position, (line, by_type) in enumerate(zip(lines, candidates))
+    ]
+    optimal = True
+    if coupled:
+        try:
+            picks, optimal = _search_coupled(lines, promotions, coupled, memo, out_of_time)
+        except _OutOfTime:
+            logger.warning("Stacking %d lines ran out of time listing their options, choosing line by line", len(lines))
+            picks, optimal = _sequential(lines, candidates, coupled), False
+        chosen = [picks.get(position, option) for position, option in enumerate(chosen)]
+    discounts = [
+        {"line": position, "product_id": line.product_id, "promotion_id": promotion_id, "discount": discount}
+        for position, (line, option) in enumerate(zip(lines, chosen))
+        for promotion_id, discount in option.discounts
+    ]
+    return Plan(discounts, round_cents(sum(option.value for option in chosen)), optimal)
+
+
+def _search_coupled(lines: list, promotions: dict, coupled: list, memo: dict, out_of_time) -> tuple:
+    """Returns the best options of the coupled lines, or the greedy choice when the search runs out of time
+
+    Returns:
+        a tuple of the options by position of the coupled lines and whether they are optimal
+
+    Raises:
+        _OutOfTime: when it runs out of time listing their options
+    """
+    options = {}
+    for position in coupled:
+        if out_of_time():
+            raise _OutOfTime()
+        options[position] = _memoized(
+            memo,
+            "options",
+            lines[position],
+            lambda line: line_options(line, promotions.get(line.product_id, ()), out_of_time),
+        )
+    greedy = _greedy(coupled, options)
+    try:
+        return dict(zip(coupled, _search(coupled, options, greedy, out_of_time))), True
+    except _OutOfTime:
+        logger.warning("Stacking %d lines ran out of time, using the greedy choice", len(lines))
+        return dict(zip(coupled, greedy)), False
+
+
+def _memoized(memo: dict, kind: str, line, compute):
+    """Returns what compute returns for a line, computed once per product, quantity and unit price"""
+    key = (kind, line.product_id, line.quantity, line.unit_price)
+    if key not in memo:
+        memo[key] = compute(line)
+    return memo[key]
+
+
+def _candidates(line, promotions: list) -> dict:
+    """Returns the (promotion_id, rule) of each Promotion of each PromotionType that gives a line a discount"""
+    by_type = {promotion_type: [] for promotion_type in STACKING_ORDER}
+    for promotion in promotions:
+        rule = compile_rule(promotion["promotion_type"], promotion["rule"])
+        if rule is not None and rule(line.quantity, line.unit_price) > 0:
+            by_type[promotion["promotion_type"]].append((promotion["id"], rule))
+    return by_type
+
+
+def _is_coupon(rule) -> bool:
+    """Returns True for the rules that can only be used on one line of a cart"""
+    return isinstance(rule, AmountOff) and not rule.each
+
+
+def _stack(line, by_type: dict, used) -> Option:
+    """Returns the Option of a line that takes the largest discount of each PromotionType in turn
+
+    Every later discount only depends on what is left to pay, and the less
+    is left the less it gets, so this is the best Option of the line among
+    the coupons that are not used.
+    """
+    remaining = line.quantity * line.unit_price
+    discounts = []
+    coupons = set()
+    for candidates in by_type.values():
+        scored = [
+            (round_cents(rule(line.quantity, remaining / line.quantity)), promotion_id, rule)
+            for promotion_id, rule in candidates
+            if promotion_id not in used
+        ]
+        discount, promotion_id, rule = max(scored, key=lambda item: item[0], default=(0, None, None))
+        if discount > 0:
+            remaining -= discount
+            discounts.append((promotion_id, discount))
+            if _is_coupon(rule):
+                coupons.add(promotion_id)
+    return Option(round_cents(sum(discount for _, discount in discounts)), frozenset(coupons), tuple(discounts))
+
+
+def _sequential(lines: list, candidates: list, coupled: list) -> dict:
+    """Returns the best Option by position of each coupled line in turn among the coupons the lines before left"""
+    used = set()
+    picks = {}
+    for position in coupled:
+        picks[position] = _stack(lines[position], candidates[position], used)
+        used |= picks[position].coupons
+    return picks
+
+
+def _greedy(coupled: list, options: dict) -> list:
+    """Returns the best option of each line whose coupons are still unused, best lines first"""
+    used = set()
+    picks = {}
+    for position in sorted(coupled, key=lambda position: -options[position][0].value):
+        option = next(option for option in options[position] if not option.coupons & used)
+        used |= option.coupons
+        picks[position] = option
+    return [picks[position] for position in coupled]
+
+
+def _suffixes(coupled: list, options: list) -> tuple:
+    """Returns the coupons the lines from each position on can use and the total of their best options"""
+    later = [frozenset()] * (len(coupled) + 1)
+    bound = [0.0] * (len(coupled) + 1)
+    for index in range(len(coupled) - 1, -1, -1):
+        choices = options[coupled[index]]
+        later[index] = later[index + 1].union(*(option.coupons for option in choices))
+        bound[index] = bound[index + 1] + choices[0].value
+    return later, bound
+
+
+def _search(coupled: list, options: list, greedy: list, out_of_time) -> list:
+    """Returns the best options of the coupled lines with a dynamic program
+
+    The states after each line are keyed by the coupons used so far that a
+    later line could still use, so lines that end up in the same state are
+    only searched once. A state that cannot beat the greedy choice even if
+    every later line took its best option is dropped.
+    """
+    # pylint: disable=too-many-locals
+    later, bound = _suffixes(coupled, options)
+    target = sum(option.value for option in greedy) - 1e-9
+    # used coupons -> (value, picks as a linked list of (option, previous))
+    states = {frozenset(): (0.0, None)}
+    for index, position in enumerate(coupled):
+        following = {}
+        for used, (value, picks) in states.items():
+            if out_of_time():
+                raise _OutOfTime()
+            for option in options[position]:
+                if option.coupons & used or value + option.value + bound[index + 1] < target:
+                    continue
+                key = (used | option.coupons) & later[index + 1]
+                if key not in following or following[key][0] < value + option.value:
+                    following[key] = (value + option.value, (option, picks))
+        states = following
+    return _unwind(max(states.values(), key=lambda state: state[0])[1])
+
+
+def _unwind(picks) -> list:
+    """Returns the options of a linked list of (option, previous) picks in order"""
+    chosen = []
+    while picks is not None:
+        option, picks = picks
+        chosen.append(option)
+    return chosen[::-1]
@@ -0,0 +1,95 @@
+"""
+Test cases for the batch evaluation of Promotions
+"""
+import random
+from datetime import date, timedelta
+from service.batch import PromotionSnapshot
+from service.models import Promotion, PromotionType
+from service.rules import CartLine, evaluate
+from tests.factories import PromotionFactory
+from tests.test_models import TestCaseBase
+
+RULES = [
+    ("AMOUNT_DISCOUNT", "5 off"),
+    ("AMOUNT_DISCOUNT", "$1.25 off each"),
+    ("PERCENTAGE_DISCOUNT", "15% off"),
+    ("PERCENTAGE_DISCOUNT", "33.3% off"),
+    ("BXGY", "buy 2 get 1 free"),
+    ("BXGY", "buy 1 get 1"),
+    ("UNKNOWN", "5 off"),
+    ("BXGY", "free stuff"),
+]
+
+
+def random_row(generator, by_id: int, today: date, base: int = 0) -> tuple:
+    """Returns a random snapshot row around today of a product from base"""
+    promotion_type, rule = generator.choice(RULES)
+    start_date = today + timedelta(days=generator.randrange(-10, 5))
+    end_date = start_date + timedelta(days=generator.randrange(0, 15))
+    return (by_id, base + generator.randrange(40), promotion_type, rule, start_date, end_date)
+
+
+def in_effect(rows, on_date: date) -> dict:
+    """Returns the Promotions of the rows in effect on a date by product, as rules.evaluate takes them"""
+    by_product = {}
+    for by_id, product_id, promotion_type, rule, start_date, end_date in rows:
+        if start_date <= on_date < end_date:
+            by_product.setdefault(product_id, []).append({"id": by_id, "promotion_type": promotion_type, "rule": rule})
+    return by_product
+
+
+######################################################################
+#  B A T C H   T E S T   C A S E S
+######################################################################
+class TestPromotionSnapshot(TestCaseBase):
+    """Test Cases for PromotionSnapshot"""
+
+    def test_evaluate_matches_scalar_evaluation(self):
+        """It should give exactly the discounts of the scalar evaluation"""
+        generator = random.Random(7)
+        today = date(2024, 3, 10)
+        # small product ids use the dense offsets and large ones the sorted search
+        for base in [0, 2**40]:
+            rows = [random_row(generator, by_id, today, base) for by_id in range(300)]
+            lines = [
+                CartLine(base + generator.randrange(-5, 45), generator.randrange(1, 9), generator.randrange(1, 5000) / 100)
+                for _ in range(500)
+            ]
+            self.assert_matches(PromotionSnapshot(rows), rows, lines, today)
+
+    def assert_matches(self, snapshot, rows, lines, today):
+        """Asserts that the snapshot evaluates the lines like rules.evaluate"""
+        for on_date in [today, today + timedelta(days=3)]:
+            expected = evaluate(lines, in_effect(rows, on_date))
+            positions, ids, discounts = snapshot.evaluate(
+                [line.product_id for line in lines],
+                [line.quantity for line in lines],
+                [line.unit_price for line in lines],
+                on_date,
+            )
+            self.assertEqual(
+                list(zip(positions.tolist(), ids.tolist(), discounts.tolist())),
+                [(item["line"], item["promotion_id"], item["discount"]) for item in expected],
+            )
+
+    def test_evaluate_nothing(self):
+        """It should evaluate an empty snapshot and an empty batch"""
+        positions, ids, discounts = PromotionSnapshot([]).evaluate([1], [1], [1.0], [date.today().toordinal()])
+        self.assertEqual((len(positions), len(ids), len(discounts)), (0, 0, 0))
+
+    def test_load(self):
+        """It should load the active Promotions of the database"""
+        today = date.today()
+        promotions = [
+            PromotionFactory(status=True, promotion_type=PromotionType.PERCENTAGE_DISCOUNT, rule="10% off"),
+            PromotionFactory(status=False, promotion_type=PromotionType.PERCENTAGE_DISCOUNT, rule="10% off"),
+            PromotionFactory(status=True, promotion_type=PromotionType.BXGY, rule="not a rule"),
+        ]
+        for promotion in promotions:
+            promotion.start_date = today
+            promotion.duration = 5
+        Promotion.create_many(promotions)
+        snapshot = PromotionSnapshot.load()
+        self.assertEqual(snapshot.ids.tolist(), [promotions[0].id])
+        positions, ids, discounts = snapshot.evaluate([promotions[0].product_id], [2], [5.0], today)
+        self.assertEqual((positions.tolist(), ids.tolist(), discounts.tolist()), ([0], [promotions[0].id], [1.0]))
@@ -0,0 +1,178 @@
+"""
+Test cases for the Bloom filters
+"""
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from service.common.bloom import CountingBloomFilter, KeyFilter, SATURATED
+
+
+######################################################################
+#  C O U N T I N G   B L O O M   F I L T E R   T E S T   C A S E S
+######################################################################
+class TestCountingBloomFilter(TestCase):
+    """Test Cases for CountingBloomFilter"""
+
+    def test_add_and_remove(self):
+        """It should find the keys that were added until they are removed"""
+        bloom = CountingBloomFilter(1000, 0.01)
+        for key in range(500):
+            bloom.add(key)
+        bloom.add(7, 2)
+        self.assertTrue(all(key in bloom for key in range(500)))
+        for key in range(100):
+            bloom.remove(key)
+        self.assertTrue(all(key in bloom for key in range(100, 500)))
+        self.assertIn(7, bloom)
+        bloom.remove(7, 2)
+        self.assertNotIn(7, bloom)
+
+    def test_false_positive_rate(self):
+        """It should find about error_rate of the keys never added when full"""
+        bloom = CountingBloomFilter(2000, 0.01)
+        self.assertEqual(bloom.false_positive_rate(), 0.0)
+        for key in range(2000):
+            bloom.add(key)
+        found = sum(key in bloom for key in range(10000, 30000))
+        self.assertLess(found / 20000, 0.02)
+        self.assertAlmostEqual(bloom.false_positive_rate(), 0.01, delta=0.005)
+        for key in range(2000):
+            bloom.remove(key)
+        self.assertEqual(bloom.false_positive_rate(), 0.0)
+
+    def test_saturated_counters(self):
+        """It should never remove a key from a saturated counter"""
+        bloom = CountingBloomFilter(10, 0.01)
+        bloom.add("a", SATURATED + 10)
+        bloom.remove("a", SATURATED + 10)
+        self.assertIn("a", bloom)
+
+
+######################################################################
+#  K E Y   F I L T E R   T E S T   C A S E S
+######################################################################
+class TestKeyFilter(TestCase):
+    """Test Cases for KeyFilter"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.loads = 0
+        self.rows = [(1, 2), (2, 1)]
+        self.spawned = []
+        self.filter = KeyFilter(error_rate=0.01, ttl=60, clock=lambda: self.now, spawn=self.spawned.append)
+
+    def load(self):
+        """Returns the (key, count) rows and counts the loads"""
+        self.loads += 1
+        return list(self.rows)
+
+    @staticmethod
+    def broken_load():
+        """Fails to load the rows"""
+        raise ConnectionError("Could not load the keys")
+
+    def test_might_contain(self):
+        """It should load the keys on the first lookup and count the negatives"""
+        self.assertEqual(self.filter.false_positive_rate(), 0.0)
+        self.assertTrue(self.filter.might_contain(1, self.load))
+        self.assertFalse(self.filter.might_contain(3, self.load))
+        self.assertEqual(self.loads, 1)
+        stats = self.filter.stats()
+        self.assertEqual((stats["lookups"], stats["negatives"]), (2, 1))
+        self.assertEqual(stats["capacity"], 1024)
+        self.assertLess(stats["false_positive_rate"], 0.01)
+        self.assertEqual(self.filter.false_positive_rate(), stats["false_positive_rate"])
+
+    def test_add_and_remove(self):
+        """It should follow the writes without reloading"""
+        self.filter.add([3])
+        self.assertFalse(self.filter.might_contain(3, self.load))
+        generation = self.filter.generation
+        self.filter.add([3])
+        self.filter.remove([2], generation)
+        self.assertTrue(self.filter.might_contain(3, self.load))
+        self.assertFalse(self.filter.might_contain(2, self.load))
+        self.assertEqual(self.loads, 1)
+
+    def test_remove_after_rebuild(self):
+        """It should not remove the rows of a write read before the filter was rebuilt"""
+        self.rows = [(1, 1), (2, 1)]
+        self.filter.might_contain(1, self.load)
+        generation = self.filter.generation
+        self.now = 60
+        self.filter.might_contain(1, self.load)
+        # the rebuild counts the rows once the write removed key 1
+        self.rows = [(2, 1)]
+        self.spawned.pop()()
+        self.filter.add([1])
+        self.filter.remove([1], generation)
+        self.assertTrue(self.filter.might_contain(1, self.load))
+
+    def test_rebuild_in_the_background(self):
+        """It should answer from the filter it has while it is rebuilt after the time to live"""
+        self.filter.might_contain(1, self.load)
+        self.rows = [(3, 1)]
+        self.now = 60
+        self.assertFalse(self.filter.might_contain(3, self.load))
+        self.assertFalse(self.filter.might_contain(3, self.load))
+        self.assertEqual((self.loads, len(self.spawned)), (1, 1))
+        self.spawned.pop()()
+        self.assertTrue(self.filter.might_contain(3, self.load))
+        self.assertFalse(self.filter.might_contain(1, self.load))
+        self.assertEqual((self.loads, self.spawned), (2, []))
+
+    def test_rebuild_after_writes(self):
+        """It should keep the keys added during a rebuild and drop a rebuild of a dropped filter"""
+        self.filter.might_contain(1, self.load)
+        self.now = 60
+        self.filter.might_contain(1, self.load)
+        # the rebuild read the rows before the write
+        self.filter.add([3])
+        self.spawned.pop()()
+        self.assertTrue(self.filter.might_contain(3, self.load))
+        self.now = 120
+        self.filter.might_contain(3, self.load)
+        self.filter.invalidate()
+        self.spawned.pop()()
+        self.assertEqual((self.loads, self.filter.stats()["capacity"]), (3, 0))
+        self.assertFalse(self.filter.might_contain(3, self.load))
+        self.assertEqual(self.loads, 4)
+
+    def test_rebuild_when_too_full(self):
+        """It should rebuild in the background as soon as it is too full"""
+        self.filter.might_contain(1, self.load)
+        self.filter.add(range(100, 5000))
+        self.assertEqual(self.spawned, [])
+        self.filter.might_contain(1, self.load)
+        self.spawned.pop()()
+        self.assertEqual(self.filter.stats()["capacity"], 1024)
+        self.assertEqual(self.loads, 2)
+
+    def test_rebuild_failure(self):
+        """It should keep the filter it has when a rebuild fails and retry after the next lookup"""
+        self.filter.might_contain(1, self.load)
+        self.now = 60
+        self.filter.might_contain(1, self.broken_load)
+        with patch("service.common.bloom.logger") as logger_mock:
+            self.spawned.pop()()
+        logger_mock.exception.assert_called_once()
+        self.assertTrue(self.filter.might_contain(1, self.load))
+        self.assertEqual(len(self.spawned), 1)
+
+    def test_rebuild_in_a_thread(self):
+        """It should rebuild in a thread of its own by default"""
+        key_filter = KeyFilter(ttl=0)
+        key_filter.might_contain(1, self.load)
+        deadline = time.monotonic() + 5
+        while self.loads < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.loads, 2)
+
+    def test_configure(self):
+        """It should drop the filter when configured"""
+        self.filter.might_contain(1, self.load)
+        self.filter.configure(0.001, 5)
+        stats = self.filter.stats()
+        self.assertEqual((stats["error_rate"], stats["ttl"], stats["size"]), (0.001, 5, 0))
+        self.filter.might_contain(1, self.load)
+        self.assertEqual(self.loads, 2)
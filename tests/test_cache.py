@@ -0,0 +1,81 @@
+"""
+Test cases for the in-process caches
+"""
+from unittest import TestCase
+from service.common.cache import LRUCache, Generation
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(TestCase):
+    """Test Cases for LRUCache"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=lambda: self.now)
+
+    def test_get_and_put(self):
+        """It should return stored values and count hits and misses"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("b", "missing"), "missing")
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.cache.get("a")
+        self.cache.put("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        """It should not return an entry older than its time to live"""
+        self.cache.put("a", 1)
+        self.now = 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_invalidate_and_clear(self):
+        """It should remove one entry or all of them"""
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.cache.invalidate("a")
+        self.cache.invalidate("missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), 2)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_configure(self):
+        """It should resize and empty the cache, and disable it at size 0"""
+        self.cache.put("a", 1)
+        self.cache.configure(0, 5)
+        self.assertEqual(self.cache.stats()["ttl"], 5)
+        self.cache.put("a", 1)
+        self.assertIsNone(self.cache.get("a"))
+
+
+######################################################################
+#  G E N E R A T I O N   T E S T   C A S E S
+######################################################################
+class TestGeneration(TestCase):
+    """Test Cases for Generation"""
+
+    def test_bump(self):
+        """It should start a new generation when bumped"""
+        generation = Generation()
+        self.assertEqual(generation.value, 0)
+        self.assertEqual(generation.bump(), 1)
+        self.assertEqual(generation.value, 1)
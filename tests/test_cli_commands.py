@@ -2,12 +2,16 @@
 CLI Command Extensions for Flask
 """
 import os
+from datetime import date
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
+from sqlalchemy import CheckConstraint, Column, Computed, Date, Integer, MetaData, Table
+from sqlalchemy.dialects import postgresql
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.common.cli_commands import db_create, db_upgrade, evaluate_carts  # noqa: E402
+from service.batch import PromotionSnapshot  # noqa: E402
 
 
 class TestFlaskCLI(TestCase):
@@ -23,3 +27,68 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.inspect')
+    @patch('service.common.cli_commands.db')
+    def test_db_upgrade(self, db_mock, inspect_mock):
+        """It should call the db-upgrade command"""
+        index_mock = MagicMock()
+        table = Table(
+            "promotion",
+            MetaData(),
+            Column("id", Integer),
+            Column("start_date", Date),
+            Column("end_date", Date, Computed("start_date + 1", persisted=True)),
+            CheckConstraint("id > 0", name="ck_promotion_id"),
+            CheckConstraint("start_date > '2000-01-01'", name="ck_promotion_start_date"),
+        )
+        table_mock = MagicMock(columns=table.columns, constraints=table.constraints, indexes=[index_mock])
+        table_mock.name = "promotion"
+        db_mock.metadata.sorted_tables = [table_mock]
+        db_mock.engine.dialect = postgresql.dialect()
+        inspect_mock.return_value.get_columns.return_value = [{"name": "id"}, {"name": "start_date"}]
+        inspect_mock.return_value.get_check_constraints.return_value = [{"name": "ck_promotion_id"}]
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(db_upgrade)
+            self.assertEqual(result.exit_code, 0)
+        db_mock.create_all.assert_called_once()
+        statements = [str(call.args[0]) for call in db_mock.session.execute.call_args_list]
+        self.assertEqual(
+            statements,
+            [
+                "ALTER TABLE promotion ADD COLUMN end_date DATE GENERATED ALWAYS AS (start_date + 1) STORED",
+                "ALTER TABLE promotion ADD CONSTRAINT ck_promotion_start_date CHECK (start_date > '2000-01-01') NOT VALID",
+            ],
+        )
+        index_mock.create.assert_called_once_with(bind=db_mock.engine, checkfirst=True)
+
+    @patch('service.batch.PromotionSnapshot.load')
+    def test_evaluate_carts(self, load_mock):
+        """It should evaluate the cart lines of a CSV file"""
+        today = date.today()
+        load_mock.return_value = PromotionSnapshot(
+            [(1, 7, "PERCENTAGE_DISCOUNT", "10% off", date(2024, 3, 1), date(2024, 3, 5)),
+             (2, 7, "BXGY", "buy 1 get 1", today, date.fromordinal(today.toordinal() + 1))]
+        )
+        lines = (
+            "cart_id,product_id,quantity,unit_price,on_date\n"
+            "a,7,2,5.5,2024-03-02\n"
+            "a,8,1,3,2024-03-02\n"
+            "b,7,4,2,\n"
+        )
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            with self.runner.isolated_filesystem():
+                with open("lines.csv", "w", encoding="utf-8") as file:
+                    file.write(lines)
+                result = self.runner.invoke(evaluate_carts, ["lines.csv", "discounts.csv"])
+                self.assertEqual(result.exit_code, 0, result.output)
+                with open("discounts.csv", encoding="utf-8") as file:
+                    output = file.read().splitlines()
+        self.assertEqual(
+            output,
+            [
+                "cart_id,line,product_id,promotion_id,discount",
+                "a,0,7,1,1.1",
+                "b,2,7,2,4.0",
+            ],
+        )
@@ -0,0 +1,146 @@
+"""
+Test cases for the interval indexes
+"""
+import time
+import random
+from unittest import TestCase
+from unittest.mock import patch
+from service.common.intervals import IntervalTree, IntervalIndex
+
+
+######################################################################
+#  I N T E R V A L   T R E E   T E S T   C A S E S
+######################################################################
+class TestIntervalTree(TestCase):
+    """Test Cases for IntervalTree"""
+
+    def test_at(self):
+        """It should find the half open intervals that contain a point"""
+        tree = IntervalTree([(1, 5, "a"), (3, 8, "b"), (5, 6, "c"), (4, 4, "empty")])
+        self.assertEqual(tree.at(0), [])
+        self.assertEqual(sorted(tree.at(1)), ["a"])
+        self.assertEqual(sorted(tree.at(4)), ["a", "b"])
+        self.assertEqual(sorted(tree.at(5)), ["b", "c"])
+        self.assertEqual(sorted(tree.at(8)), [])
+        self.assertEqual(IntervalTree([]).at(1), [])
+
+    def test_at_matches_a_scan(self):
+        """It should find the same intervals as scanning all of them"""
+        generator = random.Random(42)
+        intervals = []
+        for value in range(500):
+            start = generator.randrange(100)
+            intervals.append((start, start + generator.randrange(20), value))
+        tree = IntervalTree(intervals)
+        for point in range(-1, 125):
+            expected = [value for start, end, value in intervals if start <= point < end]
+            self.assertEqual(sorted(tree.at(point)), expected)
+
+
+######################################################################
+#  I N T E R V A L   I N D E X   T E S T   C A S E S
+######################################################################
+class TestIntervalIndex(TestCase):
+    """Test Cases for IntervalIndex"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.rows = {1: ("p", 0, 10), 2: ("p", 5, 15), 3: ("q", 0, 10)}
+        self.loads = []
+        self.spawned = []
+        self.index = IntervalIndex(ttl=60, clock=lambda: self.now, spawn=self.spawned.append)
+
+    def load(self, ids):
+        """Returns the rows with the ids, or all of them for None"""
+        self.loads.append(ids)
+        wanted = self.rows if ids is None else [by_id for by_id in ids if by_id in self.rows]
+        return [(by_id, *self.rows[by_id]) for by_id in wanted]
+
+    @staticmethod
+    def broken_load(ids):
+        """Fails to load the rows"""
+        raise ConnectionError(f"Could not load {ids}")
+
+    def test_find(self):
+        """It should find the ids of a key in effect at a point, loading once"""
+        self.assertEqual(sorted(self.index.find("p", 7, self.load)), [1, 2])
+        self.assertEqual(self.index.find("q", 12, self.load), [])
+        self.assertEqual(self.index.find("r", 1, self.load), [])
+        self.assertEqual(self.loads, [None])
+
+    def test_invalidate_ids(self):
+        """It should only reload the invalidated ids"""
+        self.index.find("p", 7, self.load)
+        self.rows[1] = ("q", 0, 10)
+        del self.rows[2]
+        self.rows[4] = ("p", 6, 8)
+        self.index.invalidate([1, 2, 4])
+        self.assertEqual(self.index.find("p", 7, self.load), [4])
+        self.assertEqual(sorted(self.index.find("q", 7, self.load)), [1, 3])
+        self.assertEqual(self.loads[0], None)
+        self.assertEqual(sorted(self.loads[1]), [1, 2, 4])
+
+    def test_reload_everything(self):
+        """It should reload everything when invalidated or reconfigured"""
+        self.index.find("p", 7, self.load)
+        self.index.invalidate()
+        self.index.find("p", 7, self.load)
+        self.index.configure(30)
+        self.index.find("p", 7, self.load)
+        self.assertEqual(self.loads, [None, None, None])
+        self.assertEqual(self.spawned, [])
+
+    def test_reload_in_the_background(self):
+        """It should answer from the rows it has while it reloads everything once expired"""
+        self.index.find("p", 7, self.load)
+        self.rows[4] = ("p", 6, 8)
+        self.now = 60
+        self.assertEqual(sorted(self.index.find("p", 7, self.load)), [1, 2])
+        self.assertEqual(sorted(self.index.find("p", 7, self.load)), [1, 2])
+        self.assertEqual((self.loads, len(self.spawned)), ([None], 1))
+        self.spawned.pop()()
+        self.assertEqual(sorted(self.index.find("p", 7, self.load)), [1, 2, 4])
+        self.assertEqual((self.loads, self.spawned), ([None, None], []))
+
+    def test_reload_in_the_background_after_writes(self):
+        """It should reload again the ids written during a reload and drop a reload of dropped rows"""
+        self.index.find("p", 7, self.load)
+        self.now = 60
+        self.index.find("p", 7, self.load)
+        rows = dict(self.rows)
+        del self.rows[2]
+        self.index.invalidate([2])
+        self.assertEqual(self.index.find("p", 7, self.load), [1])
+        # the reload read the rows before the write
+        self.rows, rows = rows, self.rows
+        self.spawned.pop()()
+        self.rows = rows
+        self.assertEqual(self.index.find("p", 7, self.load), [1])
+        self.assertEqual(self.loads, [None, [2], None, [2]])
+        self.now = 120
+        self.index.find("p", 7, self.load)
+        self.index.invalidate()
+        self.spawned.pop()()
+        self.assertEqual(self.loads[-1:], [None])
+        self.assertEqual(self.index.find("p", 7, self.load), [1])
+        self.assertEqual(self.loads[-2:], [None, None])
+
+    def test_reload_failure(self):
+        """It should keep the rows it has when a reload fails and retry after the next lookup"""
+        self.index.find("p", 7, self.load)
+        self.now = 60
+        self.index.find("p", 7, self.broken_load)
+        with patch("service.common.intervals.logger") as logger_mock:
+            self.spawned.pop()()
+        logger_mock.exception.assert_called_once()
+        self.assertEqual(sorted(self.index.find("p", 7, self.load)), [1, 2])
+        self.assertEqual(len(self.spawned), 1)
+
+    def test_reload_in_a_thread(self):
+        """It should reload in a thread of its own by default"""
+        index = IntervalIndex(ttl=0)
+        index.find("p", 7, self.load)
+        deadline = time.monotonic() + 5
+        while len(self.loads) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.loads, [None, None])
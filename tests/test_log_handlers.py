@@ -0,0 +1,138 @@
+"""
+Test cases for the log handlers
+"""
+import io
+import json
+import queue
+import time
+import logging
+from unittest import TestCase
+from flask import Flask
+from service.common.log_handlers import (
+    MODULE_LOGGER,
+    JsonFormatter,
+    RecordQueueHandler,
+    RecordQueueListener,
+    SamplingFilter,
+    init_logging,
+    parse_sample_rates,
+)
+
+
+def make_record(level: int = logging.INFO, msg: str = "Found %d of %s", args=(3, "them"), exc_info=None):
+    """Returns a log record of this module"""
+    return logging.LogRecord("test", level, __file__, 1, msg, args, exc_info)
+
+
+def make_error_record():
+    """Returns an error record with the traceback of a KeyError"""
+    try:
+        raise KeyError("missing")
+    except KeyError as error:
+        return make_record(logging.ERROR, "Failed", (), (KeyError, error, error.__traceback__))
+
+
+######################################################################
+#  F O R M A T T E R   A N D   F I L T E R   T E S T   C A S E S
+######################################################################
+class TestLogRecords(TestCase):
+    """Test Cases for JsonFormatter, RecordQueueHandler and SamplingFilter"""
+
+    def test_json_formatter(self):
+        """It should format a record as a JSON line with its traceback"""
+        entry = json.loads(JsonFormatter().format(make_record()))
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], "test")
+        self.assertEqual(entry["module"], "test_log_handlers")
+        self.assertEqual(entry["message"], "Found 3 of them")
+        self.assertNotIn("exception", entry)
+        entry = json.loads(JsonFormatter().format(make_error_record()))
+        self.assertIn("KeyError: 'missing'", entry["exception"])
+
+    def test_prepare_a_record_for_the_queue(self):
+        """It should merge the arguments and keep the traceback as text on the queue"""
+        handler = RecordQueueHandler(None)
+        names = ["them"]
+        record = handler.prepare(make_record(args=(3, names)))
+        names.append("others")
+        self.assertEqual((record.msg, record.args), ("Found 3 of ['them']", None))
+        record = handler.prepare(make_error_record())
+        self.assertIsNone(record.exc_info)
+        self.assertIn("KeyError: 'missing'", json.loads(JsonFormatter().format(record))["exception"])
+
+    def test_write_in_batches(self):
+        """It should write the records queued in each interval until it is stopped"""
+        records = queue.SimpleQueue()
+        stream = io.StringIO()
+        listener = RecordQueueListener(records, logging.StreamHandler(stream), interval=0.01)
+        listener.start()
+        RecordQueueHandler(records).handle(make_record())
+        deadline = time.monotonic() + 5
+        while not stream.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(stream.getvalue(), "Found 3 of them\n")
+        RecordQueueHandler(records).handle(make_record(msg="Left %s %s"))
+        listener.stop()
+        self.assertEqual(stream.getvalue(), "Found 3 of them\nLeft 3 them\n")
+
+    def test_sampling_filter(self):
+        """It should keep the share of the records of the sampled levels and all the others"""
+        samples = iter([0.05, 0.5, 0.15])
+        sampling = SamplingFilter({logging.INFO: 0.1, logging.DEBUG: 0.0}, lambda: next(samples))
+        self.assertTrue(sampling.filter(make_record(logging.INFO)))
+        self.assertFalse(sampling.filter(make_record(logging.INFO)))
+        self.assertFalse(sampling.filter(make_record(logging.DEBUG)))
+        self.assertTrue(sampling.filter(make_record(logging.WARNING)))
+
+    def test_parse_sample_rates(self):
+        """It should parse the sample rates of the levels"""
+        self.assertEqual(parse_sample_rates(""), {})
+        self.assertEqual(parse_sample_rates("info=0.1, DEBUG=0,"), {logging.INFO: 0.1, logging.DEBUG: 0.0})
+        for text in ("LOUD=0.5", "INFO=2", "INFO=some", "INFO"):
+            self.assertRaises(ValueError, parse_sample_rates, text)
+
+
+######################################################################
+#  I N I T   L O G G I N G   T E S T   C A S E S
+######################################################################
+class TestInitLogging(TestCase):
+    """Test Cases for init_logging"""
+
+    def setUp(self):
+        self.module_logger = logging.getLogger(MODULE_LOGGER)
+        self.saved = (self.module_logger.handlers, self.module_logger.filters[:], self.module_logger.propagate)
+        self.app = Flask("log_handlers_test")
+        self.stream = io.StringIO()
+        self.sink = logging.getLogger("log_handlers_test.sink")
+        self.sink.handlers = [logging.StreamHandler(self.stream)]
+        self.sink.setLevel(logging.INFO)
+        # the route tests disable logging for the whole process
+        self.disabled = logging.root.manager.disable
+        logging.disable(logging.NOTSET)
+
+    def tearDown(self):
+        logging.disable(self.disabled)
+        self.module_logger.handlers, self.module_logger.filters, self.module_logger.propagate = self.saved
+        self.module_logger.setLevel(logging.NOTSET)
+
+    def test_log_through_the_queue(self):
+        """It should write the records of the app and the modules as JSON lines from a thread"""
+        listener = init_logging(self.app, self.sink.name, {logging.INFO: 0.0})
+        self.app.logger.info("Sampled out")
+        self.app.logger.warning("Listed %d", 5)
+        self.module_logger.error("Not found")
+        listener.stop()
+        entries = [json.loads(line) for line in self.stream.getvalue().splitlines()]
+        self.assertEqual([entry["message"] for entry in entries], ["Listed 5", "Not found"])
+        self.assertEqual([entry["logger"] for entry in entries], ["log_handlers_test", MODULE_LOGGER])
+        listener = init_logging(self.app, self.sink.name)
+        self.app.logger.info("Kept")
+        listener.stop()
+        self.assertIn('"message": "Kept"', self.stream.getvalue())
+
+    def test_log_to_stderr_without_handlers(self):
+        """It should write to stderr when the logger it is given has no handlers"""
+        listener = init_logging(self.app, "log_handlers_test.none")
+        self.assertIsInstance(listener.handlers[0], logging.StreamHandler)
+        self.assertIsInstance(listener.handlers[0].formatter, JsonFormatter)
+        listener.stop()
@@ -0,0 +1,126 @@
+"""
+Test cases for the request metrics
+"""
+import os
+import json
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from service.common.metrics import (
+    MetricsRegistry,
+    REQUESTS,
+    REQUEST_DURATION,
+    IN_FLIGHT,
+    PRODUCT_FILTER_FALSE_POSITIVE_RATE,
+)
+
+LABELS = (("endpoint", "/api/promotions"), ("method", "GET"))
+
+
+######################################################################
+#  M E T R I C S   R E G I S T R Y   T E S T   C A S E S
+######################################################################
+class TestMetricsRegistry(TestCase):
+    """Test Cases for MetricsRegistry"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.registry = MetricsRegistry(buckets=(0.1, 1.0), clock=lambda: self.now)
+
+    def test_render(self):
+        """It should render counters, gauges and cumulative histograms in the text format"""
+        self.registry.inc(REQUESTS, LABELS + (("status", "200"),))
+        self.registry.inc(REQUESTS, LABELS + (("status", "200"),), 2)
+        self.registry.inc(IN_FLIGHT, LABELS)
+        self.registry.inc(IN_FLIGHT, LABELS, -1)
+        for value in (0.05, 0.1, 0.5, 3.0):
+            self.registry.observe(REQUEST_DURATION, LABELS, value)
+        lines = self.registry.render().splitlines()
+        self.assertIn("# TYPE promotion_http_requests_total counter", lines)
+        self.assertIn('promotion_http_requests_total{endpoint="/api/promotions",method="GET",status="200"} 3', lines)
+        self.assertIn('promotion_http_requests_in_flight{endpoint="/api/promotions",method="GET"} 0', lines)
+        histogram = [line for line in lines if line.startswith("promotion_http_request_duration_seconds_")]
+        self.assertEqual(
+            histogram,
+            [
+                'promotion_http_request_duration_seconds_bucket{endpoint="/api/promotions",method="GET",le="0.1"} 2',
+                'promotion_http_request_duration_seconds_bucket{endpoint="/api/promotions",method="GET",le="1"} 3',
+                'promotion_http_request_duration_seconds_bucket{endpoint="/api/promotions",method="GET",le="+Inf"} 4',
+                'promotion_http_request_duration_seconds_sum{endpoint="/api/promotions",method="GET"} 3.65',
+                'promotion_http_request_duration_seconds_count{endpoint="/api/promotions",method="GET"} 4',
+            ],
+        )
+        self.registry.set(PRODUCT_FILTER_FALSE_POSITIVE_RATE, (("worker", "1"),), 0.5)
+        self.registry.set(PRODUCT_FILTER_FALSE_POSITIVE_RATE, (("worker", "1"),), 0.25)
+        self.assertIn('promotion_product_filter_false_positive_rate{worker="1"} 0.25', self.registry.render().splitlines())
+        self.registry.clear()
+        self.assertNotIn("promotion_http_requests_total{", self.registry.render())
+
+    def test_escape_label_values(self):
+        """It should escape the backslashes, quotes and line feeds of label values"""
+        registry = MetricsRegistry({"odd_total": ("counter", "Odd labels")})
+        registry.inc("odd_total", (("path", 'a\\b"c\nd'),))
+        self.assertIn('odd_total{path="a\\\\b\\"c\\nd"} 1', registry.render().splitlines())
+        registry.inc("plain_total")
+        registry.families["plain_total"] = ("counter", "No labels")
+        self.assertIn("plain_total 1", registry.render().splitlines())
+
+    def test_sum_the_workers(self):
+        """It should sum the files of the other workers and leave out the gauges of dead ones"""
+        with tempfile.TemporaryDirectory() as directory:
+            self.registry.configure(directory, 5)
+            self.registry.inc(REQUESTS, LABELS)
+            self.registry.inc(IN_FLIGHT, LABELS)
+            self.registry.observe(REQUEST_DURATION, LABELS, 0.5)
+            self.registry.flush()
+            with open(os.path.join(directory, f"{os.getpid()}.json"), encoding="utf-8") as file:
+                self.assertEqual(len(json.load(file)), 3)
+            # a live worker, a dead one and a file that is not valid
+            rows = [
+                [REQUESTS, [list(pair) for pair in LABELS], 2],
+                [IN_FLIGHT, [list(pair) for pair in LABELS], 1],
+                [REQUEST_DURATION, [list(pair) for pair in LABELS], [1, 0, 0, 0.25]],
+                ["unknown_total", [], 1],
+            ]
+            for pid in (os.getppid(), 2**22 + 1):
+                with open(os.path.join(directory, f"{pid}.json"), "w", encoding="utf-8") as file:
+                    json.dump(rows, file)
+            with open(os.path.join(directory, "1.json"), "w", encoding="utf-8") as file:
+                file.write("{")
+            with patch("service.common.metrics.os.kill", side_effect=self.kill):
+                samples = self.registry.collect()
+            self.assertEqual(samples[(REQUESTS, LABELS)], 5)
+            self.assertEqual(samples[(IN_FLIGHT, LABELS)], 2)
+            self.assertEqual(samples[(REQUEST_DURATION, LABELS)], [2, 1, 0, 1.0])
+            self.assertNotIn(("unknown_total", ()), samples)
+
+    @staticmethod
+    def kill(pid, _signal):
+        """Stands in for os.kill when only the parent process is running"""
+        if pid != os.getppid():
+            raise ProcessLookupError()
+
+    def test_flush_interval(self):
+        """It should write the file of a worker at most once per flush interval"""
+        self.registry.flush()
+        with tempfile.TemporaryDirectory() as directory:
+            self.registry.configure(directory, 5)
+            path = os.path.join(directory, f"{os.getpid()}.json")
+            self.registry.flush()
+            self.registry.inc(REQUESTS, LABELS)
+            self.now = 4
+            self.registry.flush()
+            with open(path, encoding="utf-8") as file:
+                self.assertEqual(json.load(file), [])
+            self.registry.flush(force=True)
+            with open(path, encoding="utf-8") as file:
+                self.assertEqual(len(json.load(file)), 1)
+
+    @patch("service.common.metrics.os.kill", side_effect=PermissionError())
+    def test_workers_of_other_users(self, _kill_mock):
+        """It should count a worker it may not signal as running"""
+        with tempfile.TemporaryDirectory() as directory:
+            self.registry.configure(directory, 5)
+            with open(os.path.join(directory, "12345.json"), "w", encoding="utf-8") as file:
+                json.dump([[IN_FLIGHT, [], 1]], file)
+            self.assertEqual(self.registry.collect(), {(IN_FLIGHT, ()): 1})
@@ -4,11 +4,24 @@ Test cases for Promotion Model
 
 import os
 import logging
+import threading
+import time
 from unittest import TestCase
 from unittest.mock import patch
-from datetime import date
+from datetime import date, timedelta
+from sqlalchemy import delete, insert, inspect, text, update
 from wsgi import app
-from service.models import Promotion, PromotionType, DataValidationError, db
+from service.models import (
+    Promotion,
+    PromotionType,
+    DataValidationError,
+    VersionConflictError,
+    db,
+    promotion_cache,
+    promotion_generation,
+    effective_index,
+    product_filter,
+)
 from tests.factories import PromotionFactory
 
 DATABASE_URI = os.getenv(
@@ -41,6 +54,9 @@ class TestCaseBase(TestCase):
         """This runs before each test"""
         db.session.query(Promotion).delete()  # clean up the last tests
         db.session.commit()
+        promotion_cache.clear()
+        effective_index.invalidate()
+        product_filter.invalidate()
 
     def tearDown(self):
         """This runs after each test"""
@@ -100,6 +116,19 @@ class TestPromotionModel(TestCaseBase):
         promotions = Promotion.all()
         self.assertEqual(len(promotions), 1)
 
+    def test_create_many_promotions(self):
+        """It should Create many Promotions in one transaction"""
+        promotions = PromotionFactory.create_batch(5)
+        Promotion.create_many(promotions)
+        for promotion in promotions:
+            self.assertIsNotNone(promotion.id)
+        self.assertEqual(
+            sorted(promotion.id for promotion in Promotion.all()),
+            sorted(promotion.id for promotion in promotions),
+        )
+        Promotion.create_many([])
+        self.assertEqual(len(Promotion.all()), 5)
+
     def test_read_a_promotion(self):
         """It should Read a Promotion"""
         promotion = PromotionFactory()
@@ -206,6 +235,233 @@ class TestPromotionModel(TestCaseBase):
         self.assertIn("status", data)
         self.assertEqual(data["status"], promotion.status)
 
+    def test_serialize_rows(self):
+        """It should serialize Promotions straight from rows like serialize does"""
+        promotions = PromotionFactory.create_batch(5)
+        Promotion.create_many(promotions)
+        expected = sorted((promotion.serialize() for promotion in promotions), key=lambda item: item["id"])
+        rows = list(Promotion.serialize_rows(Promotion.query.order_by(Promotion.id)))
+        self.assertEqual(rows, expected)
+        self.assertEqual([list(row) for row in rows], [list(item) for item in expected])
+        rows = list(Promotion.serialize_rows(Promotion.query.order_by(Promotion.id), ["rule", "id"]))
+        self.assertEqual(rows, [{"rule": item["rule"], "id": item["id"]} for item in expected])
+
+    def test_find_serialized(self):
+        """It should Find a serialized Promotion by ID"""
+        promotion = PromotionFactory()
+        promotion.create()
+        self.assertEqual(Promotion.find_serialized(promotion.id), promotion.serialize())
+        self.assertEqual(Promotion.find_serialized(str(promotion.id), ["name"]), {"name": promotion.name})
+        self.assertIsNone(Promotion.find_serialized(0))
+        self.assertIsNone(Promotion.find_serialized("abc"))
+
+    def test_find_serialized_is_cached(self):
+        """It should serve repeated lookups of a Promotion from the cache"""
+        promotion = PromotionFactory()
+        promotion.create()
+        expected = promotion.serialize()
+        self.assertEqual(Promotion.find_serialized(promotion.id), expected)
+        hits = promotion_cache.hits
+        with patch("service.models.Promotion.serialize_rows") as serialize_rows_mock:
+            found = Promotion.find_serialized(promotion.id)
+            self.assertEqual(Promotion.find_serialized(promotion.id, ["name"]), {"name": promotion.name})
+        serialize_rows_mock.assert_not_called()
+        self.assertEqual(promotion_cache.hits, hits + 2)
+        # changing the result must not change the cached Promotion
+        found["name"] = "changed"
+        self.assertEqual(Promotion.find_serialized(promotion.id), expected)
+
+    def test_find_serialized_many(self):
+        """It should Find many serialized Promotions by ID with one query for the uncached ones"""
+        promotions = PromotionFactory.create_batch(3)
+        Promotion.create_many(promotions)
+        first, second, third = [promotion.id for promotion in promotions]
+        Promotion.find_serialized(first)
+        hits = promotion_cache.hits
+        found = Promotion.find_serialized_many([second, first, 0, second, third])
+        self.assertEqual(list(found), [first, second, third])
+        self.assertEqual(found[second], promotions[1].serialize())
+        self.assertEqual(promotion_cache.hits, hits + 1)
+        with patch("service.models.Promotion.serialize_rows") as serialize_rows_mock:
+            found = Promotion.find_serialized_many([first, third], ["name"])
+        serialize_rows_mock.assert_not_called()
+        self.assertEqual(found, {first: {"name": promotions[0].name}, third: {"name": promotions[2].name}})
+
+    def test_serialize_groups(self):
+        """It should serialize the Promotions of a query grouped by a field"""
+        promotions = [PromotionFactory(product_id=product_id) for product_id in [7, 8, 7]]
+        Promotion.create_many(promotions)
+        query = Promotion.find_by_product_id([7, 8, 9])
+        groups = Promotion.serialize_groups(query, "product_id")
+        self.assertEqual(
+            groups,
+            {7: [promotions[0].serialize(), promotions[2].serialize()], 8: [promotions[1].serialize()]},
+        )
+        groups = Promotion.serialize_groups(query, "product_id", ["id"])
+        self.assertEqual(groups, {7: [{"id": promotions[0].id}, {"id": promotions[2].id}], 8: [{"id": promotions[1].id}]})
+
+    def test_writes_bump_the_generation(self):
+        """It should start a new generation on every write"""
+        generation = promotion_generation.value
+        promotion = PromotionFactory(status=True)
+        promotion.create()
+        promotion.deactivate()
+        Promotion.create_many(PromotionFactory.create_batch(2))
+        Promotion.delete_where(ids=[promotion.id])
+        self.assertEqual(promotion_generation.value, generation + 4)
+
+    def test_set_status(self):
+        """It should set the status of a Promotion in one statement and skip it when unchanged"""
+        promotion = PromotionFactory(status=False)
+        promotion.create()
+        expected = promotion.serialize()
+        Promotion.find_serialized(promotion.id)
+        generation = promotion_generation.value
+        found = Promotion.set_status(promotion.id, True)
+        self.assertEqual(found, {**expected, "status": True})
+        self.assertEqual(promotion_generation.value, generation + 1)
+        self.assertTrue(Promotion.find_serialized(promotion.id)["status"])
+        # nothing is written the second time
+        found = Promotion.set_status(str(promotion.id), True, ["id", "status"])
+        self.assertEqual(found, {"id": promotion.id, "status": True})
+        self.assertEqual(promotion_generation.value, generation + 1)
+        self.assertIsNone(Promotion.set_status(0, False))
+        self.assertIsNone(Promotion.set_status("abc", False))
+
+    def test_set_status_after_concurrent_write(self):
+        """It should return the status another transaction committed while it waited for the row"""
+        promotion = PromotionFactory(status=False)
+        promotion.create()
+        found = []
+
+        def activate():
+            with app.app_context():
+                found.append(Promotion.set_status(promotion.id, True, ["status", "version"]))
+
+        with db.engine.connect() as connection:
+            connection.execute(
+                update(Promotion).where(Promotion.id == promotion.id).values(status=True, version=Promotion.version + 1)
+            )
+            thread = threading.Thread(target=activate)
+            thread.start()
+            # commit only once the UPDATE of set_status waits for the row lock
+            waiting = text("SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'")
+            while not self._scalar(waiting):
+                time.sleep(0.01)
+            connection.commit()
+            thread.join()
+        self.assertEqual(found, [{"status": True, "version": 2}])
+
+    @staticmethod
+    def _scalar(statement):
+        """Returns the scalar of a statement run in a transaction of its own"""
+        with db.engine.connect() as connection:
+            return connection.execute(statement).scalar()
+
+    def test_patch(self):
+        """It should change only the given fields of a Promotion in one statement"""
+        promotion = PromotionFactory(product_id=1001, duration=5)
+        promotion.create()
+        expected = promotion.serialize()
+        Promotion.find_serialized(promotion.id)
+        self.assertTrue(Promotion.may_have_product(1001))
+        found = Promotion.patch(promotion.id, {"duration": 10, "rule": "10% off"})
+        end_date = (promotion.start_date + timedelta(days=10)).isoformat()
+        self.assertEqual(found, {**expected, "duration": 10, "end_date": end_date, "rule": "10% off"})
+        self.assertEqual(Promotion.find_serialized(promotion.id), found)
+        # the product_id it moves away from leaves the product filter
+        found = Promotion.patch(str(promotion.id), {"product_id": 1002}, ["id", "product_id"])
+        self.assertEqual(found, {"id": promotion.id, "product_id": 1002})
+        self.assertFalse(Promotion.may_have_product(1001))
+        self.assertTrue(Promotion.may_have_product(1002))
+        self.assertIsNone(Promotion.patch(0, {"status": False}))
+        self.assertIsNone(Promotion.patch("abc", {"status": False}))
+
+    def test_patch_with_bad_data(self):
+        """It should not patch a Promotion with fields that are not valid"""
+        promotion = PromotionFactory()
+        promotion.create()
+        for data in (
+            {},
+            [],
+            {"id": 5},
+            {"end_date": "2024-01-01"},
+            {"name": 5},
+            {"start_date": "tomorrow"},
+            {"duration": "5"},
+            {"duration": True},
+            {"promotion_type": "FREE"},
+            {"product_id": 1.5},
+            {"status": "yes"},
+            {"start_date": "9999-12-30", "duration": 5},
+            {"duration": 1000000000},
+            {"start_date": "9999-12-30"},
+            {"start_date": "0001-01-01", "duration": -1},
+        ):
+            self.assertRaises(DataValidationError, Promotion.patch, promotion.id, data)
+        self.assertEqual(Promotion.find_serialized(promotion.id), promotion.serialize())
+
+    def test_version(self):
+        """It should count the writes of a Promotion and refuse writes of an older version"""
+        promotion = PromotionFactory(status=True)
+        promotion.create()
+        self.assertEqual(promotion.version, 1)
+        promotion.rule = "10% off"
+        promotion.update()
+        self.assertEqual(promotion.version, 2)
+        promotion.deactivate()
+        self.assertEqual(promotion.version, 3)
+        self.assertEqual(Promotion.patch(promotion.id, {"duration": 3}, ["version"], versions=[3]), {"version": 4})
+        Promotion.set_status_where(True, ids=[promotion.id])
+        self.assertEqual(Promotion.find_serialized(promotion.id, ["version"]), {"version": 5})
+        # a write of a version that was read before is refused
+        self.assertRaises(VersionConflictError, Promotion.patch, promotion.id, {"duration": 9}, versions=[4])
+        self.assertIsNone(Promotion.patch(0, {"duration": 9}, versions=[4]))
+        # another writer changes the Promotion after it was read
+        promotion = Promotion.find(promotion.id)
+        self.assertEqual(promotion.version, 5)
+        self.write_elsewhere(promotion.id)
+        promotion.name = "stale"
+        self.assertRaises(VersionConflictError, promotion.update)
+        promotion = Promotion.find(promotion.id)
+        self.write_elsewhere(promotion.id)
+        self.assertRaises(VersionConflictError, promotion.delete)
+        self.assertEqual(Promotion.find(promotion.id).version, 7)
+
+    @staticmethod
+    def write_elsewhere(by_id):
+        """Bumps the version of a Promotion from another connection"""
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(Promotion).where(Promotion.id == by_id).values(version=Promotion.version + 1)
+            )
+
+    def test_writes_invalidate_the_cache(self):
+        """It should not serve a cached Promotion after it was changed"""
+        promotion = PromotionFactory(status=True)
+        promotion.create()
+        Promotion.find_serialized(promotion.id)
+        promotion.deactivate()
+        self.assertFalse(Promotion.find_serialized(promotion.id)["status"])
+        promotion.activate()
+        self.assertTrue(Promotion.find_serialized(promotion.id)["status"])
+        promotion.name = "renamed"
+        promotion.update()
+        self.assertEqual(Promotion.find_serialized(promotion.id)["name"], "renamed")
+        Promotion.set_status_where(False, ids=[promotion.id])
+        self.assertFalse(Promotion.find_serialized(promotion.id)["status"])
+        Promotion.set_status_where(True, name="renamed")
+        self.assertTrue(Promotion.find_serialized(promotion.id)["status"])
+        by_id = promotion.id
+        promotion.delete()
+        self.assertIsNone(Promotion.find_serialized(by_id))
+        promotion = PromotionFactory()
+        promotion.create()
+        by_id = promotion.id
+        Promotion.find_serialized(by_id)
+        Promotion.delete_where(ids=[by_id])
+        self.assertIsNone(Promotion.find_serialized(by_id))
+
     def test_deserialize_a_promotion(self):
         """It should de-serialize a Promotion"""
         data = PromotionFactory().serialize()
@@ -241,6 +497,22 @@ class TestPromotionModel(TestCaseBase):
         promotion = Promotion()
         self.assertRaises(DataValidationError, promotion.deserialize, data)
 
+    def test_deserialize_end_date_out_of_range(self):
+        """It should not deserialize a Promotion that ends past the dates Python can load"""
+        data = PromotionFactory(start_date=date(9999, 12, 30), duration=1).serialize()
+        promotion = Promotion()
+        promotion.deserialize(data)
+        self.assertEqual(promotion.serialize()["end_date"], "9999-12-31")
+        for start_date, duration in (("9999-12-30", 5), ("2024-01-01", 1000000000), ("0001-01-01", -1)):
+            data.update(start_date=start_date, duration=duration)
+            self.assertRaises(DataValidationError, promotion.deserialize, data)
+
+    def test_end_date_check_constraint(self):
+        """It should not store a Promotion that ends past the dates Python can load"""
+        promotion = PromotionFactory(start_date=date(9999, 12, 30), duration=5)
+        self.assertRaises(DataValidationError, Promotion.create_many, [promotion])
+        self.assertEqual(Promotion.query.count(), 0)
+
     def test_deserialize_bad_product_id(self):
         """It should not deserialize a bad product_id attribute"""
         test_promotion = PromotionFactory()
@@ -282,6 +554,32 @@ class TestExceptionHandlers(TestCaseBase):
         promotion = PromotionFactory()
         self.assertRaises(DataValidationError, promotion.create)
 
+    @patch("service.models.db.session.commit")
+    def test_create_many_exception(self, exception_mock):
+        """It should catch a create many exception"""
+        exception_mock.side_effect = Exception()
+        promotions = PromotionFactory.create_batch(2)
+        self.assertRaises(DataValidationError, Promotion.create_many, promotions)
+
+    @patch("service.models.db.session.commit")
+    def test_bulk_where_exceptions(self, exception_mock):
+        """It should catch set status where and delete where exceptions"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Promotion.set_status_where, True, ids=[1])
+        self.assertRaises(DataValidationError, Promotion.delete_where, ids=[1])
+
+    @patch("service.models.db.session.commit")
+    def test_set_status_exception(self, exception_mock):
+        """It should catch a set status exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Promotion.set_status, 1, True)
+
+    @patch("service.models.db.session.commit")
+    def test_patch_exception(self, exception_mock):
+        """It should catch a patch exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Promotion.patch, 1, {"rule": "10% off"})
+
     @patch("service.models.db.session.commit")
     def test_update_exception(self, exception_mock):
         """It should catch a update exception"""
@@ -402,3 +700,213 @@ class TestModelQueries(TestCaseBase):
         self.assertEqual(found.count(), count)
         for promotion in found:
             self.assertEqual(promotion.status, activated)
+
+    def test_find_by_filters(self):
+        """It should Find Promotions that match all of the filters"""
+        promotions = PromotionFactory.create_batch(10)
+        for promotion in promotions:
+            promotion.create()
+        first = promotions[0]
+        found = Promotion.find_by_filters(
+            name=first.name,
+            start_date=first.start_date.isoformat(),
+            promotion_type=first.promotion_type.name.lower(),
+            product_id=first.product_id,
+            status=first.status,
+        )
+        self.assertIn(first.id, [promotion.id for promotion in found])
+        for promotion in found:
+            self.assertEqual(promotion.name, first.name)
+            self.assertEqual(promotion.start_date, first.start_date)
+            self.assertEqual(promotion.promotion_type, first.promotion_type)
+            self.assertEqual(promotion.product_id, first.product_id)
+            self.assertEqual(promotion.status, first.status)
+        self.assertEqual(Promotion.find_by_filters().count(), 10)
+
+    def test_end_date(self):
+        """It should keep the end_date of a Promotion in the database"""
+        promotion = PromotionFactory(start_date=date(2024, 2, 27), duration=3)
+        self.assertEqual(promotion.serialize()["end_date"], "2024-03-01")
+        promotion.create()
+        self.assertEqual(Promotion.find(promotion.id).end_date, date(2024, 3, 1))
+        promotion.duration = 5
+        promotion.update()
+        self.assertEqual(Promotion.find(promotion.id).end_date, date(2024, 3, 3))
+        self.assertEqual(Promotion.find_serialized(promotion.id, ["end_date"]), {"end_date": "2024-03-03"})
+
+    def test_find_by_date_ranges(self):
+        """It should Find Promotions by date ranges"""
+        promotions = [
+            PromotionFactory(start_date=date(2024, 3, 1), duration=10),
+            PromotionFactory(start_date=date(2024, 3, 5), duration=1),
+            PromotionFactory(start_date=date(2024, 3, 10), duration=0),
+        ]
+        Promotion.create_many(promotions)
+
+        def names(query):
+            return sorted(promotion.name for promotion in query)
+
+        first, second, _ = [promotion.name for promotion in promotions]
+        self.assertEqual(names(Promotion.find_by_active_on("2024-03-05")), sorted([first, second]))
+        self.assertEqual(names(Promotion.find_by_active_on(date(2024, 3, 10))), [first])
+        self.assertEqual(names(Promotion.find_by_active_on("2024-03-11")), [])
+        self.assertEqual(names(Promotion.find_by_starts_before("2024-03-05")), [first])
+        self.assertEqual(names(Promotion.find_by_ends_after("2024-03-10")), [first])
+        self.assertEqual(
+            names(Promotion.find_by_filters(starts_before="2024-03-10", ends_after="2024-03-05")),
+            sorted([first, second]),
+        )
+        self.assertRaises(DataValidationError, Promotion.find_by_active_on, "someday")
+        self.assertRaises(DataValidationError, Promotion.find_by_filters, ends_after=None, start_date="03/01/2024")
+
+    def test_find_by_bad_promotion_type(self):
+        """It should not Find Promotions by an unknown Promotion Type"""
+        self.assertRaises(DataValidationError, Promotion.find_by_filters, promotion_type="FREE")
+
+    def test_find_effective(self):
+        """It should Find the active Promotions of a product in effect on a date"""
+        on_date = date(2024, 3, 10)
+        promotions = [
+            PromotionFactory(product_id=7, status=True, start_date=on_date, duration=1),
+            PromotionFactory(product_id=7, status=True, start_date=on_date - timedelta(days=9), duration=10),
+            PromotionFactory(product_id=7, status=True, start_date=on_date - timedelta(days=10), duration=10),
+            PromotionFactory(product_id=7, status=True, start_date=on_date + timedelta(days=1), duration=5),
+            PromotionFactory(product_id=7, status=False, start_date=on_date, duration=5),
+            PromotionFactory(product_id=8, status=True, start_date=on_date, duration=5),
+        ]
+        Promotion.create_many(promotions)
+        found = Promotion.find_effective(7, on_date)
+        self.assertEqual(found, [promotion.serialize() for promotion in promotions[:2]])
+        self.assertEqual(Promotion.find_effective(7, on_date, ["id"]), [{"id": promotion.id} for promotion in promotions[:2]])
+        self.assertEqual(Promotion.find_effective(9, on_date), [])
+        self.assertEqual(Promotion.find_effective(8), [])
+
+    def test_find_effective_after_writes(self):
+        """It should keep the effective Promotions up to date on writes"""
+        on_date = date(2024, 3, 10)
+        promotion = PromotionFactory(product_id=7, status=True, start_date=on_date, duration=3)
+        promotion.create()
+        self.assertEqual(len(Promotion.find_effective(7, on_date)), 1)
+        promotion.deactivate()
+        self.assertEqual(Promotion.find_effective(7, on_date), [])
+        promotion.activate()
+        promotion.product_id = 8
+        promotion.update()
+        self.assertEqual(Promotion.find_effective(7, on_date), [])
+        self.assertEqual(len(Promotion.find_effective(8, on_date)), 1)
+        Promotion.set_status_where(False, product_id=8)
+        self.assertEqual(Promotion.find_effective(8, on_date), [])
+
+    def test_find_effective_after_writes_elsewhere(self):
+        """It should not find the Promotions another worker changed before effective_index reloads"""
+        on_date = date(2024, 3, 10)
+        promotions = [
+            PromotionFactory(product_id=7, status=True, start_date=on_date, duration=3) for _ in range(4)
+        ]
+        Promotion.create_many(promotions)
+        self.assertEqual(len(Promotion.find_effective(7, on_date)), 4)
+        deactivated, moved, postponed, deleted = [promotion.id for promotion in promotions]
+        with db.engine.begin() as connection:
+            connection.execute(update(Promotion).where(Promotion.id == deactivated).values(status=False))
+            connection.execute(update(Promotion).where(Promotion.id == moved).values(product_id=8))
+            connection.execute(
+                update(Promotion).where(Promotion.id == postponed).values(start_date=on_date + timedelta(days=1))
+            )
+            connection.execute(delete(Promotion).where(Promotion.id == deleted))
+        self.assertEqual(Promotion.find_effective(7, on_date), [])
+        # the rows are grouped by the product they have now
+        self.assertEqual(Promotion.find_effective_many([7, 8], on_date, ["id"]), {8: [{"id": moved}]})
+
+    def test_load_effective_rows_in_a_thread(self):
+        """It should load the effective Promotions outside of the application context"""
+        promotion = PromotionFactory(status=True, duration=3)
+        promotion.create()
+        load = Promotion._effective_loader()  # pylint: disable=protected-access
+        rows = []
+        thread = threading.Thread(target=lambda: rows.extend(load([promotion.id])))
+        thread.start()
+        thread.join()
+        self.assertEqual([row[:2] for row in rows], [(promotion.id, promotion.product_id)])
+
+    def test_may_have_product(self):
+        """It should keep the products that have Promotions up to date on writes"""
+        negatives = product_filter.negatives
+        promotion = PromotionFactory(product_id=1001)
+        promotion.create()
+        Promotion.create_many([PromotionFactory(product_id=1002)])
+        self.assertTrue(Promotion.may_have_product(1001))
+        self.assertTrue(Promotion.may_have_product(1002))
+        self.assertFalse(Promotion.may_have_product(1003))
+        promotion = Promotion.find(promotion.id)
+        promotion.product_id = 1003
+        promotion.update()
+        self.assertFalse(Promotion.may_have_product(1001))
+        self.assertTrue(Promotion.may_have_product(1003))
+        promotion.delete()
+        self.assertFalse(Promotion.may_have_product(1003))
+        self.assertEqual(product_filter.stats()["negatives"], negatives + 3)
+
+    def test_may_have_product_after_writes_elsewhere(self):
+        """It should find the products another worker gave Promotions once the filter is rebuilt"""
+        product_filter.configure(0.01, 0)
+        self.addCleanup(product_filter.configure, app.config["PRODUCT_FILTER_ERROR_RATE"], app.config["PRODUCT_FILTER_TTL"])
+        self.assertFalse(Promotion.may_have_product(1001))
+        with db.engine.begin() as connection:
+            connection.execute(insert(Promotion), [PromotionFactory(product_id=1001).row()])
+        # rebuilt in a thread of its own, so the first lookups may still miss it
+        deadline = time.monotonic() + 5
+        while not Promotion.may_have_product(1001) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(Promotion.may_have_product(1001))
+
+    def test_set_status_where(self):
+        """It should set the status of the selected Promotions in one statement"""
+        promotions = PromotionFactory.create_batch(6)
+        for promotion in promotions:
+            promotion.status = True
+        Promotion.create_many(promotions)
+        ids = [promotion.id for promotion in promotions[:4]]
+        count = Promotion.set_status_where(False, ids=ids, product_id=promotions[0].product_id)
+        expected = [promotion.id for promotion in promotions[:4] if promotion.product_id == promotions[0].product_id]
+        self.assertEqual(count, len(expected))
+        deactivated = [promotion.id for promotion in Promotion.find_by_promotion_status(False)]
+        self.assertEqual(sorted(deactivated), sorted(expected))
+
+    def test_delete_where(self):
+        """It should remove the selected Promotions in one statement"""
+        promotions = PromotionFactory.create_batch(6)
+        Promotion.create_many(promotions)
+        count = Promotion.delete_where(ids=[promotion.id for promotion in promotions[:4]])
+        self.assertEqual(count, 4)
+        self.assertEqual(len(Promotion.all()), 2)
+
+    def test_find_page(self):
+        """It should Find Promotions one page at a time"""
+        promotions = PromotionFactory.create_batch(5)
+        for promotion in promotions:
+            promotion.create()
+        ids = sorted(promotion.id for promotion in promotions)
+        page, next_key = Promotion.find_page(Promotion.query, 3)
+        self.assertEqual([promotion["id"] for promotion in page], ids[:3])
+        self.assertEqual(next_key, {"id": ids[2]})
+        page, next_key = Promotion.find_page(Promotion.query, 3, next_key, fields=["name"])
+        self.assertEqual(page, [{"name": Promotion.find(by_id).name} for by_id in ids[3:]])
+        self.assertIsNone(next_key)
+
+    def test_find_page_bad_key(self):
+        """It should not Find a page with a bad key"""
+        self.assertRaises(
+            DataValidationError,
+            Promotion.find_page,
+            Promotion.query,
+            3,
+            {"start_date": "tomorrow", "id": 1},
+            "start_date",
+        )
+
+    def test_filter_columns_are_indexed(self):
+        """It should have an index for every filterable column"""
+        indexes = inspect(db.engine).get_indexes(Promotion.__tablename__)
+        leading = {index["column_names"][0] for index in indexes}
+        for column in ["name", "start_date", "promotion_type", "product_id", "status"]:
+            self.assertIn(column, leading)
@@ -0,0 +1,105 @@
+"""
+Test cases for the profilers
+"""
+import threading
+from unittest import TestCase
+from service.common.profiling import SamplingProfiler, RequestProfiler, TRUNCATED
+
+
+def wait_for(event: threading.Event):
+    """Blocks a thread in a frame the profiler can find"""
+    event.wait()
+
+
+def hello_app(environ, start_response):  # pylint: disable=unused-argument
+    """A WSGI application that says hello"""
+    start_response("201 CREATED", [("Content-Type", "text/plain")])
+    return [b"hello"]
+
+
+######################################################################
+#  S A M P L I N G   P R O F I L E R   T E S T   C A S E S
+######################################################################
+class TestSamplingProfiler(TestCase):
+    """Test Cases for SamplingProfiler"""
+
+    def setUp(self):
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=wait_for, args=(self.event,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.event.set()
+        self.thread.join()
+
+    def test_sample(self):
+        """It should count the stacks of the other threads from the outermost frame"""
+        profiler = SamplingProfiler()
+        profiler.sample()
+        profiler.sample()
+        lines = profiler.collapsed().splitlines()
+        waiting = [line for line in lines if ";wait_for (test_profiling.py:" in line]
+        self.assertEqual(len(waiting), 1)
+        self.assertTrue(waiting[0].startswith("_bootstrap (threading.py:"))
+        self.assertTrue(waiting[0].endswith(" 2"))
+        self.assertFalse(any("test_sample" in line for line in lines))
+        self.assertEqual(profiler.stats()["samples"], 2)
+        profiler.clear()
+        self.assertEqual(profiler.collapsed(), "")
+        self.assertEqual(profiler.stats()["samples"], 0)
+
+    def test_max_stacks(self):
+        """It should count the stacks beyond max_stacks as truncated"""
+        profiler = SamplingProfiler()
+        profiler.configure(0.01, 0)
+        profiler.sample()
+        self.assertTrue(profiler.collapsed().startswith(f"{TRUNCATED} "))
+        self.assertEqual(profiler.stats()["stacks"], 1)
+
+    def test_start_and_stop(self):
+        """It should sample in the background until stopped"""
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.stop()
+        profiler.start()
+        profiler.start()
+        self.assertTrue(profiler.running)
+        while profiler.stats()["samples"] < 3:
+            self.event.wait(0.001)
+        profiler.stop()
+        self.assertFalse(profiler.stats()["running"])
+        self.assertIn(";wait_for (test_profiling.py:", profiler.collapsed())
+
+
+######################################################################
+#  R E Q U E S T   P R O F I L E R   T E S T   C A S E S
+######################################################################
+class TestRequestProfiler(TestCase):
+    """Test Cases for RequestProfiler"""
+
+    def setUp(self):
+        self.allowed = True
+        self.middleware = RequestProfiler(hello_app, lambda environ: self.allowed, limit=5)
+        self.started = []
+
+    def call(self, query: str) -> bytes:
+        """Calls the middleware and returns the body"""
+        environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/hello", "QUERY_STRING": query}
+        return b"".join(self.middleware(environ, lambda status, headers: self.started.append((status, dict(headers)))))
+
+    def test_profile_a_request(self):
+        """It should answer a request that asks for it with its cProfile statistics"""
+        body = self.call("a=1&__profile=1").decode()
+        self.assertTrue(body.startswith("GET /hello took "))
+        self.assertIn("hello_app", body)
+        status, headers = self.started[0]
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["X-Profiled-Status"], "201 CREATED")
+        self.assertEqual(int(headers["Content-Length"]), len(body.encode()))
+
+    def test_pass_other_requests_through(self):
+        """It should not profile the requests that do not ask for it or are not allowed"""
+        self.assertEqual(self.call("a=1"), b"hello")
+        self.assertEqual(self.call("__profile=0"), b"hello")
+        self.allowed = False
+        self.assertEqual(self.call("__profile=1"), b"hello")
+        self.assertEqual([status for status, _ in self.started], ["201 CREATED"] * 3)
@@ -1,15 +1,29 @@
+# pylint: disable=too-many-lines
 """
 TestPromotion API Service Test Suite
 """
 
 import os
+import json
 import logging
 from unittest import TestCase
-from datetime import date
+from unittest.mock import patch
+from datetime import date, timedelta
 from urllib.parse import quote_plus
+from flask_restx import marshal
 from wsgi import app
 from service.common import status
-from service.models import db, Promotion, PromotionType
+from service.models import (
+    db,
+    Promotion,
+    PromotionType,
+    promotion_cache,
+    result_cache,
+    promotion_generation,
+    effective_index,
+    product_filter,
+)
+from service.routes import promotion_model
 from .factories import PromotionFactory
 
 DATABASE_URI = os.getenv(
@@ -22,6 +36,7 @@ logging.disable(logging.CRITICAL)
 # BASE_URL = "/promotions"
 BASE_URL = "/api/promotions"
 CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_NDJSON = "application/x-ndjson"
 
 
 ######################################################################
@@ -51,6 +66,10 @@ class TestPromotionService(TestCase):
         self.client = app.test_client()
         db.session.query(Promotion).delete()  # clean up the last tests
         db.session.commit()
+        promotion_cache.clear()
+        result_cache.clear()
+        effective_index.invalidate()
+        product_filter.invalidate()
 
     def tearDown(self):
         """This runs after each test"""
@@ -89,6 +108,99 @@ class TestPromotionService(TestCase):
         self.assertEqual(data["status"], 200)
         self.assertEqual(data["message"], "Healthy")
 
+    def test_cache_stats(self):
+        """It should count the cache hits and misses of Promotion reads"""
+        test_promotion = self._create_promotions(1)[0]
+        before = self.client.get("/stats").get_json()["promotion_cache"]
+        self.client.get(f"{BASE_URL}/{test_promotion.id}")
+        self.client.get(f"{BASE_URL}/{test_promotion.id}")
+        response = self.client.get("/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        after = response.get_json()["promotion_cache"]
+        self.assertEqual(after["misses"], before["misses"] + 1)
+        self.assertEqual(after["hits"], before["hits"] + 1)
+        self.assertEqual(after["size"], 1)
+
+    def test_metrics(self):
+        """It should count the requests and their time by endpoint in the Prometheus text format"""
+        test_promotion = self._create_promotions(1)[0]
+        self.client.get(f"{BASE_URL}/{test_promotion.id}")
+        self.client.get(f"{BASE_URL}/0")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        lines = response.get_data(as_text=True).splitlines()
+        labels = 'endpoint="/api/promotions/<promotion_id>",method="GET"'
+        counts = {
+            line.split(" ")[0]: float(line.split(" ")[1])
+            for line in lines if not line.startswith("#")
+        }
+        self.assertGreaterEqual(counts[f"promotion_http_requests_total{{{labels},status=\"200\"}}"], 1)
+        self.assertGreaterEqual(counts[f"promotion_http_requests_total{{{labels},status=\"404\"}}"], 1)
+        self.assertGreaterEqual(counts[f"promotion_http_request_duration_seconds_count{{{labels}}}"], 2)
+        self.assertGreater(counts['promotion_db_duration_seconds_sum{endpoint="/api/promotions",method="POST"}'], 0)
+        self.assertEqual(counts['promotion_http_requests_in_flight{endpoint="/metrics",method="GET"}'], 1)
+
+    def test_admin_profiler(self):
+        """It should only let the admin token start, read, clear and stop the sampling profiler"""
+        self.assertEqual(self.client.put("/admin/profiler/start").status_code, status.HTTP_403_FORBIDDEN)
+        headers = {"X-Admin-Token": "s3cr3t"}
+        with patch.dict(app.config, {"ADMIN_TOKEN": ""}):
+            response = self.client.put("/admin/profiler/start", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with patch.dict(app.config, {"ADMIN_TOKEN": "s3cr3t"}):
+            response = self.client.put("/admin/profiler/start", headers={"X-Admin-Token": "wrong"})
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            response = self.client.put("/admin/profiler/start", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.get_json()["running"])
+            response = self.client.put("/admin/profiler/stop", headers=headers)
+            self.assertFalse(response.get_json()["running"])
+            response = self.client.get("/admin/profiler", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.content_type.startswith("text/plain"))
+            response = self.client.delete("/admin/profiler", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            self.assertEqual(self.client.get("/admin/profiler", headers=headers).data, b"")
+
+    def test_admin_memory(self):
+        """It should only let the admin token start, snapshot and stop tracing allocations"""
+        self.assertEqual(self.client.put("/admin/memory/start").status_code, status.HTTP_403_FORBIDDEN)
+        headers = {"X-Admin-Token": "s3cr3t"}
+        with patch.dict(app.config, {"ADMIN_TOKEN": "s3cr3t"}):
+            response = self.client.put("/admin/memory/start?frames=0", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            response = self.client.put("/admin/memory/start?frames=5", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.get_json()["tracing"])
+            try:
+                response = self.client.post("/admin/memory/snapshot?limit=5", headers=headers)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertLessEqual(len(response.get_json()["top"]), 5)
+                response = self.client.post("/admin/memory/snapshot?group_by=module", headers=headers)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                response = self.client.get("/admin/memory", headers=headers)
+                self.assertTrue(response.get_json()["tracing"])
+            finally:
+                response = self.client.put("/admin/memory/stop", headers=headers)
+            self.assertFalse(response.get_json()["tracing"])
+            response = self.client.post("/admin/memory/snapshot", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_profile_a_request(self):
+        """It should answer ?__profile=1 with cProfile statistics only when enabled for the admin"""
+        headers = {"X-Admin-Token": "s3cr3t"}
+        with patch.dict(app.config, {"ADMIN_TOKEN": "s3cr3t", "PROFILE_REQUESTS": False}):
+            response = self.client.get(f"{BASE_URL}?__profile=1", headers=headers)
+            self.assertEqual(response.get_json(), [])
+        with patch.dict(app.config, {"ADMIN_TOKEN": "s3cr3t", "PROFILE_REQUESTS": True}):
+            response = self.client.get(f"{BASE_URL}?__profile=1")
+            self.assertEqual(response.get_json(), [])
+            response = self.client.get(f"{BASE_URL}?__profile=1", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.headers["X-Profiled-Status"], "200 OK")
+            self.assertIn("function calls", response.get_data(as_text=True))
+
     def test_create_promotion(self):
         """It should Create a new Promotion"""
         test_promotion = PromotionFactory()
@@ -130,6 +242,62 @@ class TestPromotionService(TestCase):
         self.assertEqual(new_promotion["product_id"], test_promotion.product_id)
         self.assertEqual(new_promotion["status"], test_promotion.status)
 
+    def test_create_promotions_in_bulk(self):
+        """It should Create many Promotions at once"""
+        test_promotions = [promotion.serialize() for promotion in PromotionFactory.create_batch(3)]
+        response = self.client.post(f"{BASE_URL}/bulk", json=test_promotions)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        new_promotions = response.get_json()
+        self.assertEqual(len(new_promotions), 3)
+        for test_promotion, new_promotion in zip(test_promotions, new_promotions):
+            response = self.client.get(f"{BASE_URL}/{new_promotion['id']}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.get_json()["name"], test_promotion["name"])
+            self.assertEqual(response.get_json()["rule"], test_promotion["rule"])
+
+    def test_create_promotions_in_bulk_with_bad_data(self):
+        """It should not Create any Promotions in bulk when one is not valid"""
+        test_promotions = [promotion.serialize() for promotion in PromotionFactory.create_batch(3)]
+        test_promotions[1]["duration"] = "forever"
+        response = self.client.post(f"{BASE_URL}/bulk", json=test_promotions)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.get_json()["errors"]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0]["index"], 1)
+        self.assertIn("duration", errors[0]["message"])
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 0)
+
+    def test_create_promotions_in_bulk_ending_out_of_range(self):
+        """It should not Create Promotions in bulk that end past the dates Python can load"""
+        test_promotions = [promotion.serialize() for promotion in PromotionFactory.create_batch(2)]
+        test_promotions[0]["duration"] = 1000000000
+        test_promotions[1].update(start_date="9999-12-30", duration=5)
+        response = self.client.post(f"{BASE_URL}/bulk", json=test_promotions)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error["index"] for error in response.get_json()["errors"]], [0, 1])
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [])
+
+    def test_create_promotions_in_bulk_not_a_list(self):
+        """It should not Create Promotions in bulk from a single Promotion"""
+        response = self.client.post(f"{BASE_URL}/bulk", json=PromotionFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_no_promotions_in_bulk(self):
+        """It should Create nothing in bulk from an empty list"""
+        response = self.client.post(f"{BASE_URL}/bulk", json=[])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.get_json(), [])
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+
+    def test_create_too_many_promotions_in_bulk(self):
+        """It should not Create more Promotions in bulk than allowed"""
+        test_promotions = [promotion.serialize() for promotion in PromotionFactory.create_batch(3)]
+        with patch.dict(app.config, {"MAX_BULK_SIZE": 2}):
+            response = self.client.post(f"{BASE_URL}/bulk", json=test_promotions)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
     def test_get_promotion(self):
         """It should Get a single Promotion"""
         # get the id of a promotion
@@ -139,6 +307,33 @@ class TestPromotionService(TestCase):
         data = response.get_json()
         self.assertEqual(data["name"], test_promotion.name)
 
+    def test_get_promotion_after_update(self):
+        """It should not Get a stale cached Promotion after it was updated"""
+        test_promotion = self._create_promotions(1)[0]
+        self.client.get(f"{BASE_URL}/{test_promotion.id}")
+        test_promotion.name = "renamed"
+        response = self.client.put(f"{BASE_URL}/{test_promotion.id}", json=test_promotion.serialize())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(f"{BASE_URL}/{test_promotion.id}/deactivate")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = self.client.get(f"{BASE_URL}/{test_promotion.id}").get_json()
+        self.assertEqual(data["name"], "renamed")
+        self.assertFalse(data["status"])
+        self.client.delete(f"{BASE_URL}/{test_promotion.id}")
+        response = self.client.get(f"{BASE_URL}/{test_promotion.id}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_promotion_fields(self):
+        """It should Get only the requested fields of a Promotion"""
+        test_promotion = self._create_promotions(1)[0]
+        response = self.client.get(
+            f"{BASE_URL}/{test_promotion.id}", query_string="fields=id,rule"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.get_json(), {"id": str(test_promotion.id), "rule": test_promotion.rule}
+        )
+
     def test_delete_promotion(self):
         """This should delete a single Promotion"""
         # get the id of a promotion
@@ -155,6 +350,303 @@ class TestPromotionService(TestCase):
         promotions = response.get_json()
         self.assertEqual(len(promotions), 2)
 
+    def test_stream_promotions(self):
+        """It should stream all Promotions as newline delimited JSON"""
+        self._create_promotions(3)
+        expected = self.client.get(BASE_URL).get_json()
+        response = self.client.get(BASE_URL, query_string="stream=true")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, CONTENT_TYPE_NDJSON)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(sorted(json.loads(line)["id"] for line in lines), sorted(item["id"] for item in expected))
+
+    def test_stream_promotions_by_accept_header(self):
+        """It should stream a page of Promotions when asked for application/x-ndjson"""
+        self._create_promotions(3)
+        response = self.client.get(
+            BASE_URL,
+            query_string="limit=2",
+            headers={"Accept": CONTENT_TYPE_NDJSON},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, CONTENT_TYPE_NDJSON)
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 2)
+        self.assertIn("X-Next-Cursor", response.headers)
+
+    def test_list_promotions_fields(self):
+        """It should list only the requested fields of all Promotions"""
+        self._create_promotions(3)
+        requested = ["id", "product_id", "promotion_type", "rule"]
+        for query_string in [f"fields={','.join(requested)}", f"fields={','.join(requested)}&stream=true"]:
+            response = self.client.get(BASE_URL, query_string=query_string)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            lines = response.get_data(as_text=True).splitlines()
+            data = [json.loads(line) for line in lines] if len(lines) > 1 else response.get_json()
+            self.assertEqual(len(data), 3)
+            for promotion in data:
+                self.assertEqual(sorted(promotion), sorted(requested))
+
+    def test_list_promotions_unknown_fields(self):
+        """It should not list fields that do not exist"""
+        response = self.client.get(BASE_URL, query_string="fields=id,price")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("price", response.get_json()["message"])
+
+    def test_list_promotions_as_marshalled(self):
+        """It should list Promotions byte for byte as marshalling them would"""
+        self._create_promotions(3)
+        promotions = Promotion.query.order_by(Promotion.id)
+        for field_names in [None, ["rule", "id"]]:
+            mask = ",".join(field_names) if field_names else None
+            expected = marshal([promotion.serialize() for promotion in promotions], promotion_model, mask=mask)
+            query_string = {"order_by": "id", "limit": 10}
+            if field_names:
+                query_string["fields"] = mask
+            response = self.client.get(BASE_URL, query_string=query_string)
+            self.assertEqual(response.get_data(), (json.dumps(expected) + "\n").encode())
+
+    def test_list_promotions_is_cached(self):
+        """It should serve a repeated list query from the result cache"""
+        self._create_promotions(3)
+        response = self.client.get(BASE_URL, query_string="promotion_type=bxgy&limit=5&status=true")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        hits = result_cache.hits
+        with patch("service.models.Promotion.find_by_filters") as find_mock:
+            cached = self.client.get(BASE_URL, query_string="status=true&limit=5&promotion_type=BXGY")
+        find_mock.assert_not_called()
+        self.assertEqual(result_cache.hits, hits + 1)
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached.mimetype, CONTENT_TYPE_JSON)
+        self.assertEqual(cached.get_data(), response.get_data())
+        stats = self.client.get("/stats").get_json()
+        self.assertEqual(stats["result_cache"]["size"], 1)
+
+    def test_list_promotions_of_many_products(self):
+        """It should list the Promotions of a list of products by product"""
+        promotions = [
+            PromotionFactory(product_id=product_id, status=status)
+            for product_id, status in [(7, True), (8, True), (7, False), (7, True)]
+        ]
+        for promotion in promotions:
+            promotion.id = self.client.post(BASE_URL, json=promotion.serialize()).get_json()["id"]
+        response = self.client.get(BASE_URL, query_string="product_id=7,8,1001&status=true&fields=id,product_id")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.get_json(),
+            {
+                "7": [{"id": str(promotions[0].id), "product_id": 7}, {"id": str(promotions[3].id), "product_id": 7}],
+                "8": [{"id": str(promotions[1].id), "product_id": 8}],
+                "1001": [],
+            },
+        )
+        hits = result_cache.hits
+        response = self.client.get(BASE_URL, query_string="product_id=8,1002&fields=name")
+        self.assertEqual(response.get_json(), {"8": [{"name": promotions[1].name}], "1002": []})
+        cached = self.client.get(BASE_URL, query_string="product_id=8,1002&fields=name")
+        self.assertEqual(result_cache.hits, hits + 1)
+        self.assertEqual(cached.get_data(), response.get_data())
+
+    def test_list_promotions_of_many_products_bad_args(self):
+        """It should not page, stream or take bad lists of products"""
+        for query_string in ["product_id=7,8&limit=5", "product_id=7,8&stream=true", "product_id=7,x", "product_id=7,"]:
+            response = self.client.get(BASE_URL, query_string=query_string)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_get_promotions(self):
+        """It should Read many Promotions by id in one request"""
+        promotions = self._create_promotions(3)
+        ids = [int(promotion.id) for promotion in promotions]
+        response = self.client.post(f"{BASE_URL}/batch-get", json={"ids": [ids[2], 0, ids[0]]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(list(data), [str(ids[2]), "0", str(ids[0])])
+        self.assertIsNone(data["0"])
+        self.assertEqual(data[str(ids[0])], self.client.get(f"{BASE_URL}/{ids[0]}").get_json())
+        response = self.client.post(f"{BASE_URL}/batch-get?fields=id,name", json={"ids": ids[1:2]})
+        self.assertEqual(response.get_json(), {str(ids[1]): {"id": str(ids[1]), "name": promotions[1].name}})
+
+    def test_batch_get_promotions_bad_ids(self):
+        """It should not Read many Promotions without a valid list of ids"""
+        for body in [{}, {"ids": "1"}, {"ids": [1, "2"]}, {"ids": [True]}]:
+            response = self.client.post(f"{BASE_URL}/batch-get", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/batch-get?fields=bad", json={"ids": [1]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with patch.dict(app.config, {"MAX_BULK_SIZE": 2}):
+            response = self.client.post(f"{BASE_URL}/batch-get", json={"ids": [1, 2, 3]})
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_list_promotions_of_product_without_promotions(self):
+        """It should list no Promotions of a product without any without a query"""
+        test_promotion = self._create_promotions(1)[0]
+        negatives = product_filter.negatives
+        with patch("service.models.Promotion.find_page") as page_mock:
+            for query_string in ["product_id=1001", "product_id=1001&limit=5", "product_id=1001&stream=true"]:
+                response = self.client.get(BASE_URL, query_string=query_string)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.get_data(as_text=True).strip(), "" if "stream" in query_string else "[]")
+        page_mock.assert_not_called()
+        response = self.client.get(BASE_URL, query_string=f"product_id={test_promotion.product_id}")
+        self.assertEqual(len(response.get_json()), 1)
+        stats = self.client.get("/stats").get_json()["product_filter"]
+        self.assertEqual(stats["negatives"], negatives + 3)
+        self.assertLess(stats["false_positive_rate"], 0.01)
+        lines = self.client.get("/metrics").get_data(as_text=True).splitlines()
+        rate = f'promotion_product_filter_false_positive_rate{{worker="{os.getpid()}"}}'
+        self.assertTrue(any(line.startswith(f"{rate} ") for line in lines))
+        self.assertTrue(any(line.startswith("promotion_product_filter_negatives_total ") for line in lines))
+
+    def test_list_promotions_cache_invalidated_by_writes(self):
+        """It should not serve a cached list after a Promotion was written"""
+        test_promotion = self._create_promotions(1)[0]
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 1)
+        self._create_promotions(1)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 2)
+        self.client.put(f"{BASE_URL}/{test_promotion.id}/activate")
+        data = self.client.get(BASE_URL, query_string="status=false").get_json()
+        self.assertNotIn(str(test_promotion.id), [item["id"] for item in data])
+        self.client.put(f"{BASE_URL}/{test_promotion.id}/deactivate")
+        data = self.client.get(BASE_URL, query_string="status=false").get_json()
+        self.assertIn(str(test_promotion.id), [item["id"] for item in data])
+
+    def test_list_promotions_not_cached(self):
+        """It should not cache streams or results with too many Promotions"""
+        self._create_promotions(2)
+        with patch.dict(app.config, {"RESULT_CACHE_MAX_ROWS": 1}):
+            self.client.get(BASE_URL)
+        self.client.get(BASE_URL, query_string="stream=true")
+        self.assertEqual(result_cache.stats()["size"], 0)
+
+    def test_list_effective_promotions(self):
+        """It should list the active Promotions of a product in effect on a date"""
+        effective = PromotionFactory(product_id=7, status=True, start_date=date(2024, 3, 8), duration=3)
+        expired = PromotionFactory(product_id=7, status=True, start_date=date(2024, 3, 1), duration=3)
+        for promotion in [effective, expired]:
+            response = self.client.post(BASE_URL, json=promotion.serialize())
+            promotion.id = response.get_json()["id"]
+        response = self.client.get(
+            f"{BASE_URL}/effective", query_string="product_id=7&on_date=2024-03-10&fields=id,name"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [{"id": effective.id, "name": effective.name}])
+        response = self.client.get(f"{BASE_URL}/effective", query_string="product_id=7")
+        self.assertEqual(response.get_json(), [])
+
+    def test_evaluate_cart(self):
+        """It should return the discounts the Promotions in effect give a cart"""
+        today = date.today()
+        percent = PromotionFactory(
+            product_id=7, status=True, start_date=today, duration=3,
+            promotion_type=PromotionType.PERCENTAGE_DISCOUNT, rule="20% off",
+        )
+        bxgy = PromotionFactory(
+            product_id=8, status=True, start_date=today, duration=3,
+            promotion_type=PromotionType.BXGY, rule="buy 1 get 1 free",
+        )
+        for promotion in [percent, bxgy]:
+            promotion.id = self.client.post(BASE_URL, json=promotion.serialize()).get_json()["id"]
+        cart = {
+            "items": [
+                {"product_id": 7, "quantity": 2, "unit_price": 12.5},
+                {"product_id": 8, "quantity": 5, "unit_price": 3},
+                {"product_id": 9, "quantity": 1, "unit_price": 3},
+            ]
+        }
+        response = self.client.post(f"{BASE_URL}/evaluate", json=cart)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.get_json()["discounts"],
+            [
+                {"line": 0, "product_id": 7, "promotion_id": percent.id, "discount": 5.0},
+                {"line": 1, "product_id": 8, "promotion_id": bxgy.id, "discount": 6.0},
+            ],
+        )
+        cart["on_date"] = (today - timedelta(days=1)).isoformat()
+        response = self.client.post(f"{BASE_URL}/evaluate", json=cart)
+        self.assertEqual(response.get_json()["discounts"], [])
+
+    def test_evaluate_bad_cart(self):
+        """It should not evaluate carts that are not valid or too large"""
+        response = self.client.post(f"{BASE_URL}/evaluate", json={"items": [{"product_id": 7}]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for price in ["Infinity", "NaN"]:
+            response = self.client.post(
+                f"{BASE_URL}/evaluate",
+                data=f'{{"items": [{{"product_id": 7, "quantity": 1, "unit_price": {price}}}]}}',
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        percent = PromotionFactory(
+            product_id=7, status=True, start_date=date.today(), duration=3,
+            promotion_type=PromotionType.PERCENTAGE_DISCOUNT, rule="10% off",
+        )
+        self.client.post(BASE_URL, json=percent.serialize())
+        for item in [{"quantity": 10**400, "unit_price": 1}, {"quantity": 1, "unit_price": 1.7e308}]:
+            for endpoint in ["evaluate", "optimize"]:
+                response = self.client.post(f"{BASE_URL}/{endpoint}", json={"items": [{"product_id": 7, **item}]})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        cart = {"items": [{"product_id": 7, "quantity": 1, "unit_price": 1}] * 3}
+        with patch.dict(app.config, {"MAX_BULK_SIZE": 2}):
+            response = self.client.post(f"{BASE_URL}/evaluate", json=cart)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_optimize_cart(self):
+        """It should apply the best combination of the Promotions in effect to a cart"""
+        today = date.today()
+        promotions = [
+            PromotionFactory(
+                product_id=7, status=True, start_date=today, duration=3,
+                promotion_type=PromotionType.AMOUNT_DISCOUNT, rule="$20 off",
+            ),
+            PromotionFactory(
+                product_id=7, status=True, start_date=today, duration=3,
+                promotion_type=PromotionType.PERCENTAGE_DISCOUNT, rule="10% off",
+            ),
+            PromotionFactory(
+                product_id=7, status=True, start_date=today, duration=3,
+                promotion_type=PromotionType.PERCENTAGE_DISCOUNT, rule="5% off",
+            ),
+        ]
+        for promotion in promotions:
+            promotion.id = self.client.post(BASE_URL, json=promotion.serialize()).get_json()["id"]
+        cart = {
+            "items": [
+                {"product_id": 7, "quantity": 1, "unit_price": 15},
+                {"product_id": 7, "quantity": 1, "unit_price": 100},
+            ]
+        }
+        response = self.client.post(f"{BASE_URL}/optimize", json=cart)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        coupon, percent = promotions[0].id, promotions[1].id
+        self.assertEqual(
+            response.get_json(),
+            {
+                "discounts": [
+                    {"line": 0, "product_id": 7, "promotion_id": percent, "discount": 1.5},
+                    {"line": 1, "product_id": 7, "promotion_id": coupon, "discount": 20.0},
+                    {"line": 1, "product_id": 7, "promotion_id": percent, "discount": 8.0},
+                ],
+                "total_discount": 29.5,
+                "optimal": True,
+            },
+        )
+
+    def test_optimize_bad_cart(self):
+        """It should not optimize carts that are not valid or too large"""
+        response = self.client.post(f"{BASE_URL}/optimize", json={"items": "none"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        cart = {"items": [{"product_id": 7, "quantity": 1, "unit_price": 1}] * 3}
+        with patch.dict(app.config, {"MAX_BULK_SIZE": 2}):
+            response = self.client.post(f"{BASE_URL}/optimize", json=cart)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_list_effective_promotions_bad_args(self):
+        """It should not list effective Promotions without a product or with a bad date"""
+        response = self.client.get(f"{BASE_URL}/effective")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}/effective", query_string="product_id=7&on_date=soon")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_list_promotions_by_product_id(self):
         """This should list all promotions with given product id"""
         test_db = self._create_promotions(5)
@@ -194,6 +686,48 @@ class TestPromotionService(TestCase):
         promotions = response.get_json()
         self.assertEqual(len(promotions), count)
 
+    def test_list_promotions_by_page(self):
+        """It should list all Promotions one page at a time"""
+        test_db = self._create_promotions(5)
+        response = self.client.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('rel="next"', response.headers.get("Link"))
+        pages = [response.get_json()]
+        while "X-Next-Cursor" in response.headers:
+            response = self.client.get(
+                BASE_URL,
+                query_string={"limit": 2, "cursor": response.headers["X-Next-Cursor"]},
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.get_json())
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertNotIn("Link", response.headers)
+        ids = [int(promotion["id"]) for page in pages for promotion in page]
+        self.assertEqual(ids, sorted(int(promotion.id) for promotion in test_db))
+
+    def test_list_promotions_by_page_of_start_date(self):
+        """It should list Promotions one page at a time in start date order"""
+        test_db = self._create_promotions(5)
+        keys = []
+        cursor = ""
+        for _ in test_db:
+            response = self.client.get(
+                BASE_URL,
+                query_string={"limit": 1, "order_by": "start_date", "cursor": cursor},
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            promotion = response.get_json()[0]
+            keys.append((promotion["start_date"], int(promotion["id"])))
+            cursor = response.headers.get("X-Next-Cursor", "")
+        self.assertEqual(cursor, "")
+        self.assertEqual(keys, sorted(keys))
+
+    def test_list_promotions_bad_cursor(self):
+        """It should not list Promotions with a bad cursor"""
+        for cursor in ["not-a-cursor", "WzFd", "eyJ4IjogMX0="]:
+            response = self.client.get(BASE_URL, query_string={"cursor": cursor})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_promotion_not_found(self):
         """It should not Get a Promotion thats not found"""
         response = self.client.get(f"{BASE_URL}/0")
@@ -220,6 +754,79 @@ class TestPromotionService(TestCase):
         updated_promotion = response.get_json()
         self.assertEqual(updated_promotion["rule"], "unknown")
 
+    def test_update_promotion_ending_out_of_range(self):
+        """It should not Update a Promotion to end past the dates Python can load"""
+        new_promotion = self._create_promotions(1)[0].serialize()
+        url = f"{BASE_URL}/{new_promotion['id']}"
+        response = self.client.put(url, json={**new_promotion, "start_date": "9999-12-30", "duration": 5})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # the stored start_date bounds a duration patched on its own
+        response = self.client.patch(url, json={"duration": 1000000000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url).get_json()["duration"], new_promotion["duration"])
+        self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_200_OK)
+
+    def test_patch_promotion(self):
+        """It should Update only some fields of an existing Promotion"""
+        test_promotion = PromotionFactory(promotion_type=PromotionType.BXGY)
+        response = self.client.post(BASE_URL, json=test_promotion.serialize())
+        new_promotion = response.get_json()
+        response = self.client.patch(
+            f"{BASE_URL}/{new_promotion['id']}",
+            json={"promotion_type": "AMOUNT_DISCOUNT", "rule": "$5 off"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = {**new_promotion, "promotion_type": "AMOUNT_DISCOUNT", "rule": "$5 off"}
+        self.assertEqual(response.get_json(), expected)
+        response = self.client.get(f"{BASE_URL}/{new_promotion['id']}")
+        self.assertEqual(response.get_json(), expected)
+
+    def test_patch_promotion_with_bad_data(self):
+        """It should not Update some fields of a Promotion with bad data"""
+        new_promotion = self._create_promotions(1)[0]
+        response = self.client.patch(f"{BASE_URL}/{new_promotion.id}", json={"duration": "long"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f"{BASE_URL}/{new_promotion.id}", json={"end_date": "2024-01-01"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_etag_and_if_match(self):
+        """It should return the version of a Promotion as an ETag and honour If-Match"""
+        response = self.client.post(BASE_URL, json=PromotionFactory(status=True).serialize())
+        self.assertEqual(response.headers["ETag"], '"1"')
+        new_promotion = response.get_json()
+        url = f"{BASE_URL}/{new_promotion['id']}"
+        self.assertEqual(self.client.get(url).headers["ETag"], '"1"')
+        self.assertEqual(self.client.get(f"{url}?fields=rule").headers["ETag"], '"1"')
+        new_promotion["rule"] = "10% off"
+        response = self.client.put(url, json=new_promotion, headers={"If-Match": '"2"'})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.put(url, json=new_promotion, headers={"If-Match": '"1"'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["ETag"], '"2"')
+        response = self.client.patch(url, json={"duration": 9}, headers={"If-Match": '"1", W/"2"'})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.patch(url, json={"duration": 9}, headers={"If-Match": '"1", "2"'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["ETag"], '"3"')
+        self.assertEqual(response.get_json()["duration"], 9)
+        response = self.client.put(f"{url}/deactivate")
+        self.assertEqual(response.headers["ETag"], '"4"')
+        self.assertNotIn("version", response.get_json())
+        response = self.client.delete(url, headers={"If-Match": '"3"'})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(url, headers={"If-Match": "*"})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        for if_match in ['"4"', "*"]:
+            response = self.client.delete(url, headers={"If-Match": if_match})
+            self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_patch_promotion_not_found(self):
+        """It should not Update some fields of a Promotion thats not found"""
+        response = self.client.patch(f"{BASE_URL}/0", json={"name": "Trial Promotion"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     # ----------------------------------------------------------
     # TEST QUERY
     # ----------------------------------------------------------
@@ -282,6 +889,22 @@ class TestPromotionService(TestCase):
         for promotion in data:
             self.assertEqual(promotion["start_date"], test_start_date.isoformat())
 
+    def test_query_by_date_ranges(self):
+        """It should Query Promotions by date ranges"""
+        current = PromotionFactory(start_date=date(2024, 3, 1), duration=10)
+        future = PromotionFactory(start_date=date(2024, 4, 1), duration=10)
+        for promotion in [current, future]:
+            self.client.post(BASE_URL, json=promotion.serialize())
+        response = self.client.get(BASE_URL, query_string="active_on=2024-03-10")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([promotion["name"] for promotion in data], [current.name])
+        self.assertEqual(data[0]["end_date"], "2024-03-11")
+        response = self.client.get(BASE_URL, query_string="starts_before=2024-04-02&ends_after=2024-03-11")
+        self.assertEqual([promotion["name"] for promotion in response.get_json()], [future.name])
+        response = self.client.get(BASE_URL, query_string="active_on=tomorrow")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_query_by_promotion_type(self):
         """It should Query Promotions by promotion_type"""
         promotions = self._create_promotions(10)
@@ -338,6 +961,35 @@ class TestPromotionService(TestCase):
         for promotion in data:
             self.assertEqual(promotion["status"], False)
 
+    def test_query_by_several_filters(self):
+        """It should Query Promotions that match all of the filters"""
+        promotions = self._create_promotions(10)
+        test_product_id = promotions[0].product_id
+        test_status = promotions[0].status
+        count = len(
+            [
+                promotion
+                for promotion in promotions
+                if promotion.product_id == test_product_id
+                and promotion.status == test_status
+            ]
+        )
+        response = self.client.get(
+            BASE_URL,
+            query_string=f"product_id={test_product_id}&status={str(test_status).lower()}",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(len(data), count)
+        for promotion in data:
+            self.assertEqual(promotion["product_id"], test_product_id)
+            self.assertEqual(promotion["status"], test_status)
+
+    def test_query_by_bad_promotion_type(self):
+        """It should not Query Promotions by an unknown promotion_type"""
+        response = self.client.get(BASE_URL, query_string="promotion_type=FREE")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     # ----------------------------------------------------------
     # TEST ACTIONS
     # ----------------------------------------------------------
@@ -371,6 +1023,77 @@ class TestPromotionService(TestCase):
         deactivated_promotion = response.get_json()
         self.assertEqual(deactivated_promotion["status"], False)
 
+    def test_activate_promotion_twice(self):
+        """It should return the Promotion without writing it when it is already active"""
+        test_promotion = PromotionFactory(status=False)
+        promotion_id = self.client.post(BASE_URL, json=test_promotion.serialize()).get_json()["id"]
+        activated = self.client.put(f"{BASE_URL}/{promotion_id}/activate").get_json()
+        self.assertEqual(activated, {**test_promotion.serialize(), "id": int(promotion_id), "status": True})
+        generation = promotion_generation.value
+        response = self.client.put(f"{BASE_URL}/{promotion_id}/activate")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), activated)
+        self.assertEqual(promotion_generation.value, generation)
+        response = self.client.put(f"{BASE_URL}/abc/deactivate")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_activate_promotions_in_bulk_by_ids(self):
+        """It should Activate the Promotions with the given ids"""
+        promotions = self._create_promotions(5)
+        ids = [int(promotion.id) for promotion in promotions[:3]]
+        self.client.put(f"{BASE_URL}/bulk/deactivate", json={"ids": ids})
+        response = self.client.put(f"{BASE_URL}/bulk/activate", json={"ids": ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["count"], 3)
+        for by_id in ids:
+            self.assertTrue(self.client.get(f"{BASE_URL}/{by_id}").get_json()["status"])
+        # nothing is left to change the second time
+        response = self.client.put(f"{BASE_URL}/bulk/activate", json={"ids": ids})
+        self.assertEqual(response.get_json()["count"], 0)
+
+    def test_deactivate_promotions_in_bulk_by_filter(self):
+        """It should Deactivate the Promotions that match the filters"""
+        promotions = self._create_promotions(10)
+        test_product_id = promotions[0].product_id
+        count = len(
+            [
+                promotion
+                for promotion in promotions
+                if promotion.product_id == test_product_id and promotion.status
+            ]
+        )
+        response = self.client.put(
+            f"{BASE_URL}/bulk/deactivate", query_string=f"product_id={test_product_id}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["count"], count)
+        response = self.client.get(BASE_URL, query_string=f"product_id={test_product_id}")
+        for promotion in response.get_json():
+            self.assertFalse(promotion["status"])
+
+    def test_delete_promotions_in_bulk(self):
+        """It should Delete the Promotions with the given ids that match the filters"""
+        promotions = self._create_promotions(5)
+        ids = [int(promotion.id) for promotion in promotions]
+        response = self.client.delete(
+            f"{BASE_URL}/bulk", json={"ids": ids[:2]}, query_string="status=true"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        count = len([promotion for promotion in promotions[:2] if promotion.status])
+        self.assertEqual(response.get_json()["count"], count)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 5 - count)
+
+    def test_bulk_actions_need_a_selection(self):
+        """It should not change Promotions in bulk without ids or filters"""
+        self._create_promotions(2)
+        response = self.client.delete(f"{BASE_URL}/bulk")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(f"{BASE_URL}/bulk/activate", json={"ids": "all"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete(f"{BASE_URL}/bulk", json={"ids": [True, False]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 2)
+
     def test_activate_promotion_not_found(self):
         """It should not Activate a Promotion thats not found"""
         response = self.client.put(f"{BASE_URL}/0/activate")
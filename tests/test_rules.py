@@ -0,0 +1,113 @@
+"""
+Test cases for the Promotion rules
+"""
+from datetime import date
+from unittest import TestCase
+from service.models import DataValidationError
+from service.rules import (
+    AmountOff,
+    PercentOff,
+    BuyXGetY,
+    CartLine,
+    compile_rule,
+    parse_cart,
+    evaluate,
+)
+
+
+######################################################################
+#  R U L E   T E S T   C A S E S
+######################################################################
+class TestRules(TestCase):
+    """Test Cases for compiling and evaluating rules"""
+
+    def test_compile_amount_discount(self):
+        """It should compile amount discounts"""
+        for rule in ["30 off", "$30 off", "30$ off", " 30 DISCOUNT "]:
+            compiled = compile_rule("AMOUNT_DISCOUNT", rule)
+            self.assertIsInstance(compiled, AmountOff)
+            self.assertEqual(compiled(2, 100), 30)
+            self.assertEqual(compiled(1, 10), 10)
+        self.assertEqual(compile_rule("AMOUNT_DISCOUNT", "2.5 off each")(4, 10), 10)
+
+    def test_compile_percentage_discount(self):
+        """It should compile percentage discounts"""
+        compiled = compile_rule("PERCENTAGE_DISCOUNT", "20% off")
+        self.assertIsInstance(compiled, PercentOff)
+        self.assertAlmostEqual(compiled(3, 10), 6)
+        self.assertIsNone(compile_rule("PERCENTAGE_DISCOUNT", "120% off"))
+
+    def test_compile_bxgy(self):
+        """It should compile buy x get y rules"""
+        compiled = compile_rule("BXGY", "Buy 2 get 1 free")
+        self.assertIsInstance(compiled, BuyXGetY)
+        self.assertEqual(compiled(2, 5), 0)
+        self.assertEqual(compiled(3, 5), 5)
+        self.assertEqual(compiled(7, 5), 10)
+        self.assertIsNone(compile_rule("BXGY", "buy 0 get 1"))
+
+    def test_compile_invalid_rules(self):
+        """It should not compile rules that do not follow the grammar of their type"""
+        self.assertIsNone(compile_rule("AMOUNT_DISCOUNT", "20% off"))
+        self.assertIsNone(compile_rule("BXGY", "30 off"))
+        self.assertIsNone(compile_rule("UNKNOWN", "30 off"))
+
+    def test_rules_are_cached(self):
+        """It should compile each rule only once"""
+        compile_rule.cache_clear()
+        first = compile_rule("PERCENTAGE_DISCOUNT", "15% off")
+        self.assertIs(compile_rule("PERCENTAGE_DISCOUNT", "15% off"), first)
+        info = compile_rule.cache_info()  # pylint: disable=no-value-for-parameter
+        self.assertEqual(info.hits, 1)
+
+    def test_parse_cart(self):
+        """It should parse a posted cart"""
+        lines, on_date = parse_cart(
+            {"items": [{"product_id": 1, "quantity": 2, "unit_price": 3}], "on_date": "2024-03-10"}
+        )
+        self.assertEqual(lines, [CartLine(1, 2, 3.0)])
+        self.assertEqual(on_date, date(2024, 3, 10))
+        self.assertEqual(parse_cart({"items": []}), ([], None))
+
+    def test_parse_bad_carts(self):
+        """It should not parse carts that are not valid"""
+        line = {"product_id": 1, "quantity": 2, "unit_price": 3}
+        for cart in [
+            [],
+            {"items": {}},
+            {"items": [line], "on_date": "soon"},
+            {"items": [{"product_id": 1}]},
+            {"items": ["line"]},
+            {"items": [{**line, "product_id": "1"}]},
+            {"items": [{**line, "quantity": 0}]},
+            {"items": [{**line, "quantity": True}]},
+            {"items": [{**line, "unit_price": -1}]},
+            {"items": [{**line, "unit_price": float("inf")}]},
+            {"items": [{**line, "unit_price": float("nan")}]},
+            {"items": [{**line, "unit_price": 10**400}]},
+            {"items": [{**line, "quantity": 10**400}]},
+            {"items": [{**line, "quantity": 10**400, "unit_price": 0}]},
+            {"items": [{**line, "unit_price": 1.7e308}]},
+            {"items": [{**line, "quantity": 10**300, "unit_price": 10**10}]},
+            {"items": [{**line, "quantity": 1, "unit_price": 1e306}] * 2},
+        ]:
+            self.assertRaises(DataValidationError, parse_cart, cart)
+
+    def test_evaluate(self):
+        """It should return the discount of every matching Promotion of every line"""
+        lines = [CartLine(1, 3, 10.0), CartLine(2, 1, 5.0), CartLine(3, 1, 5.0)]
+        promotions = {
+            1: [
+                {"id": 10, "promotion_type": "PERCENTAGE_DISCOUNT", "rule": "10% off"},
+                {"id": 11, "promotion_type": "BXGY", "rule": "buy 2 get 1"},
+                {"id": 12, "promotion_type": "BXGY", "rule": "free stuff"},
+            ],
+            2: [{"id": 13, "promotion_type": "BXGY", "rule": "buy 1 get 1"}],
+        }
+        self.assertEqual(
+            evaluate(lines, promotions),
+            [
+                {"line": 0, "product_id": 1, "promotion_id": 10, "discount": 3.0},
+                {"line": 0, "product_id": 1, "promotion_id": 11, "discount": 10.0},
+            ],
+        )
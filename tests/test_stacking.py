@@ -0,0 +1,166 @@
+"""
+Test cases for the Promotion stacking optimizer
+"""
+import time
+import random
+from itertools import count, product
+from unittest import TestCase
+from unittest.mock import patch
+from service.rules import CartLine
+from service.stacking import line_options, optimize, _greedy, _OutOfTime
+
+PROMOTIONS = {
+    1: [
+        {"id": 1, "promotion_type": "AMOUNT_DISCOUNT", "rule": "$20 off"},
+        {"id": 2, "promotion_type": "PERCENTAGE_DISCOUNT", "rule": "10% off"},
+        {"id": 3, "promotion_type": "BXGY", "rule": "buy 1 get 1"},
+    ],
+}
+
+RULES = [
+    ("AMOUNT_DISCOUNT", "$20 off"),
+    ("AMOUNT_DISCOUNT", "$7.5 off"),
+    ("AMOUNT_DISCOUNT", "$2 off each"),
+    ("PERCENTAGE_DISCOUNT", "10% off"),
+    ("PERCENTAGE_DISCOUNT", "35% off"),
+    ("BXGY", "buy 2 get 1"),
+    ("BXGY", "buy 1 get 1"),
+    ("UNKNOWN", "5 off"),
+]
+
+
+def brute_force(lines, promotions) -> float:
+    """Returns the best total discount by trying every combination of options"""
+    best = 0.0
+    for combination in product(*(line_options(line, promotions.get(line.product_id, [])) for line in lines)):
+        coupons = [coupon for option in combination for coupon in option.coupons]
+        if len(coupons) == len(set(coupons)):
+            best = max(best, sum(option.value for option in combination))
+    return round(best, 2)
+
+
+######################################################################
+#  S T A C K I N G   T E S T   C A S E S
+######################################################################
+class TestStacking(TestCase):
+    """Test Cases for the stacking optimizer"""
+
+    def test_line_options(self):
+        """It should stack one Promotion of each type in order on a line"""
+        options = line_options(CartLine(1, 4, 10.0), PROMOTIONS[1])
+        self.assertEqual(len(options), 8)
+        # 20 free, then 20 off the 20 left to pay, then nothing is left
+        self.assertEqual(options[0].value, 40.0)
+        self.assertEqual(options[0].discounts, ((3, 20.0), (1, 20.0)))
+        self.assertEqual(options[0].coupons, {1})
+        self.assertIn(((3, 20.0), (2, 2.0)), [option.discounts for option in options])
+        self.assertEqual(options[-1].value, 0.0)
+
+    def test_line_options_skip_rules_without_discount(self):
+        """It should leave out the Promotions that give a line nothing"""
+        promotions = [
+            {"id": 4, "promotion_type": "BXGY", "rule": "buy 2 get 1"},
+            {"id": 5, "promotion_type": "UNKNOWN", "rule": "5 off"},
+        ]
+        options = line_options(CartLine(1, 2, 10.0), promotions)
+        self.assertEqual([option.discounts for option in options], [()])
+
+    def test_optimize_beats_greedy(self):
+        """It should give the coupon to the line where it saves the most"""
+        lines = [CartLine(1, 2, 15.0), CartLine(1, 1, 25.0)]
+        plan = optimize(lines, PROMOTIONS, budget=1.0)
+        self.assertTrue(plan.optimal)
+        self.assertEqual(plan.total, 37.0)
+        self.assertEqual(
+            plan.discounts,
+            [
+                {"line": 0, "product_id": 1, "promotion_id": 3, "discount": 15.0},
+                {"line": 0, "product_id": 1, "promotion_id": 2, "discount": 1.5},
+                {"line": 1, "product_id": 1, "promotion_id": 1, "discount": 20.0},
+                {"line": 1, "product_id": 1, "promotion_id": 2, "discount": 0.5},
+            ],
+        )
+
+    def test_optimize_out_of_time(self):
+        """It should choose line by line when the time budget runs out listing the options"""
+        lines = [CartLine(1, 2, 15.0), CartLine(1, 1, 25.0)]
+        clock = count(0, 10)
+        plan = optimize(lines, PROMOTIONS, budget=1.0, clock=lambda: next(clock))
+        self.assertFalse(plan.optimal)
+        self.assertEqual(plan.total, 32.5)
+        self.assertEqual([item["promotion_id"] for item in plan.discounts if item["line"] == 0], [3, 1])
+
+    def test_optimize_out_of_time_searching(self):
+        """It should fall back to the greedy choice when the search runs out of time"""
+        lines = [CartLine(1, 2, 15.0), CartLine(1, 1, 25.0)]
+        searching = []
+
+        def greedy(*args):
+            searching.append(True)
+            return _greedy(*args)
+
+        with patch("service.stacking._greedy", side_effect=greedy):
+            plan = optimize(lines, PROMOTIONS, budget=1.0, clock=lambda: 10.0 if searching else 0.0)
+        self.assertFalse(plan.optimal)
+        self.assertEqual(plan.total, 32.5)
+        self.assertRaises(_OutOfTime, line_options, lines[0], PROMOTIONS[1], lambda: True)
+
+    def test_optimize_a_large_cart_in_time(self):
+        """It should answer a cart with many lines and Promotions in about its time budget"""
+        promotions = {
+            1: [
+                {"id": by_id, "promotion_type": promotion_type, "rule": rule.format(by_id)}
+                for by_id, (promotion_type, rule) in enumerate(
+                    [("AMOUNT_DISCOUNT", "${} off")] * 10
+                    + [("PERCENTAGE_DISCOUNT", "{}% off")] * 10
+                    + [("BXGY", "buy {} get 1")] * 10,
+                    start=1,
+                )
+            ]
+        }
+        lines = [CartLine(1, 1 + position % 5, 10.0 + position / 100) for position in range(2000)]
+        start = time.perf_counter()
+        plan = optimize(lines, promotions, budget=0.05)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertFalse(plan.optimal)
+        coupons = [item["promotion_id"] for item in plan.discounts if item["promotion_id"] <= 10]
+        self.assertEqual(sorted(coupons), list(range(1, 11)))
+        self.assertAlmostEqual(plan.total, sum(item["discount"] for item in plan.discounts))
+
+    def test_optimize_without_coupons(self):
+        """It should take the best combination of every line"""
+        lines = [CartLine(2, 3, 10.0), CartLine(3, 1, 5.0)]
+        promotions = {
+            2: [
+                {"id": 6, "promotion_type": "PERCENTAGE_DISCOUNT", "rule": "10% off"},
+                {"id": 7, "promotion_type": "PERCENTAGE_DISCOUNT", "rule": "20% off"},
+            ]
+        }
+        plan = optimize(lines, promotions, budget=0.0)
+        self.assertEqual(plan, ([{"line": 0, "product_id": 2, "promotion_id": 7, "discount": 6.0}], 6.0, True))
+
+    def test_optimize_matches_brute_force(self):
+        """It should find the best total discount of random carts"""
+        generator = random.Random(11)
+        for _ in range(40):
+            promotions = {
+                product_id: [
+                    {"id": f"{product_id}-{by_id}", "promotion_type": promotion_type, "rule": rule}
+                    for by_id, (promotion_type, rule) in enumerate(generator.sample(RULES, 4))
+                ]
+                for product_id in range(3)
+            }
+            lines = [
+                CartLine(generator.randrange(3), generator.randrange(1, 5), generator.randrange(100, 3000) / 100)
+                for _ in range(generator.randrange(1, 6))
+            ]
+            plan = optimize(lines, promotions, budget=10.0)
+            self.assertTrue(plan.optimal)
+            self.assertAlmostEqual(plan.total, brute_force(lines, promotions))
+            coupons = [
+                item["promotion_id"] for item in plan.discounts
+                if any(promotion["id"] == item["promotion_id"] and promotion["rule"] in ("$20 off", "$7.5 off")
+                       for promotion in promotions[item["product_id"]])
+            ]
+            self.assertEqual(len(coupons), len(set(coupons)))
+            self.assertAlmostEqual(plan.total, sum(item["discount"] for item in plan.discounts))